@@ -0,0 +1,126 @@
+# -----------------------------------------------------------
+# Aggregate module
+# purpose: optional stage between the sensor and the
+# database interface that sums readings up per window
+# instead of logging every one. for each register it keeps
+# running min/max/mean/stddev/count (O(1) per reading) and
+# writes one model.Aggregate row to tbl_aggregate when the
+# window closes. the raw readings can still be passed on at
+# a decimation, or not at all.
+# -----------------------------------------------------------
+import model
+import stats
+
+class Window(object):
+    # the open window for one register of one device
+    __slots__ = ("series_id", "name", "start", "end", "stats", "raw_index")
+
+    def __init__(self, series_id, name):
+        self.series_id = series_id
+        self.name = name
+        self.start = None
+        self.end = None
+        self.stats = stats.RunningStats()
+        self.raw_index = 0
+    # end __init__()
+# end Window class
+
+class WindowAggregator(object):
+    """
+        WindowAggregator - windowed aggregation in front of a database
+        interface. It takes data objects through add_data, the same
+        as db.Interface, so it can be handed to the sensor as its
+        db_interface.
+        Constructor:
+            db_interface - where the aggregates, series and any raw
+                           readings are passed on to
+            window_size - close a window after this many readings
+            window_seconds - or once the reading timestamps are this
+                             many seconds past the start of the window
+            raw_decimation - also pass on every nth raw reading,
+                             0 passes on none of them
+            names - register names that get aggregated, readings of
+                    any other register are passed on untouched
+    """
+    def __init__(self, db_interface, window_size=None, window_seconds=None,
+                 raw_decimation=0, names=("object",)):
+        super(WindowAggregator, self).__init__()
+        if window_size is None and window_seconds is None:
+            raise ValueError("a window needs a size or a length in seconds")
+        # end if
+
+        self.db_interface = db_interface
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.raw_decimation = raw_decimation
+        self.names = names
+
+        # (device address, data address) -> open Window
+        self.windows = {}
+
+        # counters
+        self.readings = 0
+        self.aggregates = 0
+    # end __init__()
+
+    def add_data(self, data_object):
+        if type(data_object) is not model.Reading or data_object.name not in self.names:
+            self.db_interface.add_data(data_object)
+            return
+        # end if
+        self.readings = self.readings + 1
+
+        key = (data_object.device_address, data_object.data_address)
+        window = self.windows.get(key)
+
+        # a new series for the device closes its old window
+        if window is not None and window.series_id != data_object.series_id:
+            self.__emit__(key, window)
+            window = None
+        # end if
+
+        # a time window closes when a reading falls past its end
+        timestamp = data_object.timestamp
+        if window is not None and self.window_seconds is not None and \
+                timestamp is not None and timestamp - window.start >= self.window_seconds:
+            self.__emit__(key, window)
+            window = None
+        # end if
+
+        if window is None:
+            window = self.windows[key] = Window(data_object.series_id, data_object.name)
+            window.start = timestamp
+        # end if
+
+        window.stats.add(data_object.get_value())
+        window.end = timestamp
+
+        if self.raw_decimation > 0:
+            if window.raw_index == 0:
+                self.db_interface.add_data(data_object)
+            # end if
+            window.raw_index = (window.raw_index + 1) % self.raw_decimation
+        # end if
+
+        if self.window_size is not None and window.stats.count >= self.window_size:
+            self.__emit__(key, window)
+        # end if
+    # end add_data()
+
+    def flush(self):
+        # closes every open window, call at the end of a run so
+        # the last partial windows get logged
+        for key, window in list(self.windows.items()):
+            self.__emit__(key, window)
+        # end for
+    # end flush()
+
+    def __emit__(self, key, window):
+        del self.windows[key]
+        self.aggregates = self.aggregates + 1
+        self.db_interface.add_data(model.Aggregate(
+            window.series_id, window.name, key[0], key[1], window.start,
+            window.end, window.stats.count, window.stats.minimum,
+            window.stats.maximum, window.stats.mean, window.stats.get_stddev()))
+    # end __emit__()
+# end WindowAggregator class
@@ -0,0 +1,173 @@
+# -----------------------------------------------------------
+# asyncio module
+# purpose: runs acquisition and database logging on one
+# event loop. sensors are read through Sensor.stream(), an
+# async generator that does the bus transfer in an executor,
+# and AsyncSink collects what the streams yield into
+# batches and writes them with Interface.write_batch, also
+# in an executor. any number of sensors and sinks can run
+# side by side on the same loop.
+# -----------------------------------------------------------
+import asyncio
+import model
+
+class AsyncSink(object):
+    """
+        AsyncSink - batches data objects into the database
+        Constructor:
+            db_interface - anything with a write_batch(list) method,
+                           normally db.Interface
+            batch_size - most objects written per batch
+            flush_interval - longest time in seconds an object waits
+                             before its batch is written
+            max_queue - objects held before put() makes the producer
+                        wait
+            executor - executor the batch writes run in, None for the
+                       loop's default one
+            max_retries - times a failed batch write is tried again
+            retry_interval - seconds before the first retry, doubled
+                             each time
+
+        A batch that still has not been written after the retries is
+        handed to db_interface.add_data, so db.Interface queues it
+        (and spools it, if it has a spool) like any other data. It
+        is only counted as failed if there is no add_data.
+
+        The series a reading belongs to is written the first time
+        one of its readings comes through, so a stream only has to
+        yield readings.
+
+        Methods:
+            put - queues one data object
+            consume - queues everything an async iterator yields
+            run - the writer coroutine, start it as a task
+            close - writes what is left and stops run()
+    """
+    def __init__(self, db_interface, batch_size=100, flush_interval=0.5,
+                 max_queue=10000, executor=None, max_retries=3, retry_interval=0.5):
+        super(AsyncSink, self).__init__()
+        self.db_interface = db_interface
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.executor = executor
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.queue = asyncio.Queue(max_queue)
+
+        # series ids that have already been written
+        self.__series_seen__ = set()
+
+        # marks the end of the queue for run()
+        self.__closed__ = object()
+
+        # counters
+        self.written = 0
+        self.retries = 0
+        self.handed_off = 0
+        self.failed = 0
+    # end __init__()
+
+    async def put(self, data_object):
+        if type(data_object) is model.Reading and \
+                data_object.series_id not in self.__series_seen__:
+            self.__series_seen__.add(data_object.series_id)
+            await self.queue.put(model.Series(data_object.series_id))
+        elif type(data_object) is model.Series:
+            self.__series_seen__.add(data_object.get_id())
+        # end if
+        await self.queue.put(data_object)
+    # end put()
+
+    async def consume(self, stream):
+        async for data_object in stream:
+            await self.put(data_object)
+        # end for
+    # end consume()
+
+    async def run(self):
+        # waits for the first object of a batch, then keeps
+        # taking objects until the batch is full or the flush
+        # interval is up, and writes the batch
+        loop = asyncio.get_running_loop()
+        closed = False
+        while not closed:
+            data_object = await self.queue.get()
+            if data_object is self.__closed__:
+                break
+            # end if
+            batch = [data_object]
+            deadline = loop.time() + self.flush_interval
+
+            while batch.__len__() < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                # end if
+                try:
+                    data_object = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                # end try
+                if data_object is self.__closed__:
+                    closed = True
+                    break
+                # end if
+                batch.append(data_object)
+            # end while
+
+            await self.__write__(batch)
+        # end while
+    # end run()
+
+    async def __write__(self, batch):
+        # writes a batch, trying again after a wait if it fails.
+        # the next batch is held up meanwhile, the producers
+        # carry on until the queue is full.
+        loop = asyncio.get_running_loop()
+        delay = self.retry_interval
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.retries = self.retries + 1
+                await asyncio.sleep(delay)
+                delay = delay * 2
+            # end if
+            if await loop.run_in_executor(self.executor, self.db_interface.write_batch, batch):
+                self.written = self.written + batch.__len__()
+                return
+            # end if
+        # end for
+
+        print("ERROR: failed to write batch of %s records" % batch.__len__())
+        add_data = getattr(self.db_interface, "add_data", None)
+        if add_data is None:
+            self.failed = self.failed + batch.__len__()
+            return
+        # end if
+        for data_object in batch:
+            add_data(data_object)
+        # end for
+        self.handed_off = self.handed_off + batch.__len__()
+    # end __write__()
+
+    async def close(self):
+        await self.queue.put(self.__closed__)
+    # end close()
+# end AsyncSink class
+
+async def log_sensors(sensors, db_interface, sample_rate=0.25,
+                      reading_count=None, **sink_options):
+    # streams every sensor at the sample rate into one sink
+    # until each has taken reading_count readings. the sensors
+    # should be made without a db_interface, the sink does the
+    # logging. returns the sink so its counters can be read.
+    # batches that could not be written are left with
+    # db_interface.add_data, so close the interface (or flush
+    # it) afterwards as usual.
+    sink = AsyncSink(db_interface, **sink_options)
+    writer = asyncio.ensure_future(sink.run())
+    await asyncio.gather(*[sink.consume(sensor.stream(sample_rate, reading_count))
+                           for sensor in sensors])
+    await sink.close()
+    await writer
+    return sink
+# end log_sensors()
@@ -0,0 +1,395 @@
+# -----------------------------------------------------------
+# Analysis module
+# purpose: offline number crunching on captured readings
+# with numpy, a whole column at a time, without making a
+# model.Reading for every sample. a Capture holds the raw
+# columns and can come from
+#
+#   a model.ReadingBatch        from_reading_batch(batch)
+#   a reading_log.Reader        from_log(reader)
+#   a db.Interface query        from_rows(db_interface.fetch_series(id),
+#                                         db_interface.schema)
+#
+# and the functions below work on plain numpy arrays:
+# unit conversions, the MLX90614 error flag, rolling
+# statistics, resampling onto a fixed period and threshold
+# crossings. temperature words with the error flag set
+# convert to nan, and the statistics skip nans.
+#
+#     capture = analysis.from_log(reading_log.Reader("readings.bin"))
+#     objects = capture.select(data_address=0x7)
+#     times, means, counts = analysis.resample(objects.timestamp,
+#                                              objects.celcius(), 1.0)
+# -----------------------------------------------------------
+import itertools
+import numpy
+import model
+
+# MLX90614 error flag, bit 15 of a temperature word
+ERROR_FLAG = 0x8000
+
+# register conversions, from the model
+KELVIN_PER_COUNT = model.MLX90614_REGISTERS[0x7][1]
+EMISSIVITY_PER_COUNT = model.MLX90614_REGISTERS[0x24][1]
+
+# columns of a capture
+COLUMNS = ("timestamp", "series_id", "device_address", "data_address", "raw_value", "ttr")
+
+def error_mask(raw):
+    # True for the words with the error flag set
+    return (numpy.asarray(raw, dtype=numpy.uint16) & ERROR_FLAG) != 0
+# end error_mask()
+
+def raw_to_kelvin(raw, conversion=KELVIN_PER_COUNT):
+    # temperature words to kelvin, nan where the error flag
+    # is set
+    raw = numpy.asarray(raw, dtype=numpy.uint16)
+    kelvin = raw * conversion
+    kelvin[(raw & ERROR_FLAG) != 0] = numpy.nan
+    return kelvin
+# end raw_to_kelvin()
+
+def kelvin_to_celcius(kelvin):
+    return numpy.asarray(kelvin, dtype=numpy.float64) - 273.15
+# end kelvin_to_celcius()
+
+def kelvin_to_fahrenheit(kelvin):
+    return (numpy.asarray(kelvin, dtype=numpy.float64) - 273.15) * 9.0 / 5.0 + 32.0
+# end kelvin_to_fahrenheit()
+
+def raw_to_emissivity(raw, conversion=EMISSIVITY_PER_COUNT):
+    return numpy.asarray(raw, dtype=numpy.uint16) * conversion
+# end raw_to_emissivity()
+
+def kelvin_to_raw(kelvin, conversion=KELVIN_PER_COUNT):
+    # back to the sensor word, for data that only kept kelvin
+    # (the classic tables). the classic tables store an error
+    # word as it came, 655.36 K and up, so the full 16 bits are
+    # kept and bit 15 still flags it. nan becomes an error word.
+    kelvin = numpy.asarray(kelvin, dtype=numpy.float64)
+    raw = numpy.rint(numpy.nan_to_num(kelvin, nan=0.0) / conversion)
+    raw = numpy.clip(raw, 0, 0xffff).astype(numpy.uint16)
+    raw[numpy.isnan(kelvin)] = ERROR_FLAG
+    return raw
+# end kelvin_to_raw()
+
+def __window_sums__(values, window):
+    # sums of the valid values, their squares and how many
+    # there are over each window of the given length, from
+    # cumulative sums. the first window - 1 values have no
+    # full window and come out as nan.
+    values = numpy.asarray(values, dtype=numpy.float64)
+    valid = ~numpy.isnan(values)
+    clean = numpy.where(valid, values, 0.0)
+
+    def window_sum(column):
+        total = numpy.concatenate(([0.0], numpy.cumsum(column)))
+        sums = numpy.full(values.__len__(), numpy.nan)
+        if values.__len__() >= window:
+            sums[window - 1:] = total[window:] - total[:-window]
+        # end if
+        return sums
+    # end window_sum()
+
+    return window_sum(clean), window_sum(clean * clean), window_sum(valid.astype(numpy.float64))
+# end __window_sums__()
+
+def rolling_mean(values, window):
+    # mean of each value and the window - 1 before it
+    sums, _, counts = __window_sums__(values, window)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return numpy.where(counts > 0, sums / counts, numpy.nan)
+    # end with
+# end rolling_mean()
+
+def rolling_std(values, window):
+    # sample standard deviation over each window. the sums
+    # are taken around the overall mean so they stay accurate
+    # for temperatures far from zero.
+    values = numpy.asarray(values, dtype=numpy.float64)
+    offset = numpy.nanmean(values) if numpy.any(~numpy.isnan(values)) else 0.0
+    sums, squares, counts = __window_sums__(values - offset, window)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        variance = (squares - sums * sums / counts) / (counts - 1)
+        return numpy.where(counts > 1, numpy.sqrt(numpy.maximum(variance, 0.0)), numpy.nan)
+    # end with
+# end rolling_std()
+
+def __sliding__(values, window):
+    # windows as a strided view, no copy
+    values = numpy.asarray(values, dtype=numpy.float64)
+    result = numpy.full(values.__len__(), numpy.nan)
+    if values.__len__() < window:
+        return result, None
+    # end if
+    return result, numpy.lib.stride_tricks.sliding_window_view(values, window)
+# end __sliding__()
+
+def rolling_min(values, window):
+    result, windows = __sliding__(values, window)
+    if windows is not None:
+        with numpy.errstate(invalid="ignore"):
+            result[window - 1:] = numpy.fmin.reduce(windows, axis=1)
+        # end with
+    # end if
+    return result
+# end rolling_min()
+
+def rolling_max(values, window):
+    result, windows = __sliding__(values, window)
+    if windows is not None:
+        with numpy.errstate(invalid="ignore"):
+            result[window - 1:] = numpy.fmax.reduce(windows, axis=1)
+        # end with
+    # end if
+    return result
+# end rolling_max()
+
+def resample(timestamps, values, period, how="mean", start=None):
+    # puts the values into bins period seconds wide from start
+    # (the first timestamp by default) and reduces each bin
+    # with mean, min, max or last. returns the bin start times,
+    # the reduced values and the number of valid values in each
+    # bin. empty bins are left out. timestamps have to go up.
+    timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    keep = ~numpy.isnan(values)
+    timestamps = timestamps[keep]
+    values = values[keep]
+    if timestamps.__len__() == 0:
+        empty = numpy.empty(0)
+        return empty, empty, numpy.empty(0, dtype=numpy.int64)
+    # end if
+    if start is None:
+        start = timestamps[0]
+    # end if
+
+    bins = numpy.floor((timestamps - start) / period).astype(numpy.int64)
+    edges = numpy.flatnonzero(numpy.diff(bins)) + 1
+    firsts = numpy.concatenate(([0], edges))
+    counts = numpy.diff(numpy.concatenate((firsts, [values.__len__()])))
+    if how == "mean":
+        reduced = numpy.add.reduceat(values, firsts) / counts
+    elif how == "min":
+        reduced = numpy.minimum.reduceat(values, firsts)
+    elif how == "max":
+        reduced = numpy.maximum.reduceat(values, firsts)
+    elif how == "last":
+        reduced = values[firsts + counts - 1]
+    else:
+        raise ValueError("unknown resample reduction %s" % how)
+    # end if
+    return start + bins[firsts] * period, reduced, counts
+# end resample()
+
+def threshold_crossings(timestamps, values, threshold, hysteresis=0.0, direction=None):
+    # where the values cross the threshold. with hysteresis a
+    # crossing only counts once the values get hysteresis past
+    # the threshold on the other side, so noise sitting on the
+    # threshold is not a string of crossings. direction 1 keeps
+    # the rising crossings, -1 the falling ones, None both.
+    # returns the index of the sample each crossing was seen at,
+    # the direction of each, and the time the values went
+    # through the threshold (linear between that sample and the
+    # one before it).
+    timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+
+    # +1 above the band, -1 below it, 0 inside it or nan. the
+    # zeros take the state of the last sample outside the band.
+    state = numpy.zeros(values.__len__(), dtype=numpy.int8)
+    with numpy.errstate(invalid="ignore"):
+        state[values >= threshold + hysteresis] = 1
+        state[values < threshold - hysteresis] = -1
+    # end with
+    known = numpy.flatnonzero(state)
+    if known.__len__() < 2:
+        empty = numpy.empty(0, dtype=numpy.int64)
+        return empty, empty.astype(numpy.int8), numpy.empty(0)
+    # end if
+    states = state[known]
+    changes = numpy.flatnonzero(numpy.diff(states)) + 1
+    indexes = known[changes]
+    directions = states[changes]
+    if direction is not None:
+        keep = directions == direction
+        indexes = indexes[keep]
+        directions = directions[keep]
+    # end if
+
+    # interpolated time through the threshold itself
+    before = numpy.maximum(indexes - 1, 0)
+    v0 = values[before]
+    v1 = values[indexes]
+    t0 = timestamps[before]
+    t1 = timestamps[indexes]
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        fraction = numpy.clip((threshold - v0) / (v1 - v0), 0.0, 1.0)
+    # end with
+    fraction = numpy.where(numpy.isfinite(fraction), fraction, 1.0)
+    return indexes, directions, t0 + (t1 - t0) * fraction
+# end threshold_crossings()
+
+def summarize(values):
+    # count, errors (nans), min, max, mean and stddev of a column
+    values = numpy.asarray(values, dtype=numpy.float64)
+    valid = values[~numpy.isnan(values)]
+    if valid.__len__() == 0:
+        return {"count": 0, "errors": int(values.__len__()), "minimum": None,
+                "maximum": None, "mean": None, "stddev": None}
+    # end if
+    return {"count": int(valid.__len__()), "errors": int(values.__len__() - valid.__len__()),
+            "minimum": float(valid.min()), "maximum": float(valid.max()),
+            "mean": float(valid.mean()),
+            "stddev": float(valid.std(ddof=1)) if valid.__len__() > 1 else 0.0}
+# end summarize()
+
+class Capture(object):
+    """
+        Capture - readings as numpy columns
+        timestamp, series_id, device_address, data_address,
+        raw_value and ttr are arrays of the same length. They are
+        views onto the source where it allows (a reading log or a
+        ReadingBatch), so a capture of millions of samples costs
+        nothing to make.
+
+        Methods:
+            select - the rows of one register and/or device
+            kelvin, celcius, fahrenheit - temperatures, nan on errors
+            emissivity - emissivity values
+            errors - mask of the words with the error flag set
+    """
+
+    __slots__ = COLUMNS
+
+    def __init__(self, timestamp, series_id, device_address, data_address,
+                 raw_value, ttr):
+        self.timestamp = timestamp
+        self.series_id = series_id
+        self.device_address = device_address
+        self.data_address = data_address
+        self.raw_value = raw_value
+        self.ttr = ttr
+    # end __init__()
+
+    def __len__(self):
+        return self.raw_value.__len__()
+    # end __len__()
+
+    def select(self, data_address=None, device_address=None, series_id=None):
+        mask = numpy.ones(self.__len__(), dtype=bool)
+        if data_address is not None:
+            mask &= self.data_address == data_address
+        # end if
+        if device_address is not None:
+            mask &= self.device_address == device_address
+        # end if
+        if series_id is not None:
+            mask &= self.series_id == series_id
+        # end if
+        return Capture(*[getattr(self, column)[mask] for column in COLUMNS])
+    # end select()
+
+    def errors(self):
+        return error_mask(self.raw_value)
+    # end errors()
+
+    def kelvin(self, conversion=KELVIN_PER_COUNT):
+        return raw_to_kelvin(self.raw_value, conversion)
+    # end kelvin()
+
+    def celcius(self):
+        return kelvin_to_celcius(self.kelvin())
+    # end celcius()
+
+    def fahrenheit(self):
+        return kelvin_to_fahrenheit(self.kelvin())
+    # end fahrenheit()
+
+    def emissivity(self, conversion=EMISSIVITY_PER_COUNT):
+        return raw_to_emissivity(self.raw_value, conversion)
+    # end emissivity()
+# end Capture class
+
+def from_reading_batch(batch):
+    # views onto the typed arrays of a model.ReadingBatch
+    count = batch.__len__()
+    return Capture(numpy.frombuffer(batch.timestamps, dtype=numpy.float64, count=count),
+                   numpy.full(count, batch.series_id, dtype=numpy.float64),
+                   numpy.frombuffer(batch.device_addresses, dtype=numpy.uint8, count=count),
+                   numpy.frombuffer(batch.data_addresses, dtype=numpy.uint8, count=count),
+                   numpy.frombuffer(batch.raw_values, dtype=numpy.uint16, count=count),
+                   numpy.frombuffer(batch.ttrs, dtype=numpy.float64, count=count))
+# end from_reading_batch()
+
+def from_log(reader, series_id=None, start=None, end=None):
+    # a reading_log.Reader, all of it, one series, or the
+    # readings from start up to end. the columns are views
+    # onto the memory map.
+    if series_id is not None:
+        records = reader.series(series_id)
+    elif start is not None or end is not None:
+        records = reader.time_range(-numpy.inf if start is None else start,
+                                    numpy.inf if end is None else end)
+    else:
+        records = reader.array()
+    # end if
+    return Capture(*[records[column] for column in COLUMNS])
+# end from_log()
+
+def from_rows(rows, schema="compact", chunk_size=100000):
+    # rows streamed from db.Interface.fetch_series,
+    # fetch_time_range or fetch_device, built up a chunk at a
+    # time. compact rows carry the raw word and the time. the
+    # classic tables have neither, so the raw word is worked
+    # back out of kelvin or the emissivity and the timestamps
+    # are nan.
+    if schema == "compact":
+        dtype = [("timestamp", "f8"), ("series_id", "f8"), ("device_address", "u1"),
+                 ("data_address", "u1"), ("raw_value", "u2"), ("ttr", "f8")]
+        records = ((row[1] / 1e6, row[0], row[2], row[3], row[4],
+                    numpy.nan if row[6] is None else row[6]) for row in rows)
+    else:
+        dtype = [("series_id", "f8"), ("device_address", "u1"), ("data_address", "u1"),
+                 ("ttr", "f8"), ("kelvin", "f8"), ("emissivity", "f8")]
+        records = ((row[1], row[3], row[4],
+                    numpy.nan if row[5] is None else row[5],
+                    numpy.nan if row[6] is None else row[6],
+                    numpy.nan if row[7] is None else row[7]) for row in rows)
+    # end if
+
+    chunks = []
+    while True:
+        chunk = numpy.fromiter(itertools.islice(records, chunk_size), dtype=dtype)
+        if chunk.__len__() > 0:
+            chunks.append(chunk)
+        # end if
+        if chunk.__len__() < chunk_size:
+            break
+        # end if
+    # end while
+    data = numpy.concatenate(chunks) if chunks else numpy.empty(0, dtype=dtype)
+
+    if schema == "compact":
+        return Capture(*[data[column] for column in COLUMNS])
+    # end if
+    raw_value = kelvin_to_raw(data["kelvin"])
+    emissivity = ~numpy.isnan(data["emissivity"])
+    raw_value[emissivity] = numpy.rint(data["emissivity"][emissivity] / EMISSIVITY_PER_COUNT).astype(numpy.uint16)
+    return Capture(numpy.full(data.__len__(), numpy.nan), data["series_id"],
+                   data["device_address"], data["data_address"], raw_value, data["ttr"])
+# end from_rows()
+
+if __name__ == '__main__':
+
+    # self check: error words read back from the classic tables
+    # (kelvin = word * 0.02) are still flagged
+    words = numpy.array([15000, ERROR_FLAG | 0, ERROR_FLAG | 15000, 0xffff], dtype=numpy.uint16)
+    rows = [(index, 1.0, "object", 0x5a, 0x7, 0.001, float(word) * KELVIN_PER_COUNT, None)
+            for index, word in enumerate(words)]
+    capture = from_rows(rows, "classic")
+    assert list(capture.raw_value) == list(words), capture.raw_value
+    assert list(capture.errors()) == [False, True, True, True], capture.errors()
+    assert numpy.isnan(capture.kelvin()[1:]).all()
+    print("analysis self check passed")
+# end main
@@ -0,0 +1,269 @@
+# -----------------------------------------------------------
+# Benchmark
+# purpose: measures how many readings per second the whole
+# chain sustains, from the sensor through the ingest queue
+# to the database writer. the sensor reads from a
+# sim_bus.SimulatedBus and the interface writes either to
+# an in-memory mock connection or to a local mysql server,
+# for every combination of batch size and sample rate given.
+#
+# for each run it reports samples/s, inserted rows/s, queue
+# depth and drain time, peak memory and ttr / batch write
+# latency percentiles, and writes them all to a json file
+# so runs can be compared over time. every run goes in a
+# process of its own, so its peak memory is its own.
+#
+# TO RUN:   python3 benchmark.py --batch-sizes 1,10,100,1000
+#                                --sample-rates 0,0.001
+#                                --readings 5000
+# -----------------------------------------------------------
+import argparse
+import concurrent.futures
+import json
+import platform
+import resource
+import threading
+import time
+import tracemalloc
+import db
+import i2c_sensor
+import sim_bus
+
+class MockCursor(object):
+    # db-api cursor that only counts rows. it knows the two
+    # statements the interface reads back from.
+    def __init__(self, connection):
+        super(MockCursor, self).__init__()
+        self.connection = connection
+        self.rows = []
+    # end __init__()
+
+    def execute(self, command_string, params=None):
+        self.rows = []
+        if command_string.startswith("UPDATE tbl_reading_sequence"):
+            self.connection.next_id = self.connection.next_id + params[0]
+        elif command_string == "SELECT LAST_INSERT_ID()":
+            self.rows = [(self.connection.next_id,)]
+        elif command_string.startswith("SELECT"):
+            self.rows = [(0,)]
+        # end if
+        self.connection.wait(self.connection.statement_latency)
+    # end execute()
+
+    def executemany(self, command_string, rows):
+        self.connection.rows = self.connection.rows + rows.__len__()
+        self.connection.wait(self.connection.statement_latency +
+                             self.connection.row_latency * rows.__len__())
+    # end executemany()
+
+    def fetchall(self):
+        return self.rows
+    # end fetchall()
+
+    def fetchmany(self, size):
+        rows = self.rows[:size]
+        self.rows = self.rows[size:]
+        return rows
+    # end fetchmany()
+
+    def close(self):
+        pass
+    # end close()
+# end MockCursor class
+
+class MockConnection(object):
+    """
+        MockConnection - stand-in for a mysql connection
+        Constructor:
+            statement_latency - seconds each statement takes, a stand
+                                in for the network round trip
+            row_latency - extra seconds per row inserted
+            commit_latency - seconds each commit takes
+    """
+    def __init__(self, statement_latency=0.0, row_latency=0.0, commit_latency=0.0):
+        super(MockConnection, self).__init__()
+        self.statement_latency = statement_latency
+        self.row_latency = row_latency
+        self.commit_latency = commit_latency
+        self.next_id = 0
+        self.rows = 0
+        self.commits = 0
+    # end __init__()
+
+    def cursor(self, **kwargs):
+        return MockCursor(self)
+    # end cursor()
+
+    def commit(self):
+        self.commits = self.commits + 1
+        self.wait(self.commit_latency)
+    # end commit()
+
+    def rollback(self):
+        pass
+    # end rollback()
+
+    def is_connected(self):
+        return True
+    # end is_connected()
+
+    def ping(self, **kwargs):
+        pass
+    # end ping()
+
+    def close(self):
+        pass
+    # end close()
+
+    def wait(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+        # end if
+    # end wait()
+# end MockConnection class
+
+def run_case(batch_size, sample_rate, reading_count, read_latency=0.0,
+             read_interval=0.0, statement_latency=0.0, row_latency=0.0,
+             commit_latency=0.0, mysql_config=None, trace_memory=False):
+    # runs one benchmark and returns its results as a dictionary
+    connector = None
+    if mysql_config is None:
+        connector = lambda **config: MockConnection(statement_latency, row_latency, commit_latency)
+    # end if
+    interface = db.Interface(mysql_config, batch_size=batch_size, connector=connector)
+
+    bus = sim_bus.SimulatedBus(latency=sim_bus.constant_latency(read_latency) if read_latency > 0 else None)
+    sensor = i2c_sensor.Sensor(address=0x5a, bus=bus, on_data=lambda reading: None,
+                               db_interface=interface)
+    sensor.read_interval = read_interval
+
+    # samples the queue depth while the run is going
+    depths = []
+    sampling = [True]
+    def sample_depth():
+        while sampling[0]:
+            depths.append(interface.data_queue.__len__())
+            time.sleep(0.01)
+        # end while
+    # end sample_depth()
+    monitor = threading.Thread(target=sample_depth)
+    monitor.start()
+
+    if trace_memory:
+        tracemalloc.start()
+    # end if
+
+    ts1 = time.perf_counter()
+    sensor.take_readings(reading_count=reading_count, sample_rate=sample_rate)
+    ts2 = time.perf_counter()
+
+    # wait for the writer to catch up
+    interface.flush()
+    ts3 = time.perf_counter()
+    interface.close()
+
+    peak_traced = None
+    if trace_memory:
+        peak_traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    # end if
+    sampling[0] = False
+    monitor.join()
+
+    acquisition_seconds = ts2 - ts1
+    total_seconds = ts3 - ts1
+    queue_stats = interface.data_queue.get_stats()
+    return {
+        "batch_size": batch_size,
+        "sample_rate": sample_rate,
+        "reading_count": reading_count,
+        "read_latency": read_latency,
+        "statement_latency": statement_latency,
+        "row_latency": row_latency,
+        "commit_latency": commit_latency,
+        "acquisition_seconds": acquisition_seconds,
+        "total_seconds": total_seconds,
+        "samples_per_second": reading_count / acquisition_seconds if acquisition_seconds > 0 else None,
+        "rows_per_second": interface.rows_written / total_seconds if total_seconds > 0 else None,
+        "rows_written": interface.rows_written,
+        "batches_written": interface.batches_written,
+        "queue_high_water": queue_stats["high_water"],
+        "queue_mean_depth": (sum(depths) / depths.__len__()) if depths else 0,
+        "queue_dropped": queue_stats["dropped"],
+        "queue_drain_seconds": ts3 - ts2,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_traced_bytes": peak_traced,
+        "ttr": sensor.get_ttr_stats("object"),
+        "batch_write": interface.write_latency.get_stats(),
+        "schedule": sensor.get_schedule_stats(),
+    }
+# end run_case()
+
+def run_case_isolated(*args, **kwargs):
+    # runs run_case in a process of its own. ru_maxrss is a high
+    # water mark for the whole process, so this is what makes
+    # peak_rss_kb that one case's peak instead of the highest of
+    # every case run so far.
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_case, *args, **kwargs).result()
+    # end with
+# end run_case_isolated()
+
+def parse_list(text, kind):
+    return [kind(value) for value in text.split(",") if value]
+# end parse_list()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="acquisition and db ingest benchmark")
+    parser.add_argument("--batch-sizes", default="1,10,100,1000",
+                        help="comma separated writer batch sizes")
+    parser.add_argument("--sample-rates", default="0",
+                        help="comma separated sample rates in seconds, 0 is as fast as possible")
+    parser.add_argument("--readings", type=int, default=5000,
+                        help="object readings per run")
+    parser.add_argument("--read-latency", type=float, default=0.0,
+                        help="simulated bus read latency in seconds")
+    parser.add_argument("--read-interval", type=float, default=0.0,
+                        help="sensor sleep after each read, the datasheet value is 0.00144")
+    parser.add_argument("--statement-latency", type=float, default=0.0,
+                        help="mock database seconds per statement")
+    parser.add_argument("--row-latency", type=float, default=0.0,
+                        help="mock database seconds per inserted row")
+    parser.add_argument("--commit-latency", type=float, default=0.0,
+                        help="mock database seconds per commit")
+    parser.add_argument("--mysql-config", default=None,
+                        help="mysql config file, writes to a real server instead of the mock")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="measure peak python allocations with tracemalloc (slow)")
+    parser.add_argument("--output", default="bench_results.json",
+                        help="json file the results are written to")
+    args = parser.parse_args()
+
+    results = []
+    for sample_rate in parse_list(args.sample_rates, float):
+        for batch_size in parse_list(args.batch_sizes, int):
+            result = run_case_isolated(batch_size, sample_rate, args.readings,
+                                       read_latency=args.read_latency,
+                                       read_interval=args.read_interval,
+                                       statement_latency=args.statement_latency,
+                                       row_latency=args.row_latency,
+                                       commit_latency=args.commit_latency,
+                                       mysql_config=args.mysql_config,
+                                       trace_memory=args.trace_memory)
+            results.append(result)
+            print("rate %-8s batch %-6s samples/s %10.1f    rows/s %10.1f    queue max %6s    drain %.3fs    ttr p99 %s    write p99 %s" %
+                  (sample_rate, batch_size, result["samples_per_second"], result["rows_per_second"],
+                   result["queue_high_water"], result["queue_drain_seconds"],
+                   result["ttr"]["p99"], result["batch_write"]["p99"]))
+        # end for
+    # end for
+
+    with open(args.output, "w") as handle:
+        handle.write(json.dumps({"timestamp": time.time(),
+                                 "python": platform.python_version(),
+                                 "machine": platform.machine(),
+                                 "results": results}, indent=2))
+    # end with
+    print("results written to %s" % args.output)
+# end main
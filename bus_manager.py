@@ -0,0 +1,163 @@
+# -----------------------------------------------------------
+# Bus manager module
+# purpose: polls several MLX90614 sensors from one process.
+# each i2c bus is opened once and shared by every device on
+# it behind a lock, and one loop works out which device is
+# due next from each device's own sample rate. every device
+# feeds the same database interface.
+# -----------------------------------------------------------
+import threading
+import i2c_sensor
+import scheduler
+
+class LockedBus(object):
+    """
+        LockedBus - shares one bus handle between devices
+        Every transfer holds the bus lock, so reads from different
+        threads never interleave on the wire.
+        Constructor:
+            bus - the smbus.SMBus (or fake) handle to wrap
+    """
+    def __init__(self, bus):
+        super(LockedBus, self).__init__()
+        self.bus = bus
+        self.lock = threading.Lock()
+    # end __init__()
+
+    def read_word_data(self, address, register):
+        with self.lock:
+            return self.bus.read_word_data(address, register)
+        # end with
+    # end read_word_data()
+# end LockedBus class
+
+class Device(object):
+    """
+        Device - one sensor managed by the bus manager
+        Holds the sensor along with its own sample rate, deadline
+        scheduler and how many readings it still has to take.
+    """
+    def __init__(self, sensor, sample_rate, catch_up=False):
+        super(Device, self).__init__()
+        self.sensor = sensor
+        self.sample_rate = sample_rate
+        self.scheduler = scheduler.DeadlineScheduler(sample_rate, catch_up)
+        self.remaining = None
+
+        # the sensor reports this device's scheduling stats
+        sensor.scheduler = self.scheduler
+    # end __init__()
+# end Device class
+
+class BusManager(object):
+    """
+        BusManager - polls many sensor addresses across shared buses
+        Constructor:
+            db_interface - the database interface every device logs to
+
+        Methods:
+            add_bus - registers a bus handle (a fake one for testing)
+            add_device - adds a sensor at an address on a bus
+            run - takes readings from every device until each one has
+                  taken reading_count readings, or duration seconds
+                  have passed
+    """
+    def __init__(self, db_interface=None):
+        super(BusManager, self).__init__()
+        self.db_interface = db_interface
+
+        # bus number -> LockedBus
+        self.buses = {}
+
+        # devices in the order they were added
+        self.devices = []
+
+        # set by stop() to break out of run()
+        self.running = False
+    # end __init__()
+
+    def add_bus(self, bus_number=1, bus=None):
+        # returns the shared handle for a bus number, opening
+        # it the first time it is asked for. a bus object can
+        # be handed in instead, the same as the sensor's bus=.
+        if bus_number not in self.buses:
+            if bus is None:
+                if i2c_sensor.smbus is None:
+                    raise RuntimeError("smbus is not installed, a bus object has to be given")
+                # end if
+                bus = i2c_sensor.smbus.SMBus(bus_number)
+            # end if
+            self.buses[bus_number] = LockedBus(bus)
+        # end if
+        return self.buses[bus_number]
+    # end add_bus()
+
+    def add_device(self, address, sample_rate=0.25, bus_number=1,
+                   bus=None, on_data=None, catch_up=False):
+        # adds a sensor at an i2c address and returns it
+        sensor = i2c_sensor.Sensor(address=address,
+                                   bus=self.add_bus(bus_number, bus),
+                                   on_data=on_data,
+                                   db_interface=self.db_interface)
+        self.devices.append(Device(sensor, sample_rate, catch_up))
+        return sensor
+    # end add_device()
+
+    def stop(self):
+        self.running = False
+    # end stop()
+
+    def run(self, reading_count=None, duration=None):
+        # every device starts its own series, then the loop keeps
+        # picking whichever device's deadline comes first, waits
+        # for it and takes its sample.
+        if not self.devices:
+            raise ValueError("no devices to poll, add them with add_device() first")
+        # end if
+        self.running = True
+        for device in self.devices:
+            device.sensor.begin_series()
+            device.remaining = reading_count
+        # end for
+        for device in self.devices:
+            device.scheduler.start()
+        # end for
+
+        end_time = None
+        if duration is not None:
+            end_time = self.devices[0].scheduler.get_deadline() + duration
+        # end if
+
+        active = [device for device in self.devices
+                  if device.remaining is None or device.remaining > 0]
+        while self.running and active.__len__() > 0:
+            device = min(active, key=lambda _device: _device.scheduler.get_deadline())
+            if end_time is not None and device.scheduler.get_deadline() > end_time:
+                break
+            # end if
+
+            device.scheduler.wait()
+            device.sensor.sample()
+
+            if device.remaining is not None:
+                device.remaining = device.remaining - 1
+                if device.remaining == 0:
+                    active.remove(device)
+                # end if
+            # end if
+        # end while
+        self.running = False
+
+        # log each device's series summaries
+        for device in self.devices:
+            device.sensor.end_series()
+        # end for
+    # end run()
+
+    def get_schedule_stats(self):
+        # returns the scheduling stats of every device keyed by
+        # its i2c address
+        return dict((device.sensor.i2c_address, device.scheduler.get_stats())
+                    for device in self.devices)
+    # end get_schedule_stats()
+# end BusManager class
@@ -3,58 +3,687 @@
 # connect to a remote mysql database and insert
 # records to it.
 # -----------------------------------------------------------
-import mysql.connector
 import model
+import latency
+import ingest
+import spool
+import sinks
 import threading
 import time
 import json
+import random
+import collections
 from datetime import datetime
 
-class Interface(object):
+# mysql.connector is only needed when connecting to a real
+# server. a connector function can be handed to the
+# interface instead (the benchmark does this).
+try:
+    import mysql.connector
+except ImportError:
+    mysql = None
+# end try
 
-    def __init__(self, config_file):
-        super(Interface, self).__init__()
+# insert statements for each of the tables. these are
+# used with executemany so a whole batch of rows goes
+# to the server in one statement per table.
+SQL_INSERT_SERIES = "INSERT INTO tbl_series (id) VALUES(%s)"
+SQL_INSERT_READING = (
+                      "INSERT INTO tbl_reading (id, name, series_id, ttr, location_id, device_address, data_address) "
+                      "VALUES(%s, %s, %s, %s, %s, %s, %s)"
+                     )
+SQL_INSERT_TEMPERATURE = (
+                          "INSERT INTO tbl_temperature (reading_id, kelvin, celcius, fahrenheit) "
+                          "VALUES(%s, %s, %s, %s)"
+                         )
+SQL_INSERT_EMISSIVITY = (
+                         "INSERT INTO tbl_emissivity (reading_id, value) "
+                         "VALUES(%s, %s)"
+                        )
 
+SQL_INSERT_AGGREGATE = (
+                        "INSERT IGNORE INTO tbl_aggregate (series_id, name, device_address, data_address, "
+                        "window_start, window_end, count, minimum, maximum, mean, stddev) "
+                        "VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+                       )
+
+# windowed summaries from aggregate.WindowAggregator. a
+# window is unique to its register and start time, and rows
+# that are already there are ignored, so a spooled chunk of
+# aggregates that is replayed twice does not double up.
+SQL_CREATE_AGGREGATE = (
+                        "CREATE TABLE IF NOT EXISTS tbl_aggregate ("
+                        "id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+                        "series_id DOUBLE NOT NULL, name VARCHAR(32), "
+                        "device_address INT, data_address INT, "
+                        "window_start DOUBLE, window_end DOUBLE, count INT, "
+                        "minimum DOUBLE, maximum DOUBLE, mean DOUBLE, stddev DOUBLE, "
+                        "UNIQUE KEY uq_aggregate_window (series_id, device_address, "
+                        "data_address, window_start))"
+                       )
+
+# tbl_aggregate made before the unique key was added gets
+# it on connect
+SQL_HAS_AGGREGATE_KEY = (
+                         "SELECT COUNT(*) FROM information_schema.statistics "
+                         "WHERE table_schema = DATABASE() AND table_name = 'tbl_aggregate' "
+                         "AND index_name = 'uq_aggregate_window'"
+                        )
+SQL_ADD_AGGREGATE_KEY = (
+                         "ALTER TABLE tbl_aggregate ADD UNIQUE KEY uq_aggregate_window "
+                         "(series_id, device_address, data_address, window_start)"
+                        )
+
+# reading ids are handed out in blocks from a single row
+# counter table instead of asking tbl_reading for its max
+# id before every insert.
+SQL_CREATE_READING_SEQUENCE = (
+                               "CREATE TABLE IF NOT EXISTS tbl_reading_sequence ("
+                               "id INT NOT NULL PRIMARY KEY, next_id BIGINT NOT NULL)"
+                              )
+SQL_SEED_READING_SEQUENCE = (
+                             "INSERT IGNORE INTO tbl_reading_sequence (id, next_id) "
+                             "SELECT 0, COALESCE(MAX(id) + 1, 0) FROM tbl_reading"
+                            )
+SQL_RESERVE_READING_IDS = (
+                           "UPDATE tbl_reading_sequence "
+                           "SET next_id = LAST_INSERT_ID(next_id + %s) WHERE id = 0"
+                          )
+
+# one row per register per series from Sensor.end_series,
+# so reports do not have to go over the readings again.
+# ignored if it is already there, for spool replays.
+SQL_CREATE_SERIES_SUMMARY = (
+                             "CREATE TABLE IF NOT EXISTS tbl_series_summary ("
+                             "series_id DOUBLE NOT NULL, name VARCHAR(32), "
+                             "device_address INT NOT NULL, data_address INT NOT NULL, "
+                             "start DOUBLE, end DOUBLE, count INT, minimum DOUBLE, "
+                             "maximum DOUBLE, mean DOUBLE, stddev DOUBLE, ewma DOUBLE, "
+                             "slope DOUBLE, PRIMARY KEY (series_id, device_address, data_address))"
+                            )
+SQL_INSERT_SUMMARY = (
+                      "INSERT IGNORE INTO tbl_series_summary (series_id, name, device_address, "
+                      "data_address, start, end, count, minimum, maximum, mean, stddev, ewma, slope) "
+                      "VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+                     )
+
+# errors that mean the connection or the server is the
+# problem, not the rows. a batch that fails with one of these
+# is tried again. anything else (a duplicate key, a value too
+# long for its column) would fail the same way every time.
+# mysql.connector raises a deadlock as InternalError and a
+# lock wait timeout as DatabaseError, so the error numbers and
+# sqlstates are checked as well as the class names.
+TRANSIENT_ERROR_CLASSES = ("OperationalError", "InterfaceError")
+TRANSIENT_ERRNOS = (
+                    1040,   # too many connections
+                    1053,   # server shutting down
+                    1205,   # lock wait timeout
+                    1213,   # deadlock
+                    2002,   # can not connect (socket)
+                    2003,   # can not connect (tcp)
+                    2006,   # server has gone away
+                    2013,   # lost connection during query
+                    2055,   # lost connection (system error)
+                   )
+TRANSIENT_SQLSTATES = ("40001",)   # serialization failure / deadlock
+
+def is_transient_error(ex):
+    # True if the write is worth trying again. goes by the error
+    # number and sqlstate mysql.connector gives, then by the
+    # class names so it works for any db-api connector handed
+    # to the interface.
+    if getattr(ex, "errno", None) in TRANSIENT_ERRNOS:
+        return True
+    # end if
+    sqlstate = getattr(ex, "sqlstate", None) or ""
+    if sqlstate in TRANSIENT_SQLSTATES or sqlstate.startswith("08"):
+        return True
+    # end if
+    return any(cls.__name__ in TRANSIENT_ERROR_CLASSES for cls in type(ex).__mro__)
+# end is_transient_error()
+
+# tables this module adds to the schema, made on connect
+SQL_CREATE_TABLES = (SQL_CREATE_READING_SEQUENCE, SQL_CREATE_AGGREGATE,
+                     SQL_CREATE_SERIES_SUMMARY)
+
+# compact schema. one narrow row per reading in tbl_sample,
+# keyed on the series and the time the reading was taken in
+# microseconds. kelvin is kept in thousandths so it fits an
+# INT, and is NULL for registers that are not temperatures.
+# the other units, and the old column names, come from the
+# views. see migrate.py to move old data over.
+SCHEMA_CLASSIC = "classic"
+SCHEMA_COMPACT = "compact"
+
+SQL_CREATE_SAMPLE = (
+                     "CREATE TABLE IF NOT EXISTS tbl_sample ("
+                     "series_id DOUBLE NOT NULL, ts BIGINT NOT NULL, "
+                     "device_address TINYINT UNSIGNED NOT NULL, "
+                     "data_address TINYINT UNSIGNED NOT NULL, "
+                     "location_id SMALLINT NOT NULL DEFAULT 0, "
+                     "raw_value SMALLINT UNSIGNED NOT NULL, kelvin_milli INT NULL, "
+                     "ttr FLOAT, "
+                     "PRIMARY KEY (series_id, ts, device_address, data_address))"
+                    )
+SQL_CREATE_SAMPLE_TEMPERATURE_VIEW = (
+                                      "CREATE OR REPLACE VIEW view_sample_temperature AS "
+                                      "SELECT series_id, ts, FROM_UNIXTIME(ts / 1000000) AS taken_at, "
+                                      "device_address, data_address, location_id, "
+                                      "CASE data_address WHEN 6 THEN 'ambient' WHEN 7 THEN 'object' "
+                                      "ELSE 'temperature' END AS name, raw_value, "
+                                      "kelvin_milli / 1000 AS kelvin, "
+                                      "kelvin_milli / 1000 - 273.15 AS celcius, "
+                                      "(kelvin_milli / 1000 - 273.15) * 9 / 5 + 32 AS fahrenheit, ttr "
+                                      "FROM tbl_sample WHERE kelvin_milli IS NOT NULL"
+                                     )
+SQL_CREATE_SAMPLE_EMISSIVITY_VIEW = (
+                                     "CREATE OR REPLACE VIEW view_sample_emissivity AS "
+                                     "SELECT series_id, ts, FROM_UNIXTIME(ts / 1000000) AS taken_at, "
+                                     "device_address, data_address, location_id, raw_value, "
+                                     "raw_value / 65535 AS value, ttr "
+                                     "FROM tbl_sample WHERE data_address = 36"
+                                    )
+SQL_CREATE_COMPACT_TABLES = (SQL_CREATE_SAMPLE, SQL_CREATE_SAMPLE_TEMPERATURE_VIEW,
+                             SQL_CREATE_SAMPLE_EMISSIVITY_VIEW, SQL_CREATE_AGGREGATE,
+                             SQL_CREATE_SERIES_SUMMARY)
+
+# both of these ignore rows that are already there, so a
+# batch that is written twice (a spool replay after a crash)
+# does not fail or double up
+SQL_INSERT_SERIES_IGNORE = "INSERT IGNORE INTO tbl_series (id) VALUES(%s)"
+SQL_INSERT_SAMPLE = (
+                     "INSERT IGNORE INTO tbl_sample (series_id, ts, device_address, data_address, "
+                     "location_id, raw_value, kelvin_milli, ttr) "
+                     "VALUES(%s, %s, %s, %s, %s, %s, %s, %s)"
+                    )
+
+def sample_row(aReading):
+    # tbl_sample row for a reading. readings made without a
+    # timestamp are stamped now.
+    timestamp = aReading.timestamp
+    if timestamp is None:
+        timestamp = time.time()
+    # end if
+    kelvin_milli = None
+    data = aReading.get_data()
+    if type(data) is model.Temperature:
+        kelvin_milli = int(round(data.get_kelvin() * 1000))
+    # end if
+    return (aReading.series_id, int(round(timestamp * 1000000)), aReading.device_address,
+            aReading.data_address, aReading.location_id, aReading.raw_value,
+            kelvin_milli, aReading.ttr)
+# end sample_row()
+
+# read queries. rows come back as tuples in the order of the
+# select list, classic and compact have different columns:
+#
+#   classic  id, series_id, name, device_address, data_address,
+#            ttr, kelvin, emissivity
+#   compact  series_id, ts, device_address, data_address,
+#            raw_value, kelvin, ttr
+#
+# the classic tables have no reading time, so a time range
+# there is the readings of the series (named by their start
+# time) that started inside it.
+SQL_SELECT_CLASSIC = (
+                      "SELECT r.id, r.series_id, r.name, r.device_address, r.data_address, "
+                      "r.ttr, t.kelvin, e.value FROM tbl_reading r "
+                      "LEFT JOIN tbl_temperature t ON t.reading_id = r.id "
+                      "LEFT JOIN tbl_emissivity e ON e.reading_id = r.id "
+                     )
+SQL_SELECT_COMPACT = (
+                      "SELECT series_id, ts, device_address, data_address, raw_value, "
+                      "kelvin_milli / 1000, ttr FROM tbl_sample "
+                     )
+SQL_SELECT_STORED_SUMMARY = (
+                             "SELECT count, minimum, maximum, mean, end - start, stddev, ewma, slope "
+                             "FROM tbl_series_summary WHERE series_id = %s AND data_address = %s"
+                            )
+SQL_QUERIES = {
+    SCHEMA_CLASSIC: {
+        "stored_summary": SQL_SELECT_STORED_SUMMARY,
+        "series": SQL_SELECT_CLASSIC + "WHERE r.series_id = %s ORDER BY r.id",
+        "time_range": SQL_SELECT_CLASSIC + "WHERE r.series_id >= %s AND r.series_id < %s ORDER BY r.id",
+        "device": SQL_SELECT_CLASSIC + "WHERE r.device_address = %s ORDER BY r.id",
+        "device_register": SQL_SELECT_CLASSIC + "WHERE r.device_address = %s "
+                                                "AND r.data_address = %s ORDER BY r.id",
+        "summary": "SELECT COUNT(*), MIN(t.kelvin), MAX(t.kelvin), AVG(t.kelvin), NULL "
+                   "FROM tbl_reading r JOIN tbl_temperature t ON t.reading_id = r.id "
+                   "WHERE r.series_id = %s AND r.data_address = %s",
+    },
+    SCHEMA_COMPACT: {
+        "stored_summary": SQL_SELECT_STORED_SUMMARY,
+        "series": SQL_SELECT_COMPACT + "WHERE series_id = %s ORDER BY ts",
+        "time_range": SQL_SELECT_COMPACT + "WHERE ts >= %s AND ts < %s ORDER BY series_id, ts",
+        "device": SQL_SELECT_COMPACT + "WHERE device_address = %s ORDER BY series_id, ts",
+        "device_register": SQL_SELECT_COMPACT + "WHERE device_address = %s "
+                                                "AND data_address = %s ORDER BY series_id, ts",
+        "summary": "SELECT COUNT(*), MIN(kelvin_milli) / 1000, MAX(kelvin_milli) / 1000, "
+                   "AVG(kelvin_milli) / 1000, (MAX(ts) - MIN(ts)) / 1000000 "
+                   "FROM tbl_sample WHERE series_id = %s AND data_address = %s",
+    },
+}
+
+class SummaryCache(object):
+    """
+        SummaryCache - least recently used cache of series summaries
+        Holds up to max_entries summaries. Getting or putting one
+        makes it the most recently used, and putting one past the
+        limit throws out the least recently used.
+        Constructor:
+            max_entries - most summaries held
+    """
+    def __init__(self, max_entries=256):
+        super(SummaryCache, self).__init__()
+        self.max_entries = max_entries
+        self.__entries__ = collections.OrderedDict()
+        self.__lock__ = threading.Lock()
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    # end __init__()
+
+    def __len__(self):
+        return self.__entries__.__len__()
+    # end __len__()
+
+    def get(self, key):
+        with self.__lock__:
+            summary = self.__entries__.get(key)
+            if summary is None:
+                self.misses = self.misses + 1
+                return None
+            # end if
+            self.__entries__.move_to_end(key)
+            self.hits = self.hits + 1
+            return summary
+        # end with
+    # end get()
+
+    def put(self, key, summary):
+        with self.__lock__:
+            self.__entries__[key] = summary
+            self.__entries__.move_to_end(key)
+            while self.__entries__.__len__() > self.max_entries:
+                self.__entries__.popitem(last=False)
+                self.evictions = self.evictions + 1
+            # end while
+        # end with
+    # end put()
+
+    def discard_series(self, series_ids):
+        # drops every summary of the given series, they have
+        # had readings added since they were worked out
+        with self.__lock__:
+            for key in [key for key in self.__entries__ if key[0] in series_ids]:
+                del self.__entries__[key]
+            # end for
+        # end with
+    # end discard_series()
+
+    def get_stats(self):
+        return {"entries": self.__entries__.__len__(), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+    # end get_stats()
+# end SummaryCache class
+
+# config keys that are never printed
+SECRET_KEYS = ("password", "passwd", "password1", "password2", "password3")
+
+def load_config(config_file):
+    # reads the mysql.connector.connect arguments from a json
+    # file. None gives no arguments.
+    if config_file is None:
+        return {}
+    # end if
+    with open(config_file) as handle:
+        return json.loads(handle.read())
+    # end with
+# end load_config()
+
+def safe_config(config):
+    # copy of the config that is safe to print
+    return dict((key, "****" if key in SECRET_KEYS else value)
+                for key, value in config.items())
+# end safe_config()
+
+class ConnectionPool(object):
+    """
+        ConnectionPool - keeps database connections open between uses
+        Connections handed back with put() are kept, up to
+        pool_size of them, and given out again by get(). One that
+        has sat idle for health_check_interval seconds is pinged
+        before it is given out, and dropped for a new one if the
+        ping fails.
+        Constructor:
+            connector - function that opens a connection from the
+                        config arguments
+            config - the connector arguments
+            pool_size - most idle connections kept
+            health_check_interval - idle seconds before a ping
+    """
+    def __init__(self, connector, config, pool_size=2, health_check_interval=30.0):
+        super(ConnectionPool, self).__init__()
+        self.connector = connector
+        self.config = config
+        self.pool_size = pool_size
+        self.health_check_interval = health_check_interval
+        self.__idle__ = []
+        self.__lock__ = threading.Lock()
+
+        # counters
+        self.opened = 0
+        self.reused = 0
+        self.failed_checks = 0
+    # end __init__()
+
+    def get(self):
+        # an idle connection that passes its health check, or a
+        # new one. connect errors are raised to the caller.
+        while True:
+            with self.__lock__:
+                if not self.__idle__:
+                    break
+                # end if
+                connection, released = self.__idle__.pop()
+            # end with
+            if time.monotonic() - released < self.health_check_interval or \
+                    self.__check__(connection):
+                self.reused = self.reused + 1
+                return connection
+            # end if
+            self.failed_checks = self.failed_checks + 1
+            self.__close__(connection)
+        # end while
+        connection = self.connector(**self.config)
+        self.opened = self.opened + 1
+        return connection
+    # end get()
+
+    def put(self, connection):
+        # hands a connection back to be used again
+        with self.__lock__:
+            if self.__idle__.__len__() < self.pool_size:
+                self.__idle__.append((connection, time.monotonic()))
+                return
+            # end if
+        # end with
+        self.__close__(connection)
+    # end put()
+
+    def discard(self, connection):
+        # closes a connection that should not be used again
+        self.__close__(connection)
+    # end discard()
+
+    def close(self):
+        with self.__lock__:
+            idle = self.__idle__
+            self.__idle__ = []
+        # end with
+        for connection, _ in idle:
+            self.__close__(connection)
+        # end for
+    # end close()
+
+    def get_stats(self):
+        return {"opened": self.opened, "reused": self.reused,
+                "failed_checks": self.failed_checks, "idle": self.__idle__.__len__()}
+    # end get_stats()
+
+    def __check__(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception as ex:
+            print("DATABASE HEALTH CHECK FAILED: %s" % ex)
+            return False
+        # end try
+    # end __check__()
+
+    def __close__(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        # end try
+    # end __close__()
+# end ConnectionPool class
+
+class Interface(sinks.Sink):
+
+    def __init__(self, config_file, batch_size=100, flush_interval=0.05,
+                 id_block_size=1000, queue_size=100000,
+                 overflow_policy=ingest.POLICY_DROP_OLDEST, on_spill=None,
+                 spool_file=None, spool_threshold=None, connector=None,
+                 pool_size=2, health_check_interval=30.0, backoff_initial=0.5,
+                 backoff_max=60.0, schema=SCHEMA_CLASSIC, summary_cache_size=256,
+                 max_retries=10, dead_letter_file=None):
+        super(Interface, self).__init__(batch_size)
+
+        # table layout readings are written in. SCHEMA_CLASSIC is
+        # tbl_reading with tbl_temperature / tbl_emissivity,
+        # SCHEMA_COMPACT is one tbl_sample row per reading.
+        if schema not in (SCHEMA_CLASSIC, SCHEMA_COMPACT):
+            raise ValueError("unknown schema %s" % schema)
+        # end if
+        self.schema = schema
+
+        # config file with the mysql.connector.connect arguments.
+        # None connects with no arguments. it is read once, on
+        # the first connect.
         self.config_file = config_file
+        self.__config__ = None
+
+        # function that opens a db-api connection from the config
+        # arguments, mysql.connector.connect unless one is given
+        self.connector = connector
+
+        # batching settings for the writer thread. up to
+        # batch_size objects are written per transaction, and
+        # the thread waits at most flush_interval seconds for
+        # a batch to fill up before writing what it has.
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # reading ids are reserved id_block_size at a time. the
+        # block is [next id, block end) and starts out empty.
+        self.id_block_size = id_block_size
+        self.__next_reading_id__ = 0
+        self.__reading_id_block_end__ = 0
+
         self.cursor = None
         self.connection = None
-        self.data_queue = []
-        self.running = False
+
+        # connections are taken from and handed back to a pool,
+        # so they stay open between bursts of readings. made on
+        # the first connect.
+        self.pool = None
+        self.pool_size = pool_size
+        self.__pool_lock__ = threading.Lock()
+        self.health_check_interval = health_check_interval
+
+        # failed connects are retried after a random wait of up
+        # to backoff_initial seconds, doubling each time up to
+        # backoff_max
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.__wake__ = threading.Event()
+
+        # a batch that keeps failing on transient errors (see
+        # is_transient_error) is given up on after max_retries
+        # goes. objects the server will
+        # not take are written to dead_letter_file, one JSON line
+        # each in the spool format, so they can be fixed up and
+        # loaded by hand. the last error a write had decides
+        # which of the two it was.
+        self.max_retries = max_retries
+        self.dead_letter_file = dead_letter_file
+        self.__last_error__ = None
+
+        # the tables are only checked on the first connect
+        self.__tables_ready__ = False
+
+        # series summaries handed out by get_series_summary
+        self.summary_cache = SummaryCache(summary_cache_size)
+
+        # optional write-ahead spool on local disk. objects are
+        # written through to it instead of the queue while the
+        # server can not be reached, or once the queue holds
+        # spool_threshold objects, and replayed on reconnect.
+        self.spool = None
+        self.spool_threshold = spool_threshold
+        if spool_file is not None:
+            self.spool = spool.Spool(spool_file)
+            if on_spill is None:
+                on_spill = self.spool.append
+            # end if
+        # end if
+
+        # bounded queue between the sensor and the writer thread.
+        # see ingest.IngestQueue for the overflow policies.
+        self.data_queue = ingest.IngestQueue(queue_size, overflow_policy, on_spill)
         self.broken_connection = False
-        self.thread = threading.Thread(target=self.run)
-        self.new_thread_needed = False
+
+        # the one writer thread. it is started by the first
+        # add_data and runs until close() or kill(), sleeping on
+        # the queue while there is nothing to write.
+        self.thread = None
+        self.running = False
+        self.__closing__ = False
+        self.__thread_lock__ = threading.Lock()
+
+        # flush() waits on this for the writer to settle what was
+        # added. accepted counts the objects add_data took in, and
+        # an object is settled once it is committed, moved to the
+        # spool, or dropped or spilled by the queue policy.
+        self.__settle_condition__ = threading.Condition()
+        self.accepted = 0
+        self.__committed__ = 0
+        self.__diverted__ = 0
+
+        # held while a batch is being written, so write_batch
+        # callers and the writer thread take turns on the one
+        # connection
+        self.__write_lock__ = threading.RLock()
 
         # connection status to the server
         self.__connected__ = False
 
+        # write counters and the latency of each batch write
+        self.rows_written = 0
+        self.batches_written = 0
+        self.write_latency = latency.LatencyHistogram()
+        self.connect_failures = 0
+        self.reconnects = 0
+
+        # set when a connection is lost (discarded after an error
+        # or a failed connect), so the next connect that works is
+        # counted as a reconnect. giving the connection back to the
+        # pool when the writer goes idle does not count.
+        self.__connection_lost__ = False
+        self.batches_failed = 0
+        self.rejected = 0
+
     # end of __init__()
 
-    def __connect__(self):
+    def __open_pool__(self):
+        # makes the connection pool on first use, reading the
+        # config file. returns False if it could not be made.
+        with self.__pool_lock__:
+            if self.pool is not None:
+                return True
+            # end if
+            connector = self.connector
+            if connector is None:
+                if mysql is None:
+                    print("DATABASE CONNECTION ERROR: mysql.connector is not installed")
+                    return False
+                # end if
+                connector = mysql.connector.connect
+            # end if
 
-        # load the config file data
-        with open(self.config_file) as handle:
-            config = json.loads(handle.read())
+            # load the config file data
+            try:
+                self.__config__ = load_config(self.config_file)
+            except Exception as ex:
+                print("DATABASE CONFIG ERROR: %s" % ex)
+                return False
+            # end try
+            print("database configuration: %s" % safe_config(self.__config__))
+            self.pool = ConnectionPool(connector, self.__config__, self.pool_size,
+                                       self.health_check_interval)
+            return True
         # end with
+    # end __open_pool__()
+
+    def __connect__(self):
+
+        if not self.__open_pool__():
+            self.__connected__ = False
+            return
+        # end if
 
         try:
-            print("connecting to database...")
-            print("database configuration: %s" % config)
-            self.connection = mysql.connector.connect(**config)
+            self.connection = self.pool.get()
             self.cursor = self.connection.cursor()
-            self.__connected__ = True
+            if not self.__tables_ready__:
+                print("connected to database")
+                self.__tables_ready__ = self.__prepare_tables__()
+            # end if
+            self.__connected__ = self.__tables_ready__
         except Exception as ex:
             print("DATABASE CONNECTION ERROR: %s" % ex)
             self.__connected__ = False
+        # end try
+        if not self.__connected__:
+            self.__connection_lost__ = True
+            if self.connection is not None:
+                self.pool.discard(self.connection)
+                self.connection = None
+                self.cursor = None
+            # end if
+        elif self.__connection_lost__:
+            self.reconnects = self.reconnects + 1
+            self.__connection_lost__ = False
+        # end if
     # end connect
 
-    def __disconnect__(self):
-        self.connection.close()
+    def __disconnect__(self, discard=False):
+        # hands the connection back to the pool, where it stays
+        # open for the next burst. discard closes it instead, for
+        # a connection that has had an error on it.
+        try:
+            self.cursor.close()
+        except Exception:
+            pass
+        # end try
+        if discard:
+            self.pool.discard(self.connection)
+            self.__connection_lost__ = True
+        else:
+            self.pool.put(self.connection)
+        # end if
+        self.connection = None
         self.cursor = None
 
         self.__connected__ = False
         
     # end disconnect
 
+    def __backoff__(self, attempt):
+        # waits a random time of up to backoff_initial * 2 **
+        # attempt seconds (capped at backoff_max), so loggers that
+        # lost the same server do not all come back at once.
+        # kill() cuts the wait short.
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_initial * (2 ** attempt)))
+        print("DATABASE WRITER RETRYING IN %.1f SECONDS" % delay)
+        self.__wake__.wait(delay)
+    # end __backoff__()
+
     def __execute_sql_command__(self, command_string, params=None, select=False):
         try:
             if params is not None:
@@ -82,182 +711,757 @@ class Interface(object):
         # end try
     # end execute sql command
 
-    def __get_reading_id__(self, from_db=True):
-        if from_db or self.reading_index == -1:
-            sql_command = "SELECT id from tbl_reading ORDER BY id desc LIMIT 1"
-            data = self.__execute_sql_command__(sql_command, None, True)
-            #print("__get_reading_id__ = %s" % data)
-            if data is not None and data.__len__() > 0:
-                return int(data[0][0]) + 1
+    def __prepare_tables__(self):
+        # makes sure the tables this module added exist, and the
+        # reading id sequence row with them. the row is seeded
+        # from the highest id already in tbl_reading so ids carry
+        # on from where the old loggers left off. the compact
+        # schema has no reading ids, it just needs tbl_sample and
+        # its views. this only runs on the first connect.
+        try:
+            if self.schema == SCHEMA_COMPACT:
+                for sql_command in SQL_CREATE_COMPACT_TABLES:
+                    self.cursor.execute(sql_command)
+                # end for
             else:
-                return 0
+                for sql_command in SQL_CREATE_TABLES:
+                    self.cursor.execute(sql_command)
+                # end for
+                self.cursor.execute(SQL_SEED_READING_SEQUENCE)
             # end if
-        else:
-            self.reading_index = self.reading_index + 1
+            self.connection.commit()
+        except Exception as ex:
+            print("TABLE SETUP ERROR: %s" % ex)
+            return False
+        # end try
+        self.__add_aggregate_key__()
+        return True
+    # end __prepare_tables__()
+
+    def __add_aggregate_key__(self):
+        # adds the unique window key to a tbl_aggregate made
+        # before it. if the table already has duplicate windows
+        # in it the key can not be added, that is printed and
+        # logging carries on without it.
+        try:
+            self.cursor.execute(SQL_HAS_AGGREGATE_KEY)
+            if int(self.cursor.fetchall()[0][0]) == 0:
+                print("adding unique window key to tbl_aggregate")
+                self.cursor.execute(SQL_ADD_AGGREGATE_KEY)
+            # end if
+        except Exception as ex:
+            print("AGGREGATE KEY ERROR: %s" % ex)
+        # end try
+    # end __add_aggregate_key__()
+
+    def __reserve_reading_ids__(self, count):
+        # reserves the next count reading ids and returns the end
+        # of the block, or None on an error. the update bumps
+        # the shared counter and LAST_INSERT_ID hands back the new
+        # value on this connection only, so two loggers writing to
+        # the same table can never be given the same block. it is
+        # committed straight away so the row lock is not held for
+        # the rest of the batch.
+        try:
+            self.cursor.execute(SQL_RESERVE_READING_IDS, (count,))
+            self.cursor.execute("SELECT LAST_INSERT_ID()")
+            data = self.cursor.fetchall()
+            self.connection.commit()
+        except Exception as ex:
+            print("READING ID RESERVATION ERROR: %s" % ex)
+            self.__last_error__ = ex
+            return None
+        # end try
+        return int(data[0][0])
+    # end __reserve_reading_ids__()
+
+    def __get_reading_id__(self):
+        # hands out the next reading id from the reserved block,
+        # only going to the database when the block runs out.
+        # returns None if a new block could not be reserved.
+        if self.__next_reading_id__ >= self.__reading_id_block_end__:
+            block_end = self.__reserve_reading_ids__(self.id_block_size)
+            if block_end is None:
+                return None
+            # end if
+            self.__next_reading_id__ = block_end - self.id_block_size
+            self.__reading_id_block_end__ = block_end
+        # end if
+
+        reading_id = self.__next_reading_id__
+        self.__next_reading_id__ = reading_id + 1
+        return reading_id
     # end get reading_id
 
-    def __insert_series__(self, aSeries):
-        sql_command_string = ("INSERT INTO tbl_series (id) VALUES(%s)" % aSeries.get_id())
-        self.__execute_sql_command__(sql_command_string, None, False)
-    # end __insert_series__()
+    def __take_batch__(self):
+        # takes up to batch_size objects off the front of the
+        # queue, waiting at most flush_interval seconds for a
+        # full batch to build up.
+        return self.data_queue.get_batch(self.batch_size, self.flush_interval)
+    # end __take_batch__()
 
-    def __insert_reading__(self, aReading):
+    def __write_batch__(self, batch):
+        # splits the batch up by table and writes every table
+        # with a single executemany (mysql.connector turns
+        # these into multi-row VALUES inserts). everything is
+        # committed once at the end so the batch goes in as
+        # one transaction. returns True if the batch committed.
+        if self.schema == SCHEMA_COMPACT:
+            statements = self.__compact_statements__(batch)
+        else:
+            rows = sinks.split_rows(batch, self.__get_reading_id__)
+            if rows is None:
+                return False
+            # end if
+            statements = ((SQL_INSERT_SERIES, rows.series),
+                          (SQL_INSERT_READING, rows.readings),
+                          (SQL_INSERT_TEMPERATURE, rows.temperatures),
+                          (SQL_INSERT_EMISSIVITY, rows.emissivities),
+                          (SQL_INSERT_AGGREGATE, rows.aggregates),
+                          (SQL_INSERT_SUMMARY, rows.summaries))
+        # end if
 
-        # inserts the reading
-        sql_command_string = (
-                              "INSERT INTO tbl_reading (id, name, series_id, ttr, location_id, device_address, data_address) " 
-                              "VALUES(%s, %s, %s, %s, %s, %s, %s)"
-                              )
-        sql_command_parameters = (aReading.id, aReading.name, aReading.series_id, aReading.ttr, aReading.location_id, aReading.device_address, aReading.data_address)
-        self.__execute_sql_command__(sql_command_string, sql_command_parameters, False)
-
-        # if the reading is a temperature value, we insert it into the 
-        # temperature table. If the reading is emissivity, then we insert
-        # it into that table.
-        if type(aReading.get_data()) is model.Temperature:
-            self.__insert_temperature__(aReading.id, aReading.get_data())
-        elif type(aReading.get_data()) is model.Emissivity:
-            self.__insert_emissivity__(aReading.id, aReading.get_data())
+        ts1 = time.perf_counter_ns()
+        row_count = 0
+        try:
+            for sql_command, table_rows in statements:
+                if table_rows:
+                    self.cursor.executemany(sql_command, table_rows)
+                    row_count = row_count + table_rows.__len__()
+                # end if
+            # end for
+            self.connection.commit()
+        except Exception as ex:
+            print("BATCH SQL ERROR: %s" % ex)
+            self.batches_failed = self.batches_failed + 1
+            self.__last_error__ = ex
+            try:
+                self.connection.rollback()
+            except Exception as rollback_ex:
+                print("ROLLBACK ERROR: %s" % rollback_ex)
+            # end try
+            return False
+        # end try
+
+        # summaries of series that just had readings added are
+        # out of date
+        if self.summary_cache.__len__() > 0:
+            self.summary_cache.discard_series(set(data_object.series_id for data_object in batch
+                                                  if type(data_object) is model.Reading))
         # end if
-    # end insert_record
-
-    def __insert_temperature__(self, reading_id, aTemperature):
-        sql_command_string = (
-                              "INSERT INTO tbl_temperature (reading_id, kelvin, celcius, fahrenheit) "
-                              "VALUES(%s, %s, %s, %s)"
-                             )
-        sql_command_parameters = (reading_id, aTemperature.get_kelvin(), aTemperature.get_celcius(), aTemperature.get_fahrenheit())
-        self.__execute_sql_command__(sql_command_string, sql_command_parameters, False)
-    # end insert_temperature
-
-    def __insert_emissivity__(self, reading_id, aEmissivity):
-        sql_command_string = (
-                              "INSERT INTO tbl_emissivity (reading_id, value) "
-                              "VALUES(%s, %s)"
-                              )
-        sql_command_parameters = (reading_id, aEmissivity.get_value())
-        self.__execute_sql_command__(sql_command_string, sql_command_parameters, False)
-    # end insert_emissivity
+
+        # time from the first insert to the commit coming back
+        self.write_latency.record(time.perf_counter_ns() - ts1)
+        self.batches_written = self.batches_written + 1
+        self.rows_written = self.rows_written + row_count
+        return True
+    # end __write_batch__()
+
+    def __compact_statements__(self, batch):
+        # the compact schema has one row per reading and no ids
+        # to hand out, the key comes from the reading itself
+        series = []
+        samples = []
+        aggregates = []
+        summaries = []
+        for data_object in batch:
+            if type(data_object) is model.Reading:
+                samples.append(sample_row(data_object))
+            elif type(data_object) is model.Series:
+                series.append((data_object.get_id(),))
+            elif type(data_object) is model.Aggregate:
+                aggregates.append(sinks.split_rows((data_object,), None).aggregates[0])
+            elif type(data_object) is model.SeriesSummary:
+                summaries.append(sinks.summary_row(data_object))
+            else:
+                print("ERROR: Unsupported data type %s" % type(data_object))
+            # end if
+        # end for
+        return ((SQL_INSERT_SERIES_IGNORE, series),
+                (SQL_INSERT_SAMPLE, samples),
+                (SQL_INSERT_AGGREGATE, aggregates),
+                (SQL_INSERT_SUMMARY, summaries))
+    # end __compact_statements__()
+
+    def __batch_committed__(self, batch):
+        # checks whether a spooled chunk already made it into the
+        # database. a chunk is written in one transaction, so if
+        # its first row is there then all of it is. a chunk with
+        # only aggregates and summaries in it is just written
+        # again, both are inserted with INSERT IGNORE.
+        for data_object in batch:
+            if type(data_object) is model.Reading:
+                sql_command = "SELECT COUNT(*) FROM tbl_reading WHERE id = %s"
+                params = (data_object.id,)
+            elif type(data_object) is model.Series:
+                sql_command = "SELECT COUNT(*) FROM tbl_series WHERE id = %s"
+                params = (data_object.get_id(),)
+            else:
+                continue
+            # end if
+            data = self.__execute_sql_command__(sql_command, params, True)
+            return data is not None and int(data[0][0]) > 0
+        # end for
+        return False
+    # end __batch_committed__()
+
+    def __replay_spool__(self):
+        # writes the next chunk of the spool to the database.
+        # returns False if the chunk could not be written.
+        start, end, batch = self.spool.read_batch(self.batch_size)
+        if batch.__len__() == 0:
+            return True
+        # end if
+
+        # the compact schema inserts with INSERT IGNORE on a key
+        # the readings carry with them, so a chunk that is
+        # written twice does no harm and there are no ids to pin
+        # down first
+        if self.schema == SCHEMA_COMPACT:
+            if not self.__write_batch__(batch):
+                return self.__reject_chunk__(end, batch)
+            # end if
+            self.spool.commit(end, batch.__len__())
+            return True
+        # end if
+        readings = [data_object for data_object in batch
+                    if type(data_object) is model.Reading]
+
+        first_id = self.spool.get_pending(start)
+        resumed = first_id is not None
+        if not resumed:
+            # first attempt at this chunk. reserve its ids and
+            # write them down before anything goes to the server.
+            block_end = self.__reserve_reading_ids__(readings.__len__())
+            if block_end is None:
+                return False
+            # end if
+            first_id = block_end - readings.__len__()
+            self.spool.mark_pending(start, end, first_id)
+        # end if
+
+        for index, reading in enumerate(readings):
+            reading.set_id(first_id + index)
+        # end for
+
+        # if the chunk was already being replayed when the program
+        # stopped, it has the same ids as last time, so check
+        # whether that write got in before going again.
+        committed = resumed and self.__batch_committed__(batch)
+
+        if not committed and not self.__write_batch__(batch):
+            return self.__reject_chunk__(end, batch)
+        # end if
+        self.spool.commit(end, batch.__len__())
+        return True
+    # end __replay_spool__()
+
+    def __reject_chunk__(self, end, batch):
+        # a spooled chunk that failed. on a transient error it
+        # stays in the spool for the next go and this returns
+        # False. if the server turned the rows down the whole
+        # chunk goes to the dead letter file and the spool moves
+        # past it, it is not split up like a queued batch since
+        # half a chunk in the tables would throw out the check
+        # for a chunk that was already written.
+        if is_transient_error(self.__last_error__):
+            return False
+        # end if
+        self.__reject__(batch)
+        self.spool.commit(end)
+        return True
+    # end __reject_chunk__()
+
+    def __write_apart__(self, batch):
+        # writes a batch the server turned down in halves, and the
+        # halves of those, until each object it will not take is
+        # on its own and can be rejected without holding up the
+        # rest. returns the objects that were not tried because
+        # of a transient error in the middle of it.
+        half = batch.__len__() // 2
+        for part_index, part in enumerate((batch[:half], batch[half:])):
+            if self.__write_batch__(part):
+                self.__settle__(committed=part.__len__())
+            elif is_transient_error(self.__last_error__):
+                return batch[half:] if part_index == 0 else part
+            elif part.__len__() == 1:
+                self.__reject__(part)
+                self.__settle__(diverted=1)
+            else:
+                left = self.__write_apart__(part)
+                if left:
+                    return left + batch[half:] if part_index == 0 else left
+                # end if
+            # end if
+        # end for
+        return []
+    # end __write_apart__()
+
+    def __reject__(self, objects):
+        # objects that are given up on. they are counted, and
+        # written to the dead letter file if there is one.
+        self.rejected = self.rejected + objects.__len__()
+        print("ERROR: rejected %s records: %s" % (objects.__len__(), self.__last_error__))
+        if self.dead_letter_file is None:
+            return
+        # end if
+        try:
+            with open(self.dead_letter_file, "a") as handle:
+                for data_object in objects:
+                    handle.write(json.dumps(spool.encode(data_object)) + "\n")
+                # end for
+            # end with
+        except Exception as ex:
+            print("DEAD LETTER ERROR: %s" % ex)
+        # end try
+    # end __reject__()
+
+    def __spill_queue__(self):
+        # moves everything in the memory queue out to the spool
+        # so it survives a restart while the server is down
+        batch = self.data_queue.get_batch(self.data_queue.__len__())
+        for data_object in batch:
+            self.spool.append(data_object)
+        # end for
+        self.spool.sync()
+        self.__settle__(diverted=batch.__len__())
+    # end __spill_queue__()
+
+    def get_settled(self):
+        # objects from add_data that are committed, in the spool,
+        # or were dropped or spilled by the queue
+        queue = self.data_queue
+        return self.__committed__ + self.__diverted__ + queue.dropped + queue.spilled
+    # end get_settled()
+
+    def __settle__(self, committed=0, diverted=0):
+        # counts objects as settled and wakes anyone in flush()
+        with self.__settle_condition__:
+            self.__committed__ = self.__committed__ + committed
+            self.__diverted__ = self.__diverted__ + diverted
+            self.__settle_condition__.notify_all()
+        # end with
+    # end __settle__()
+
+    def __is_settled__(self, target):
+        return self.get_settled() >= target and \
+            (self.spool is None or not self.spool.has_pending())
+    # end __is_settled__()
+
+    def write_batch(self, batch):
+        # writes a list of Series and Reading objects on the
+        # calling thread in one transaction, connecting first if
+        # need be. this skips the queue, it is for callers that
+        # do their own batching (see aio.AsyncSink). returns True
+        # if the batch committed.
+        with self.__write_lock__:
+            if not self.__connected__:
+                self.__connect__()
+            # end if
+            if not self.__connected__:
+                return False
+            # end if
+            if not self.__write_batch__(batch):
+                self.__disconnect__(discard=True)
+                return False
+            # end if
+            return True
+        # end with
+    # end write_batch()
+
+    def fetch_series(self, series_id, chunk_size=1000):
+        # every reading of a series, oldest first
+        return self.__stream__("series", (series_id,), chunk_size)
+    # end fetch_series()
+
+    def fetch_time_range(self, start, end, chunk_size=1000):
+        # readings taken from start up to end, in seconds since
+        # the epoch. on the classic schema, the readings of the
+        # series that started in that time.
+        if self.schema == SCHEMA_COMPACT:
+            params = (int(round(start * 1000000)), int(round(end * 1000000)))
+        else:
+            params = (start, end)
+        # end if
+        return self.__stream__("time_range", params, chunk_size)
+    # end fetch_time_range()
+
+    def fetch_device(self, device_address, data_address=None, chunk_size=1000):
+        # every reading from a device, or from one of its
+        # registers
+        if data_address is None:
+            return self.__stream__("device", (device_address,), chunk_size)
+        # end if
+        return self.__stream__("device_register", (device_address, data_address), chunk_size)
+    # end fetch_device()
+
+    def get_series_summary(self, series_id, data_address=0x7):
+        # count, min / max / mean kelvin and duration in seconds
+        # of one register of a series (the object temperature
+        # unless told otherwise) as a dictionary, or None if it
+        # could not be read. the row the sensor logged at the end
+        # of the series (tbl_series_summary) is used if there is
+        # one, which also has stddev, ewma and slope. otherwise it
+        # is worked out from the readings, without those, and
+        # with no duration on the classic schema. summaries are
+        # cached until the series has more readings written to it
+        # through this interface.
+        key = (series_id, data_address)
+        summary = self.summary_cache.get(key)
+        if summary is not None:
+            return summary
+        # end if
+        # tbl_series_summary is only made when a writer connects,
+        # so it may not be there yet. that is not an error, the
+        # summary is worked out from the readings instead.
+        try:
+            rows = list(self.__stream__("stored_summary", key, 1))
+        except Exception as ex:
+            print("STORED SUMMARY QUERY ERROR: %s" % ex)
+            rows = []
+        # end try
+        if not rows:
+            try:
+                rows = [row + (None, None, None) for row in self.__stream__("summary", key, 1)]
+            except Exception as ex:
+                print("SUMMARY QUERY ERROR: %s" % ex)
+                return None
+            # end try
+        # end if
+        if not rows:
+            return None
+        # end if
+        count = rows[0][0]
+        summary = {"series_id": series_id, "data_address": data_address,
+                   "count": int(count)}
+        for field, value in zip(("minimum", "maximum", "mean", "duration", "stddev",
+                                 "ewma", "slope"), rows[0][1:]):
+            summary[field] = None if value is None else float(value)
+        # end for
+        self.summary_cache.put(key, summary)
+        return summary
+    # end get_series_summary()
+
+    def __stream__(self, query, params, chunk_size):
+        # runs a read query on a connection of its own and yields
+        # the rows chunk_size at a time from an unbuffered cursor,
+        # so a long series never has to fit in memory and the
+        # writer thread keeps its connection. a connection that
+        # is let go of before the last row is closed, it still
+        # has rows waiting on it. the read transaction is ended
+        # before the connection goes back to the pool, or the next
+        # query on it would see the same repeatable-read snapshot
+        # and miss everything logged since.
+        if not self.__open_pool__():
+            return
+        # end if
+        connection = self.pool.get()
+        finished = False
+        try:
+            cursor = connection.cursor(buffered=False)
+            cursor.execute(SQL_QUERIES[self.schema][query], params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                # end if
+                for row in rows:
+                    yield row
+                # end for
+            # end while
+            cursor.close()
+            connection.rollback()
+            finished = True
+        finally:
+            if finished:
+                self.pool.put(connection)
+            else:
+                self.pool.discard(connection)
+            # end if
+        # end try
+    # end __stream__()
 
     def add_data(self, data_object):
         # data object can be: Series, Reading, Temperature, Emissivity, 
         # this is the method to add a reading into the
-        # data queue and start logging into the database
-        self.data_queue.append(data_object)
+        # data queue and start logging into the database.
+        # while the server is down, or the queue is backed up
+        # past the spool threshold, it goes to the spool instead.
+        with self.__settle_condition__:
+            self.accepted = self.accepted + 1
+        # end with
+        if self.spool is not None and (self.broken_connection or
+                (self.spool_threshold is not None and
+                 self.data_queue.__len__() >= self.spool_threshold)):
+            self.spool.append(data_object)
+            self.__settle__(diverted=1)
+        else:
+            self.data_queue.put(data_object)
+        # end if
         if not self.running:
-            # if a new thread is needed, then we
-            # will recreate it.
-            if self.new_thread_needed:
-                self.thread = threading.Thread(target=self.run)
-            # end if
+            self.__start_thread__()
+        # end if
+    # end add_data
 
-            # start the thread
+    def __start_thread__(self):
+        # starts the writer thread if it is not going already.
+        # the lock stops two callers starting it at once.
+        with self.__thread_lock__:
+            if self.running or self.__closing__:
+                return
+            # end if
+            self.running = True
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
             self.thread.start()
+        # end with
+    # end __start_thread__()
+
+    def flush(self, timeout=None):
+        # waits until everything add_data has taken in so far is
+        # committed (or spooled, dropped or spilled), and the
+        # spool has been replayed. returns False if that has not
+        # happened after timeout seconds.
+        with self.__settle_condition__:
+            target = self.accepted
+        # end with
+        if self.__is_settled__(target):
+            return True
         # end if
-    # end add_data
+        if not self.running:
+            self.__start_thread__()
+        # end if
+        with self.__settle_condition__:
+            return self.__settle_condition__.wait_for(lambda: self.__is_settled__(target), timeout)
+        # end with
+    # end flush()
 
-    def kill(self):
-        #print("db thread flagged for death.")
-        self.running = False
+    def close(self, timeout=None):
+        # logs what is left, stops the writer thread and closes
+        # the connections. returns False if the writer had not
+        # finished after timeout seconds. it is told to stop
+        # anyway, and if it is stuck in a write it is left to it
+        # (it is a daemon thread) with its connection open, and
+        # what it had not written is lost unless it is spooled.
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        # end if
+        flushed = self.flush(timeout)
+        with self.__thread_lock__:
+            self.__closing__ = True
+        # end with
+        remaining = None
+        if deadline is not None:
+            remaining = max(0.0, deadline - time.monotonic())
+        # end if
+        if not self.__stop_thread__(remaining):
+            print("ERROR: database writer did not stop, %s records not logged" % self.get_unsettled())
+            if self.spool is not None:
+                self.spool.sync()
+            # end if
+            return False
+        # end if
+        with self.__write_lock__:
+            if self.__connected__:
+                self.__disconnect__()
+            # end if
+            if self.pool is not None:
+                self.pool.close()
+            # end if
+        # end with
+        if self.spool is not None:
+            self.spool.close()
+        # end if
+        return flushed
+    # end close()
+
+    def kill(self, timeout=5.0):
+        # stops the writer thread straight away, whatever is
+        # left in the queue stays there. returns False if the
+        # thread was still in a write after timeout seconds.
+        return self.__stop_thread__(timeout)
     # end of kill()
 
+    def is_connected(self):
+        # True while the writer holds a working connection
+        return self.__connected__
+    # end is_connected()
+
+    def get_unsettled(self):
+        # objects add_data took in that are not committed,
+        # spooled, dropped or spilled yet
+        return max(0, self.accepted - self.get_settled())
+    # end get_unsettled()
+
+    def __stop_thread__(self, timeout=None):
+        # returns False if the thread had not stopped after
+        # timeout seconds
+        self.running = False
+        self.__wake__.set()
+        self.data_queue.wake()
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+            return not thread.is_alive()
+        # end if
+        return True
+    # end __stop_thread__()
+
     def run(self):
-        self.running = True
+        # the writer thread. sleeps on the queue until there is
+        # something to write, writes it a batch at a time and
+        # hands the connection back to the pool whenever it goes
+        # idle, so it is there warm for the next burst.
 
-        #print("started db logging thread..")
+        self.__wake__.clear()
+        try:
+            self.__write_loop__()
+        finally:
+            # hand the connection back to the pool. if the thread
+            # died on an error the next add_data starts another.
+            self.running = False
+            with self.__write_lock__:
+                if self.__connected__:
+                    self.__disconnect__()
+                # end if
+            # end with
+            self.__settle__()
+        # end try
+    # end of run
 
-        # if we have to connect more than three times,
-        # we will have to give up.
+    def __write_loop__(self):
+        # failed connects or batches in a row, for the backoff
         connection_attempts = 0
-        
+        failures = 0
+
+        # first object of the last batch that failed, and how
+        # many times in a row it has been tried again
+        retry_head = None
+        retries = 0
+
         while self.running:
-            
-            #if self.__connected__ == False and self.broken_connection == False:
-            #    # connect to the database
-            #    self.__connect__()
+
+            # nothing to write, wait for more
+            if self.data_queue.__len__() == 0 and \
+                    (self.spool is None or not self.spool.has_pending()):
+                if self.__connected__:
+                    with self.__write_lock__:
+                        self.__disconnect__()
+                    # end with
+                # end if
+                self.__settle__()
+                self.data_queue.wait()
+                continue
             # end if
+            
+            # connects under the write lock, so a write_batch caller
+            # connecting at the same time can not open a second
+            # connection over this one. the lock is let go before
+            # the backoff wait.
             while (self.__connected__ == False and self.running):
-                if self.running:
-                    self.__connect__()
-                # end
-                if not self.__connected__:
-                    print("MYSQL SERVER CONNECTION ERROR, THREAD WAITING 20 SECONDS")
-                    time.sleep(20)
+                with self.__write_lock__:
+                    if not self.__connected__:
+                        self.__connect__()
+                    # end if
+                    connected = self.__connected__
+                # end with
+                if not connected:
+                    self.broken_connection = True
+                    self.connect_failures = self.connect_failures + 1
+                    if self.spool is not None:
+                        self.__spill_queue__()
+                    # end if
+                    self.__backoff__(connection_attempts)
+                    connection_attempts = connection_attempts + 1
                 # end if
             # end while
-
-            # this will not execute unless the server
-            # gets connected
-            #print("db connected = %s" % self.__connected__)
+            if not self.running:
+                break
+            # end if
+            connection_attempts = 0
+            self.broken_connection = False
 
             if self.data_queue.__len__() > 0:
 
-                # gets the first data object in the queue
-                data_object = self.data_queue[0]
-                
-                # process the reading
-            
-                # determine the type of data object
-                # can either be a series or reading
-
-                if type(data_object) is model.Series:
+                # takes up to batch_size objects off the front
+                # of the queue and writes them in one transaction.
+                batch = self.__take_batch__()
 
-                    # inserts the series data into the database. If we get an error
-                    # we need to break the thread.
-                    _inserted = self.__insert_series__(data_object)
-                    
-                    if _inserted is None:
+                with self.__write_lock__:
+                    _written = self.__write_batch__(batch)
+                # end with
 
-                        # print some debug information
-                        print("ERROR: failed to insert record")
+                if _written:
+                    failures = 0
+                    self.__settle__(committed=batch.__len__())
+                    continue
+                # end if
 
-                        # set the kill it
-                        self.running = False
-                        
-                    # end if
+                # print some debug information
+                print("ERROR: failed to insert batch of %s records" % batch.__len__())
 
-                elif type(data_object) is model.Reading:
-                    # first, get the id of the reading. This should
-                    # be the last database index in the table. So, for
-                    # this we need to query the db for the latest index
-                    # value.
-                    _reading_id = self.__get_reading_id__(True)
-                    data_object.set_id(_reading_id)
-
-                    # insert the reading into the reading table
-                    self.__insert_reading__(data_object)
-                
-                    if type(data_object.get_data()) is type(model.Temperature):
-                        
-                        # insert temperature into temperature table
-                        self.__insert_temperature__(data_object.id, a_reading.get_data())
-                    
-                    elif type(data_object.get_data()) is type(model.Emissivity):
-                        
-                        # insert emissivity into emissivity table
-                        self.__insert_emissivity__(data_object.id, data_object.get_data())
+                # the same batch coming round again counts as a retry
+                if batch[0] is retry_head:
+                    retries = retries + 1
+                else:
+                    retry_head = batch[0]
+                    retries = 0
+                # end if
 
+                if not is_transient_error(self.__last_error__):
+                    # the server turned the rows down. going again
+                    # will not help, so the batch is written apart
+                    # and only the objects it will not take are
+                    # rejected.
+                    with self.__write_lock__:
+                        left = self.__write_apart__(batch)
+                    # end with
+                    if not left:
+                        continue
                     # end if
-                else:
-                    print("ERROR: Unsupported data type %s" % type(data_object))
+                    batch = left
+                    retry_head = batch[0]
+                elif retries >= self.max_retries:
+                    print("ERROR: giving up on batch after %s retries" % retries)
+                    self.__reject__(batch)
+                    self.__settle__(diverted=batch.__len__())
+                    continue
                 # end if
 
-                # pop the record off of the queue
-                self.data_queue.pop(0)
+                # a transient error (the connection went, a deadlock
+                # or a lock wait timeout). put the batch back on the
+                # front of the queue so nothing is lost, and try
+                # again on a fresh connection after a wait
+                self.data_queue.put_front(batch)
+                with self.__write_lock__:
+                    self.__disconnect__(discard=True)
+                # end with
+                self.__backoff__(failures)
+                failures = failures + 1
             else:
-                # this is there are no more records
-                # in the data queue
-                self.running = False
+
+                # the queue is empty, so catch up on anything that
+                # was spooled while the server was down.
+                with self.__write_lock__:
+                    _replayed = self.__replay_spool__()
+                # end with
+                if _replayed:
+                    failures = 0
+                    self.__settle__()
+                else:
+                    print("ERROR: failed to replay spooled records")
+                    with self.__write_lock__:
+                        if self.__connected__:
+                            self.__disconnect__(discard=True)
+                        # end if
+                    # end with
+                    self.__backoff__(failures)
+                    failures = failures + 1
+                # end if
             # end if
         # end while loop
-        
-        # if there is no more data to log, disconnect from the server
-        if self.__connected__:
-            self.__disconnect__()
-        # end if
-
-        self.new_thread_needed = True
-    # end of run
+    # end __write_loop__()
 # end of class
 
 ##if __name__ == '__main__':
@@ -0,0 +1,138 @@
+# -----------------------------------------------------------
+# Deadband module
+# purpose: report by exception. a reading is only passed on
+# to the database when it has moved more than its register's
+# deadband since the last reading that was passed on, or
+# when the heartbeat interval is up, so a flat temperature
+# still shows up every so often and a gap in the data means
+# an outage rather than a steady reading.
+# -----------------------------------------------------------
+import time
+import model
+
+class Deadband(object):
+    """
+        Deadband - threshold for one register
+        Constructor:
+            absolute - change in kelvin (or emissivity value) that
+                       has to be exceeded
+            percent - change as a percentage of the last value
+                      passed on. if both are given either one
+                      being exceeded passes the reading.
+    """
+    def __init__(self, absolute=None, percent=None):
+        super(Deadband, self).__init__()
+        if absolute is None and percent is None:
+            raise ValueError("a deadband needs an absolute or a percent threshold")
+        # end if
+        self.absolute = absolute
+        self.percent = percent
+    # end __init__()
+
+    def exceeded(self, last_value, value):
+        change = abs(value - last_value)
+        if self.absolute is not None and change > self.absolute:
+            return True
+        # end if
+        if self.percent is not None and change > abs(last_value) * self.percent / 100.0:
+            return True
+        # end if
+        return False
+    # end exceeded()
+# end Deadband class
+
+class DeadbandFilter(object):
+    """
+        DeadbandFilter - passes on readings that change meaningfully
+        It takes data objects through add_data, the same as
+        db.Interface, so it can be handed to the sensor as its
+        db_interface. accept() can be used on its own as a
+        pipeline.Filter predicate.
+        Constructor:
+            db_interface - where accepted readings and series go
+            deadbands - register name -> Deadband. readings of any
+                        other register are always passed on.
+            heartbeat - seconds after which a reading is passed on
+                        even if it has not changed. None turns the
+                        heartbeat off.
+    """
+    def __init__(self, db_interface=None, deadbands=None, heartbeat=60.0):
+        super(DeadbandFilter, self).__init__()
+        self.db_interface = db_interface
+        if deadbands is None:
+            deadbands = {}
+        # end if
+        self.deadbands = deadbands
+        self.heartbeat = heartbeat
+
+        # (device address, data address) -> [series id, last value
+        # passed on, time it was passed on]
+        self.__last__ = {}
+
+        # series id -> {"forwarded", "suppressed", "heartbeats"}
+        self.series_counts = {}
+    # end __init__()
+
+    def accept(self, aReading):
+        # returns True if the reading should be passed on
+        deadband = self.deadbands.get(aReading.name)
+        if deadband is None:
+            return True
+        # end if
+
+        counts = self.series_counts.get(aReading.series_id)
+        if counts is None:
+            counts = self.series_counts[aReading.series_id] = \
+                {"forwarded": 0, "suppressed": 0, "heartbeats": 0}
+        # end if
+
+        value = aReading.get_value()
+        timestamp = aReading.timestamp
+        if timestamp is None:
+            timestamp = time.time()
+        # end if
+
+        key = (aReading.device_address, aReading.data_address)
+        last = self.__last__.get(key)
+        if last is None or last[0] != aReading.series_id or deadband.exceeded(last[1], value):
+            # first reading of the series, or a real change
+            pass
+        elif self.heartbeat is not None and timestamp - last[2] >= self.heartbeat:
+            counts["heartbeats"] = counts["heartbeats"] + 1
+        else:
+            counts["suppressed"] = counts["suppressed"] + 1
+            return False
+        # end if
+
+        counts["forwarded"] = counts["forwarded"] + 1
+        self.__last__[key] = [aReading.series_id, value, timestamp]
+        return True
+    # end accept()
+
+    def add_data(self, data_object):
+        if type(data_object) is not model.Reading or self.accept(data_object):
+            self.db_interface.add_data(data_object)
+        # end if
+    # end add_data()
+
+    def get_stats(self, series_id=None):
+        # returns the forwarded, suppressed and heartbeat counts
+        # for one series, or for all of them keyed by series id.
+        # the reduction is the fraction of readings not logged.
+        if series_id is not None:
+            return self.__with_reduction__(self.series_counts.get(series_id))
+        # end if
+        return dict((_series_id, self.__with_reduction__(counts))
+                    for _series_id, counts in self.series_counts.items())
+    # end get_stats()
+
+    def __with_reduction__(self, counts):
+        if counts is None:
+            return None
+        # end if
+        counts = dict(counts)
+        total = counts["forwarded"] + counts["suppressed"]
+        counts["reduction"] = (counts["suppressed"] / total) if total > 0 else 0.0
+        return counts
+    # end __with_reduction__()
+# end DeadbandFilter class
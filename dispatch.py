@@ -0,0 +1,153 @@
+# -----------------------------------------------------------
+# Dispatch module
+# purpose: runs the user callbacks off the sampling thread.
+# the sensor puts each reading on a bounded ingest queue
+# (an O(1) append) and a dispatcher thread takes them off
+# in batches and hands them to on_data one at a time and/or
+# to on_batch as a list. a slow callback then backs up the
+# queue instead of stretching the sample period, and the
+# counters show when that happens.
+# -----------------------------------------------------------
+import threading
+import time
+import ingest
+import latency
+
+class Dispatcher(object):
+    """
+        Dispatcher - calls the data callbacks on a thread of its own
+        Constructor:
+            on_data - called with each reading
+            on_batch - called with a list of readings
+            batch_size - most readings handed over at a time
+            flush_interval - longest time in seconds a reading waits
+                             for its batch to fill up
+            max_size - readings held before the overflow policy
+                       kicks in
+            policy - ingest overflow policy, see ingest.IngestQueue
+            stall_threshold - seconds a batch of callbacks can take
+                              before it is counted as a stall
+
+        Methods:
+            put - queues a reading for the callbacks
+            flush - waits for everything queued so far to be handed over
+            close - flushes and stops the thread
+            get_stats - delivery, backlog and stall counters
+    """
+    def __init__(self, on_data=None, on_batch=None, batch_size=100,
+                 flush_interval=0.1, max_size=10000,
+                 policy=ingest.POLICY_DROP_OLDEST, stall_threshold=0.1):
+        super(Dispatcher, self).__init__()
+        if on_data is None and on_batch is None:
+            raise ValueError("a dispatcher needs on_data or on_batch")
+        # end if
+        self.on_data = on_data
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stall_threshold = stall_threshold
+        self.queue = ingest.IngestQueue(max_size, policy, block_timeout=None)
+
+        # flush() waits on this for the thread to catch up
+        self.__condition__ = threading.Condition()
+        self.accepted = 0
+        self.delivered = 0
+
+        # counters. a stall is a batch whose callbacks took longer
+        # than stall_threshold, callback_time is per batch.
+        self.batches = 0
+        self.stalls = 0
+        self.errors = 0
+        self.callback_time = latency.LatencyHistogram()
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    # end __init__()
+
+    def put(self, reading):
+        with self.__condition__:
+            self.accepted = self.accepted + 1
+        # end with
+        self.queue.put(reading)
+    # end put()
+
+    def run(self):
+        while self.running or self.queue.__len__() > 0:
+            if not self.queue.wait():
+                continue
+            # end if
+            batch = self.queue.get_batch(self.batch_size, self.flush_interval)
+            if batch:
+                self.__deliver__(batch)
+            # end if
+        # end while
+    # end run()
+
+    def flush(self, timeout=None):
+        # waits until every reading put so far has been handed to
+        # the callbacks, or dropped by the queue policy. returns
+        # False on a timeout.
+        with self.__condition__:
+            target = self.accepted
+            return self.__condition__.wait_for(
+                lambda: self.delivered + self.queue.dropped >= target or not self.thread.is_alive(),
+                timeout) and self.delivered + self.queue.dropped >= target
+        # end with
+    # end flush()
+
+    def close(self, timeout=None):
+        flushed = self.flush(timeout)
+        self.running = False
+        self.queue.wake()
+        self.thread.join(timeout)
+        return flushed
+    # end close()
+
+    def get_stats(self):
+        queue_stats = self.queue.get_stats()
+        return {"accepted": self.accepted, "delivered": self.delivered,
+                "backlog": queue_stats["depth"], "backlog_high_water": queue_stats["high_water"],
+                "dropped": queue_stats["dropped"], "batches": self.batches,
+                "stalls": self.stalls, "errors": self.errors,
+                "callback_time": self.callback_time.get_stats()}
+    # end get_stats()
+
+    def __deliver__(self, batch):
+        # a callback that raises is printed and counted, it does
+        # not stop the thread. each callback, and each on_data
+        # call, is tried on its own so one failing does not keep
+        # the readings from the other.
+        ts1 = time.perf_counter_ns()
+        if self.on_batch is not None:
+            try:
+                self.on_batch(batch)
+            except Exception as ex:
+                print("CALLBACK ERROR: on_batch: %s" % ex)
+                self.errors = self.errors + 1
+            # end try
+        # end if
+        if self.on_data is not None:
+            on_data = self.on_data
+            for reading in batch:
+                try:
+                    on_data(reading)
+                except Exception as ex:
+                    print("CALLBACK ERROR: on_data: %s" % ex)
+                    self.errors = self.errors + 1
+                # end try
+            # end for
+        # end if
+        elapsed = time.perf_counter_ns() - ts1
+        self.callback_time.record(elapsed)
+        self.batches = self.batches + 1
+        if elapsed > self.stall_threshold * 1e9:
+            self.stalls = self.stalls + 1
+        # end if
+        with self.__condition__:
+            self.delivered = self.delivered + batch.__len__()
+            self.__condition__.notify_all()
+        # end with
+    # end __deliver__()
+# end Dispatcher class
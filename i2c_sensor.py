@@ -1,7 +1,18 @@
+import asyncio
 import time
-import smbus
-import random
 import model
+import latency
+import scheduler
+import stats
+import dispatch
+
+# smbus is only there on the pi. anywhere else a bus object
+# has to be handed to the sensor.
+try:
+    import smbus
+except ImportError:
+    smbus = None
+# end try
 class Sensor(object):
     """
         I2CSensor - general class for an I2CSensor
@@ -12,13 +23,24 @@ class Sensor(object):
             address - hex address of the i2c sensor
             on_data - callback function when the data from the
                       sensor is read
+            db_interface - where the readings are logged, any
+                           sinks.Sink (db.Interface for mysql)
+            sink - same as db_interface
+            ewma_alpha - weight of the newest reading in the series
+                         moving averages
+            on_batch - callback function taking a list of readings,
+                       called from the dispatcher thread
+            async_callbacks - call on_data from a dispatcher thread
+                              instead of the sampling loop (on_batch
+                              always is)
 
         Methods:
             loop_forever - loops forever continuously reading the data
                            it also monitors the time it takes to read.
     """
     def __init__(self, address, bus=None,
-                 on_data=None, db_interface=None):
+                 on_data=None, db_interface=None, sink=None, ewma_alpha=0.1,
+                 on_batch=None, async_callbacks=False):
         
         # i2c bus address of device
         self.i2c_address = address
@@ -40,12 +62,25 @@ class Sensor(object):
         self.max_ttr = 0
         self.max_ttr_reading = None
 
+        # ttr latency histograms, one per register name
+        # (ambient, object, emissivity). these are reset
+        # along with the total ttr at the start of a run.
+        self.ttr_histograms = {}
+
         # maximum object temperature class
         # variables. The decimal variable is in
         # kelvin.
         self.max_object_temp = 0
         self.max_object_temp_reading = None
 
+        # running statistics of the current series, one per
+        # register name. they are logged as a SeriesSummary
+        # for each register when the series ends.
+        self.ewma_alpha = ewma_alpha
+        self.series_stats = {}
+        self.__stats_addresses__ = {}
+        self.__series_ended__ = True
+
         # hard-coded data registers for the 
         # type of sensor. This should be consistent
         # if there is more than one sensor on the
@@ -64,6 +99,9 @@ class Sensor(object):
         # doing this only once will speed up the
         # device read times.
         if bus is None:
+            if smbus is None:
+                raise RuntimeError("smbus is not installed, a bus object has to be given")
+            # end if
             self.bus = smbus.SMBus(1)
         else:
             self.bus = bus
@@ -71,9 +109,30 @@ class Sensor(object):
 
         # this is the database interface class
         # if an instance is detected then we will
-        # send the data on a reading.
+        # send the data on a reading. it can be any
+        # of the storage sinks (see sinks.Sink).
+        if sink is not None:
+            db_interface = sink
+        # end if
         self.db_interface = db_interface
 
+        # deadline scheduler of the last take_readings run
+        self.scheduler = None
+
+        # with async callbacks the readings are queued for a
+        # dispatcher thread, so a slow callback does not hold
+        # up the sampling. see dispatch.Dispatcher.
+        self.dispatcher = None
+        if async_callbacks or on_batch is not None:
+            _on_data = on_data
+            if async_callbacks and on_data is None and on_batch is None:
+                _on_data = print
+            elif not async_callbacks:
+                _on_data = None
+            # end if
+            self.dispatcher = dispatch.Dispatcher(_on_data, on_batch)
+        # end if
+
     # end of __init__
 
     def add_ttr(self, ttr):
@@ -99,8 +158,42 @@ class Sensor(object):
         # reset total ttr method, this will
         # reset the class variable
         self.total_ttr = 0
+
+        # the latency histograms go with it
+        self.ttr_histograms = {}
     # end of reset_total_ttr
 
+    def get_ttr_stats(self, name=None):
+        # returns the ttr stats (count, mean, min, max and
+        # percentiles, in seconds) for one register name, or a
+        # dictionary of them keyed by name if none is given.
+        if name is not None:
+            return self.ttr_histograms[name].get_stats()
+        # end if
+        return dict((_name, histogram.get_stats())
+                    for _name, histogram in self.ttr_histograms.items())
+    # end get_ttr_stats()
+
+    def get_ttr_snapshot(self):
+        # returns the ttr histograms as plain dictionaries keyed
+        # by register name. snapshots from several runs can be
+        # put back together with merge_ttr_snapshot.
+        return dict((_name, histogram.snapshot())
+                    for _name, histogram in self.ttr_histograms.items())
+    # end get_ttr_snapshot()
+
+    def merge_ttr_snapshot(self, snapshot):
+        # adds the histograms from a snapshot into this sensor's
+        for _name, histogram_snapshot in snapshot.items():
+            histogram = latency.LatencyHistogram.from_snapshot(histogram_snapshot)
+            if _name in self.ttr_histograms:
+                self.ttr_histograms[_name].merge(histogram)
+            else:
+                self.ttr_histograms[_name] = histogram
+            # end if
+        # end for
+    # end merge_ttr_snapshot()
+
     def get_max_ttr(self):
         return self.max_ttr_reading
     # end get_max_ttr()
@@ -113,8 +206,14 @@ class Sensor(object):
         # if there is a callback function, we will
         # call it without printing anything. if there
         # is not a callback specified, we will print
-        # what we read.
-        if self.on_data != None:
+        # what we read. with a dispatcher the reading is
+        # queued for its thread instead.
+        if self.dispatcher is not None:
+            self.dispatcher.put(aReading)
+            if self.dispatcher.on_data is None and self.on_data is not None:
+                self.on_data(aReading)
+            # end if
+        elif self.on_data != None:
             self.on_data(aReading)
         else:
             print(aReading)
@@ -137,33 +236,49 @@ class Sensor(object):
         # return back the raw value. It also
         # will keep track of the total_ttr
         
-        # first timestamp
-        ts1 = time.time()
+        # time the reading was taken
+        timestamp = time.time()
+
+        # first timestamp. ttr is timed on the monotonic
+        # nanosecond clock, the wall clock is too coarse.
+        ts1 = time.perf_counter_ns()
 
         # raw reading from the device
         raw = self.bus.read_word_data(self.i2c_address, address)
 
         # timestamp 2
-        ts2 = time.time()
+        ts2 = time.perf_counter_ns()
 
-        # gets the time to read
-        ttr = ts2 - ts1
+        # gets the time to read, in seconds
+        ttr_ns = ts2 - ts1
+        ttr = ttr_ns / 1e9
 
-        # adds the ttr to the total ttr
+        # adds the ttr to the total ttr and the
+        # latency histogram for this register
         self.add_ttr(ttr)
+        histogram = self.ttr_histograms.get(name)
+        if histogram is None:
+            histogram = self.ttr_histograms[name] = latency.LatencyHistogram()
+        # end if
+        histogram.record(ttr_ns)
 
-        # instatiates the reading object
-        reading = model.Reading(name, self.i2c_address, address,
-                                ttr, raw, self.series.get_id())
-
-        # sets the data on the reading
-        if data_type == "temperature":
-            reading.set_data(model.Temperature(raw * conversion))
-        elif data_type == "emissivity":
-            reading.set_data(model.Emissivity(raw * conversion))
-        else:
+        # instatiates the reading object and sets the data
+        # on it
+        if data_type not in ("temperature", "emissivity"):
             print("ERROR: UNSUPPORTED DATA TYPE IN READ_DEVICE METHOD")
         # end if
+        reading = model.new_reading(name, self.i2c_address, address,
+                                    ttr, raw, self.series.get_id(),
+                                    conversion, data_type,
+                                    timestamp=timestamp)
+
+        # series statistics for this register
+        series_stats = self.series_stats.get(name)
+        if series_stats is None:
+            series_stats = self.series_stats[name] = stats.SeriesStats(self.ewma_alpha)
+            self.__stats_addresses__[name] = address
+        # end if
+        series_stats.add(reading.get_value(), timestamp)
 
         # keeps track of the max time to read value
         # and data object that it occured at.
@@ -180,72 +295,238 @@ class Sensor(object):
         return reading
     # end read_address
 
-    def take_readings(self, reading_count=None, sample_rate=0.25):
+    def new_series(self):
+        # starts a new series id and resets the ttr, without
+        # reading anything
+
+        # the series before this one is over
+        if not self.__series_ended__:
+            self.end_series()
+        # end if
 
         # this is where we need to set the series id
         self.series = model.Series(time.time())
+        self.series_stats = {}
+        self.__stats_addresses__ = {}
+        self.__series_ended__ = False
 
         # add the series object in the data queue
-        self.db_interface.add_data(self.series)
+        if self.db_interface is not None:
+            self.db_interface.add_data(self.series)
+        # end if
 
         # reinitialize total_ttr in case this methos
         # gets called more than once
         self.reset_total_ttr()
+    # end new_series()
+
+    def end_series(self):
+        # ends the current series, logging a SeriesSummary for
+        # every register read in it. returns the summaries.
+        if self.series is None or self.__series_ended__:
+            return []
+        # end if
+        self.__series_ended__ = True
+        summaries = []
+        for name, series_stats in self.series_stats.items():
+            running = series_stats.running
+            summary = model.SeriesSummary(self.series.get_id(), name, self.i2c_address,
+                                          self.__stats_addresses__[name],
+                                          series_stats.first_time, series_stats.last_time,
+                                          running.count, running.minimum, running.maximum,
+                                          running.mean, running.get_stddev(),
+                                          series_stats.ewma, series_stats.get_slope())
+            summaries.append(summary)
+            if self.db_interface is not None:
+                self.db_interface.add_data(summary)
+            # end if
+        # end for
+
+        # the callbacks catch up with the end of the series
+        if self.dispatcher is not None:
+            self.dispatcher.flush()
+        # end if
+        return summaries
+    # end end_series()
+
+    def get_callback_stats(self):
+        # delivery, backlog and stall counters of the callback
+        # dispatcher, None without one
+        if self.dispatcher is None:
+            return None
+        # end if
+        return self.dispatcher.get_stats()
+    # end get_callback_stats()
+
+    def close(self):
+        # ends the series and stops the callback dispatcher
+        self.end_series()
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        # end if
+    # end close()
+
+    def get_series_stats(self, name=None):
+        # returns the running statistics of the current series
+        # (count, min, max, mean, stddev, ewma, slope, ...) for one
+        # register, or for all of them keyed by name
+        if name is not None:
+            series_stats = self.series_stats.get(name)
+            return None if series_stats is None else series_stats.get_stats()
+        # end if
+        return dict((_name, series_stats.get_stats())
+                    for _name, series_stats in self.series_stats.items())
+    # end get_series_stats()
+
+    def read_ambient(self):
+        return self.read_device(self.ambient_address, "ambient", 0.02, "temperature")
+    # end read_ambient()
+
+    def read_emissivity(self):
+        return self.read_device(self.emissivity_address, "emissivity", (1/65535), "emissivity")
+    # end read_emissivity()
+
+    def read_object(self):
+        # reads the object temperature and keeps track of the
+        # maximum object reading
+        object_reading = self.read_device(self.object_address, "object", 0.02, "temperature")
+        kelvin = object_reading.get_data().get_kelvin()
+        if kelvin > self.max_object_temp:
+            self.max_object_temp = kelvin
+            self.max_object_temp_reading = object_reading
+        # end if
+        return object_reading
+    # end read_object()
+
+    def begin_series(self):
+        # starts a new series. this sets the series id, resets
+        # the ttr and takes the ambient and emissivity readings
+        # that go at the top of every series.
+        self.new_series()
 
         # take the ambient reading first.
-        ambient_reading = self.read_device(self.ambient_address, "ambient", 0.02, "temperature")
+        ambient_reading = self.read_ambient()
 
         # we call the on_data event to let the main
         # program access the reported data.
         self.__on_data__(ambient_reading)
         
         # take the emissivity reading
-        emissivity_reading = self.read_device(self.emissivity_address, "emissivity", (1/65535), "emissivity")
+        emissivity_reading = self.read_emissivity()
 
         # fire the on_data event so the main routine
         # can print the data
         self.__on_data__(emissivity_reading)
+    # end begin_series()
+
+    def sample(self):
+        # takes one object reading in the current series and
+        # returns it
+
+        # take the readings
+        object_reading = self.read_object()
+
+        # this calls the on_data callback event
+        self.__on_data__(object_reading)
+
+        return object_reading
+    # end sample()
+
+    async def stream(self, sample_rate=0.25, reading_count=None,
+                     catch_up=False, executor=None):
+        # asyncio version of take_readings. starts a new series
+        # and yields the ambient, emissivity and then the object
+        # readings as they are taken:
+        #
+        #     async for reading in sensor.stream(0.01):
+        #
+        # the bus reads run in the executor (the loop's default
+        # one if none is given) so the event loop is never held
+        # up by the i2c transfer. the on_data callback is not
+        # called, the caller gets the readings instead. without
+        # a db_interface the series summaries are yielded last,
+        # so whatever logs the readings logs those too.
+        loop = asyncio.get_running_loop()
+        self.scheduler = scheduler.DeadlineScheduler(sample_rate, catch_up)
+
+        self.new_series()
+        yield await loop.run_in_executor(executor, self.read_ambient)
+        yield await loop.run_in_executor(executor, self.read_emissivity)
 
-        # volitile boolean that will break the loop
-        # if set to false.
-        looping = True
+        _index = 0
+        self.scheduler.start()
+        while reading_count is None or _index < reading_count:
+            delay = self.scheduler.get_deadline() - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # end if
+            self.scheduler.tick()
+
+            yield await loop.run_in_executor(executor, self.read_object)
+            _index = _index + 1
+        # end while
+        summaries = self.end_series()
+        if self.db_interface is None:
+            for summary in summaries:
+                yield summary
+            # end for
+        # end if
+    # end stream()
+
+    def iter_readings(self, reading_count=None, sample_rate=0.25,
+                      catch_up=False):
+        # generator version of take_readings. starts a new series
+        # and yields the ambient and emissivity readings, then an
+        # object reading at every sample instant. nothing is sent
+        # to on_data or the database, that is up to the caller
+        # (see the pipeline module). the series itself is still
+        # added to the database interface if there is one.
+
+        # the object readings are timed off a deadline
+        # scheduler, so the sample instants stay on the
+        # sample rate however long each sample takes. see
+        # scheduler.DeadlineScheduler for what catch_up does.
+        self.scheduler = scheduler.DeadlineScheduler(sample_rate, catch_up)
+
+        # new series id, ambient and emissivity readings
+        self.new_series()
+        yield self.read_ambient()
+        yield self.read_emissivity()
 
         # index local variable to keep track of how
         # many iterations took place. If it gets to the read count
         # then it will break the loop.
         _index = 0
-        while looping:
-
-            # take the readings
-            object_reading = self.read_device(self.object_address, "object", 0.02, "temperature")
-
-            # keep track of the maximum object reading
-            if object_reading.get_data().get_kelvin() > self.max_object_temp:
-                self.max_object_temp = object_reading.get_data().get_kelvin()
-                self.max_object_temp_reading = object_reading
-            # end if
-
-            # this calls the on_data callback event
-            self.__on_data__(object_reading)
-
-            # time to sleep. Since we build in a defualt time
-            # between readings based off of the datasheet. We
-            # will subtract this time from the sample rate. Because
-            # we already slept that long on the last reading
-            sleep_time = sample_rate - self.read_interval
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-            # end if
-
-            # this code breaks out of the loop if a reading
-            # count is specified.
-            if reading_count is not None:
-                if _index == reading_count - 1:
-                    looping = False
-                else:
-                    _index = _index + 1
-                # end if
-            # end if
+        self.scheduler.start()
+        while reading_count is None or _index < reading_count:
+
+            # wait for the next sample instant
+            self.scheduler.wait()
+
+            # take the object reading
+            yield self.read_object()
+            _index = _index + 1
+        # end while
+
+        # log the series summaries
+        self.end_series()
+    # end iter_readings
+
+    def take_readings(self, reading_count=None, sample_rate=0.25,
+                      catch_up=False):
+        # takes the readings and fires the on_data event (and
+        # the database logging) for each one
+        for reading in self.iter_readings(reading_count, sample_rate, catch_up):
+            self.__on_data__(reading)
         # end for
     # end take_readings
+
+    def get_schedule_stats(self):
+        # returns the sampling stats of the last run: achieved
+        # rate, jitter, overruns and missed slots
+        if self.scheduler is None:
+            return None
+        # end if
+        return self.scheduler.get_stats()
+    # end get_schedule_stats()
 # end of i2c sensor_count class
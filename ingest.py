@@ -0,0 +1,205 @@
+# -----------------------------------------------------------
+# Ingest queue module
+# purpose: bounded, thread safe queue that sits between the
+# sensor and the database writer thread. the sensor side
+# only ever pays O(1) to put an object in, and when the
+# queue is full one of the overflow policies decides what
+# happens to the new object.
+# -----------------------------------------------------------
+import collections
+import threading
+import time
+
+# overflow policies
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_NEWEST = "drop_newest"
+POLICY_SPILL = "spill"
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_SPILL)
+
+class IngestQueue(object):
+    """
+        IngestQueue - bounded queue for the database writer
+        Constructor:
+            max_size - maximum number of objects held in memory
+            policy - what to do with a new object when the queue
+                     is full:
+                        block - the producer waits for room
+                        drop_oldest - the oldest queued object is dropped
+                        drop_newest - the new object is dropped
+                        spill - the new object is handed to on_spill
+            on_spill - callback taking the object that did not fit,
+                       required for the spill policy
+            block_timeout - for the block policy, how long the producer
+                            waits before the new object is dropped. None
+                            waits forever.
+    """
+    def __init__(self, max_size=100000, policy=POLICY_DROP_OLDEST,
+                 on_spill=None, block_timeout=None):
+        super(IngestQueue, self).__init__()
+
+        if policy not in POLICIES:
+            raise ValueError("unsupported overflow policy %s" % policy)
+        # end if
+        if policy == POLICY_SPILL and on_spill is None:
+            raise ValueError("the spill policy needs an on_spill callback")
+        # end if
+
+        self.max_size = max_size
+        self.policy = policy
+        self.on_spill = on_spill
+        self.block_timeout = block_timeout
+
+        self.__items__ = collections.deque()
+        self.__condition__ = threading.Condition()
+
+        # number of objects the consumer is waiting for. the
+        # producer only wakes the consumer once this many
+        # objects are queued, not on every put.
+        self.__wanted__ = 1
+
+        # set by wake() to get a consumer out of wait()
+        self.__woken__ = False
+
+        # counters
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_water = 0
+    # end __init__()
+
+    def __len__(self):
+        return self.__items__.__len__()
+    # end __len__()
+
+    def put(self, item):
+        # puts an object on the back of the queue. returns True
+        # if the object was queued, False if it was dropped or
+        # spilled.
+        spill = False
+        with self.__condition__:
+            if self.__items__.__len__() >= self.max_size:
+                if self.policy == POLICY_BLOCK:
+                    if not self.__condition__.wait_for(self.__has_room__, self.block_timeout):
+                        self.dropped = self.dropped + 1
+                        return False
+                    # end if
+                elif self.policy == POLICY_DROP_OLDEST:
+                    self.__items__.popleft()
+                    self.dropped = self.dropped + 1
+                elif self.policy == POLICY_DROP_NEWEST:
+                    self.dropped = self.dropped + 1
+                    return False
+                else:
+                    self.spilled = self.spilled + 1
+                    spill = True
+                # end if
+            # end if
+
+            if not spill:
+                self.__items__.append(item)
+                self.enqueued = self.enqueued + 1
+                _length = self.__items__.__len__()
+                if _length > self.high_water:
+                    self.high_water = _length
+                # end if
+                if _length >= self.__wanted__:
+                    self.__condition__.notify_all()
+                # end if
+            # end if
+        # end with
+
+        # the spill callback is called outside of the lock so a
+        # slow disk write does not hold up the writer thread.
+        if spill:
+            self.on_spill(item)
+            return False
+        # end if
+        return True
+    # end put()
+
+    def put_front(self, items):
+        # puts objects back on the front of the queue, in order.
+        # this is for batches that failed to write. they were
+        # already counted when they came in, so they are allowed
+        # past the size limit rather than being dropped.
+        with self.__condition__:
+            self.__items__.extendleft(reversed(items))
+            self.dequeued = self.dequeued - items.__len__()
+            self.__condition__.notify_all()
+        # end with
+    # end put_front()
+
+    def get_batch(self, max_items, timeout=0):
+        # takes up to max_items objects off the front of the
+        # queue. if fewer than max_items are queued, waits up to
+        # timeout seconds for more to arrive before returning
+        # whatever is there (which may be nothing).
+        with self.__condition__:
+            if self.__items__.__len__() < max_items and timeout > 0:
+                self.__wanted__ = max_items
+                deadline = time.monotonic() + timeout
+                remaining = timeout
+                while self.__items__.__len__() < max_items and remaining > 0:
+                    self.__condition__.wait(remaining)
+                    remaining = deadline - time.monotonic()
+                # end while
+                self.__wanted__ = 1
+            # end if
+
+            _count = min(max_items, self.__items__.__len__())
+            batch = [self.__items__.popleft() for _ in range(_count)]
+            self.dequeued = self.dequeued + _count
+
+            # wakes any producers blocked on a full queue
+            if _count > 0 and self.policy == POLICY_BLOCK:
+                self.__condition__.notify_all()
+            # end if
+        # end with
+        return batch
+    # end get_batch()
+
+    def wait(self, timeout=None):
+        # waits until there is something on the queue, wake() is
+        # called or timeout seconds go by. returns True if there
+        # is something on the queue.
+        with self.__condition__:
+            if self.__items__.__len__() == 0 and not self.__woken__:
+                self.__condition__.wait_for(lambda: self.__items__.__len__() > 0 or self.__woken__,
+                                            timeout)
+            # end if
+            self.__woken__ = False
+            return self.__items__.__len__() > 0
+        # end with
+    # end wait()
+
+    def wake(self):
+        # gets the consumer out of wait() even if the queue is
+        # empty, for shutting it down
+        with self.__condition__:
+            self.__woken__ = True
+            self.__condition__.notify_all()
+        # end with
+    # end wake()
+
+    def get_stats(self):
+        # returns the queue counters as a dictionary
+        with self.__condition__:
+            return {
+                "depth": self.__items__.__len__(),
+                "max_size": self.max_size,
+                "policy": self.policy,
+                "enqueued": self.enqueued,
+                "dequeued": self.dequeued,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "high_water": self.high_water,
+            }
+        # end with
+    # end get_stats()
+
+    def __has_room__(self):
+        return self.__items__.__len__() < self.max_size
+    # end __has_room__()
+# end IngestQueue class
@@ -0,0 +1,170 @@
+# -----------------------------------------------------------
+# Latency module
+# purpose: fixed memory latency histogram. durations are
+# recorded in nanoseconds into log spaced buckets (16 per
+# power of two, so any bucket is within about 6% of the
+# values in it) and percentiles are read back off the
+# bucket counts. histograms can be saved as a snapshot
+# dictionary and merged, so runs can be added together.
+# -----------------------------------------------------------
+from array import array
+
+# buckets per power of two. values below 2 * SUB_BUCKETS
+# nanoseconds get a bucket each.
+SUB_BUCKETS = 16
+SUB_BUCKET_BITS = 4
+
+# largest power of two tracked, anything above 2^40 ns
+# (about 18 minutes) goes in the last bucket
+MAX_SHIFT = 40
+BUCKET_COUNT = (MAX_SHIFT + 2) * SUB_BUCKETS
+
+def bucket_index(value):
+    # returns the bucket a duration in nanoseconds goes in
+    if value < 2 * SUB_BUCKETS:
+        return max(value, 0)
+    # end if
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    if shift > MAX_SHIFT:
+        return BUCKET_COUNT - 1
+    # end if
+    return shift * SUB_BUCKETS + (value >> shift)
+# end bucket_index()
+
+def bucket_value(index):
+    # returns the middle of the range of values in a bucket
+    if index < 2 * SUB_BUCKETS:
+        return index
+    # end if
+    shift = index // SUB_BUCKETS - 1
+    mantissa = index - shift * SUB_BUCKETS
+    return (mantissa << shift) + ((1 << shift) >> 1)
+# end bucket_value()
+
+class LatencyHistogram(object):
+    """
+        LatencyHistogram - log bucketed histogram of durations
+        Methods:
+            record - adds one duration in nanoseconds
+            percentile - duration in nanoseconds at a percentile (0-100)
+            get_stats - count, mean, min, max and percentiles in seconds
+            snapshot / from_snapshot - to and from a plain dictionary
+            merge - adds another histogram's counts into this one
+    """
+    def __init__(self):
+        super(LatencyHistogram, self).__init__()
+        self.counts = array("Q", bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+    # end __init__()
+
+    def record(self, value):
+        self.counts[bucket_index(value)] += 1
+        self.count = self.count + 1
+        self.total = self.total + value
+        if self.min is None or value < self.min:
+            self.min = value
+        # end if
+        if self.max is None or value > self.max:
+            self.max = value
+        # end if
+    # end record()
+
+    def reset(self):
+        self.counts = array("Q", bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+    # end reset()
+
+    def percentile(self, percent):
+        # walks the buckets until the running count passes the
+        # requested rank. returns None if nothing was recorded.
+        if self.count == 0:
+            return None
+        # end if
+        rank = max(1, int(round(self.count * percent / 100.0)))
+        running = 0
+        for index, bucket_count in enumerate(self.counts):
+            running = running + bucket_count
+            if running >= rank:
+                # the extremes are known exactly, so never report
+                # a value outside of them
+                return min(max(bucket_value(index), self.min), self.max)
+            # end if
+        # end for
+        return self.max
+    # end percentile()
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        # end if
+        return self.total / self.count
+    # end mean()
+
+    def get_stats(self, percentiles=(50, 90, 99, 99.9)):
+        # returns a dictionary of the histogram stats. durations
+        # are in seconds to match the rest of the ttr values.
+        stats = {"count": self.count,
+                 "mean": self.__seconds__(self.mean()),
+                 "min": self.__seconds__(self.min),
+                 "max": self.__seconds__(self.max)}
+        for percent in percentiles:
+            stats["p%s" % ("%g" % percent).replace(".", "")] = \
+                self.__seconds__(self.percentile(percent))
+        # end for
+        return stats
+    # end get_stats()
+
+    def merge(self, other):
+        # adds the counts of another histogram into this one
+        for index, bucket_count in enumerate(other.counts):
+            if bucket_count:
+                self.counts[index] += bucket_count
+            # end if
+        # end for
+        self.count = self.count + other.count
+        self.total = self.total + other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        # end if
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        # end if
+        return self
+    # end merge()
+
+    def snapshot(self):
+        # plain dictionary of the histogram, only the buckets
+        # that have counts in them are kept
+        return {"count": self.count, "total": self.total,
+                "min": self.min, "max": self.max,
+                "buckets": dict((str(index), bucket_count)
+                                for index, bucket_count in enumerate(self.counts)
+                                if bucket_count)}
+    # end snapshot()
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        histogram = cls()
+        for index, bucket_count in snapshot["buckets"].items():
+            histogram.counts[int(index)] = bucket_count
+        # end for
+        histogram.count = snapshot["count"]
+        histogram.total = snapshot["total"]
+        histogram.min = snapshot["min"]
+        histogram.max = snapshot["max"]
+        return histogram
+    # end from_snapshot()
+
+    def __seconds__(self, value):
+        if value is None:
+            return None
+        # end if
+        return value / 1e9
+    # end __seconds__()
+# end LatencyHistogram class
@@ -41,7 +41,11 @@
 # same directory as this main_count.py file
 import i2c_sensor
 import db
-import time
+import aggregate
+import deadband
+import sinks
+import shm_ring
+import metrics
 
 # program variables adjustable
 # sample rate in seconds
@@ -65,6 +69,47 @@ DEVICE_ADDRESS = 0x5a
 # to take
 READING_COUNT = 100
 
+# where the readings are stored, see sinks.open_sink. use
+# {"type": "sqlite", "path": "readings.db"} or
+# {"type": "binary", "path": "readings.bin"} to log to
+# local files instead of the mysql server. add
+# "schema": "compact" to write the one table layout (see
+# migrate.py).
+SINK_CONFIG = {"type": "mysql", "config_file": "mysql_config.json"}
+
+# log from a separate writer process, fed through a shared
+# memory ring, so the database work does not slow down the
+# sensor loop. only raw readings go through the ring, so
+# leave AGGREGATE_WINDOW as None with this on.
+WRITER_PROCESS = False
+
+# number of object readings summed up into each row of
+# tbl_aggregate. None logs every raw reading instead.
+AGGREGATE_WINDOW = None
+
+# object temperature deadband in kelvin. readings that move
+# less than this are not logged, apart from one every
+# DEADBAND_HEARTBEAT seconds. None logs every reading.
+DEADBAND_KELVIN = None
+DEADBAND_HEARTBEAT = 60.0
+
+# seconds to wait at the end for the readings to be logged.
+# whatever is still not logged after that (the server is down
+# and there is no spool) is given up on so the program can
+# exit.
+CLOSE_TIMEOUT = 30.0
+
+# call on_data from a dispatcher thread, so printing the
+# readings does not slow down the sampling
+ASYNC_CALLBACKS = True
+
+# live metrics in the prometheus text format. METRICS_PORT
+# serves them on http://127.0.0.1:<port>/metrics and
+# METRICS_FILE writes them to a file every few seconds.
+# None turns either off.
+METRICS_PORT = None
+METRICS_FILE = None
+
 # on_data - callback method for the class
 # the output can be used for further processing
 # here.
@@ -78,12 +123,53 @@ def on_data(data_reading):
 if __name__ == '__main__':
 
     # create the class that will interact with the database
-    db_interface = db.Interface("mysql_config.json")
+    if WRITER_PROCESS:
+        db_interface = shm_ring.ProcessSink(SINK_CONFIG)
+    else:
+        db_interface = sinks.open_sink(SINK_CONFIG)
+    # end if
+
+    # if aggregation is turned on, the sensor logs through
+    # the window aggregator instead of straight to the db
+    aggregator = None
+    sensor_interface = db_interface
+    if AGGREGATE_WINDOW is not None:
+        aggregator = aggregate.WindowAggregator(db_interface, window_size=AGGREGATE_WINDOW)
+        sensor_interface = aggregator
+    # end if
+
+    # the deadband filter goes in front of everything else
+    deadband_filter = None
+    if DEADBAND_KELVIN is not None:
+        deadband_filter = deadband.DeadbandFilter(sensor_interface,
+                                                  {"object": deadband.Deadband(absolute=DEADBAND_KELVIN)},
+                                                  DEADBAND_HEARTBEAT)
+        sensor_interface = deadband_filter
+    # end if
 
     # instantiates the I2CSensor class. When the data is read
     # from the sensor, the on_data method will be called.
     sensor = i2c_sensor.Sensor(address=DEVICE_ADDRESS, bus=None,
-                               on_data=on_data, db_interface=db_interface)
+                               on_data=on_data, db_interface=sensor_interface,
+                               async_callbacks=ASYNC_CALLBACKS)
+
+    # metrics from the sensor and whichever sink is logging
+    metrics_file = None
+    if METRICS_PORT is not None or METRICS_FILE is not None:
+        registry = metrics.Metrics()
+        registry.add_sensor(sensor)
+        if isinstance(db_interface, db.Interface):
+            registry.add_interface(db_interface)
+        elif isinstance(db_interface, shm_ring.ProcessSink):
+            registry.add_stats("writer_process", db_interface.get_stats)
+        # end if
+        if METRICS_PORT is not None:
+            metrics.MetricsServer(registry, METRICS_PORT).start()
+        # end if
+        if METRICS_FILE is not None:
+            metrics_file = metrics.MetricsFile(registry, METRICS_FILE).start()
+        # end if
+    # end if
 
     # loop forever - blocking call
     # use this method if you want constant readings.
@@ -103,6 +189,12 @@ if __name__ == '__main__':
     print(" Starting to read data...")
     print("----------------------------------------------------")
     sensor.take_readings(reading_count=READING_COUNT, sample_rate=SAMPLE_RATE)
+    sensor.close()
+
+    # log the last partly full window
+    if aggregator is not None:
+        aggregator.flush()
+    # end if
 
     #comment out the above line and uncomment the one below
     #if you just want the total time printed
@@ -111,35 +203,66 @@ if __name__ == '__main__':
     print(" Total ttr %s" % round(sensor.get_total_ttr(), 4))
     print("----------------------------------------------------")
     print(" Max TTR %s" % sensor.get_max_ttr().ttr)
+    object_ttr = sensor.get_ttr_stats("object")
+    print(" Object TTR p50 %s    p99 %s    max %s" % (object_ttr["p50"], object_ttr["p99"], object_ttr["max"]))
     #print(" Max TTR READING %s" % sensor.get_max_ttr())
     print("----------------------------------------------------")
+    schedule = sensor.get_schedule_stats()
+    print(" Achieved rate %s/s    jitter %s    overruns %s    missed %s" %
+          (schedule["achieved_rate"], schedule["jitter"], schedule["overruns"], schedule["missed"]))
+    print("----------------------------------------------------")
     print(" Max Object Temperature: %s C" % sensor.get_max_object_temp().get_data().get_celcius())
+    object_stats = sensor.get_series_stats("object")
+    print(" Object mean %s K    stddev %s    slope %s K/s" %
+          (object_stats["mean"], object_stats["stddev"], object_stats["slope"]))
+    callbacks = sensor.get_callback_stats()
+    if callbacks is not None:
+        print(" Callbacks delivered %s    backlog max %s    dropped %s    stalls %s" %
+              (callbacks["delivered"], callbacks["backlog_high_water"], callbacks["dropped"],
+               callbacks["stalls"]))
+    # end if
+    if deadband_filter is not None:
+        print("----------------------------------------------------")
+        print(" Deadband: %s" % deadband_filter.get_stats(sensor.series.get_id()))
+    # end if
     #print(" Max Object Temperature READING %s" % sensor.get_max_object_temp())
     print("----------------------------------------------------")
 
-    # loop and rest while the database
-    # class is processing readings.
+    # the local file sinks and the writer process just need
+    # closing
+    if not isinstance(db_interface, db.Interface):
+        if isinstance(db_interface, shm_ring.ProcessSink):
+            db_interface.close(CLOSE_TIMEOUT)
+        else:
+            db_interface.close()
+        # end if
+        if metrics_file is not None:
+            metrics_file.stop()
+        # end if
+        print("main thread complete.")
+        raise SystemExit(0)
+    # end if
+
+    # wait for the database writer to log everything, then
+    # close the connection.
     try:
         print("waiting for db thread to complete...")
-        buffer_size1 = db_interface.data_queue.__len__()
-        print("sql records to be logged: %s" % buffer_size1)
+        print("sql records to be logged: %s" % db_interface.data_queue.__len__())
         print("logging...")
-        while db_interface.thread.is_alive():
-            #print("db thread running..buffer length=%s" % db_interface.data_queue.__len__())
-            buffer_size2 = db_interface.data_queue.__len__()
-            if buffer_size2 < buffer_size1:
-                #print("sql records to be logged: %s" % buffer_size2)
-                buffer_size1 = buffer_size2
-            # end if                
-            time.sleep(0.1)
-        # end while
-        print("db thread complete.")
+        if db_interface.close(CLOSE_TIMEOUT):
+            print("db thread complete.")
+        else:
+            print("db thread timed out, sql records not logged: %s" % db_interface.get_unsettled())
+        # end if
     except KeyboardInterrupt:
-        print("terminating db thread...could take up to 2 minutes for sql connection timeout. Output will appear regarding thread termination.")
-        while db_interface.thread.is_alive():
-            db_interface.kill()
-            time.sleep(0.1)
-        # end while
+        print("terminating db thread...")
+        db_interface.kill()
+        print("sql records not logged: %s" % db_interface.get_unsettled())
     # end try
 
+    # last write of the metrics file, with the final counts
+    if metrics_file is not None:
+        metrics_file.stop()
+    # end if
+
     print("main thread complete.")
@@ -0,0 +1,369 @@
+# -----------------------------------------------------------
+# Metrics module
+# purpose: live numbers on how the logger is doing, in the
+# prometheus text format. they can be scraped from a small
+# local http server or written to a file every few seconds
+# (for the node exporter textfile collector, or just to
+# cat while it runs):
+#
+#     registry = metrics.Metrics()
+#     registry.add_interface(db_interface)
+#     registry.add_sensor(sensor)
+#     metrics.MetricsServer(registry, port=9105).start()
+#
+# nothing is counted here, the numbers are read off the
+# counters the queue, interface, sensor and scheduler
+# already keep, when the metrics are asked for.
+# -----------------------------------------------------------
+import http.server
+import os
+import threading
+import time
+
+PREFIX = "j4055_"
+
+# quantiles the latency histograms are reported at
+QUANTILES = (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99"), ("0.999", "p999"))
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    # end if
+    return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace('"', '\\"'))
+                             for key, value in sorted(labels.items()))
+# end format_labels()
+
+class Metrics(object):
+    """
+        Metrics - collects metrics from the parts of the logger
+        Every source is a function that returns a list of
+        (name, type, help, labels, value) tuples. The add_ methods
+        add the sources for the usual parts.
+
+        Methods:
+            add_source - adds a function returning metric tuples
+            add_interface - queue, write and connection metrics of a
+                            db.Interface
+            add_queue - depth and counters of an ingest.IngestQueue
+            add_sensor - ttr percentiles and sampling of a Sensor
+            add_stats - numbers from any get_stats() dictionary
+            render - all of it in the prometheus text format
+            write_file - render to a file
+    """
+    def __init__(self):
+        super(Metrics, self).__init__()
+        self.sources = []
+        self.__lock__ = threading.Lock()
+
+        # last value and time of each counter a rate is worked
+        # out for
+        self.__last_counts__ = {}
+    # end __init__()
+
+    def add_source(self, source):
+        self.sources.append(source)
+    # end add_source()
+
+    def add_queue(self, queue, name="ingest"):
+        def source():
+            stats = queue.get_stats()
+            labels = {"queue": name}
+            return [
+                ("queue_depth", "gauge", "objects waiting in the queue", labels, stats["depth"]),
+                ("queue_max_size", "gauge", "most objects the queue holds", labels, stats["max_size"]),
+                ("queue_high_water", "gauge", "deepest the queue has been", labels, stats["high_water"]),
+                ("queue_enqueued_total", "counter", "objects put on the queue", labels, stats["enqueued"]),
+                ("queue_dequeued_total", "counter", "objects taken off the queue", labels, stats["dequeued"]),
+                ("queue_dropped_total", "counter", "objects dropped by the overflow policy", labels, stats["dropped"]),
+                ("queue_spilled_total", "counter", "objects spilled by the overflow policy", labels, stats["spilled"]),
+                ("queue_enqueue_rate", "gauge", "objects put on the queue per second since the last collect",
+                 labels, self.__rate__(("enqueued", name), stats["enqueued"])),
+                ("queue_dequeue_rate", "gauge", "objects taken off the queue per second since the last collect",
+                 labels, self.__rate__(("dequeued", name), stats["dequeued"])),
+            ]
+        # end source()
+        self.add_source(source)
+    # end add_queue()
+
+    def add_interface(self, db_interface, name="mysql"):
+        # db.Interface: its queue, batch writes, reconnects and
+        # the spool if it has one
+        self.add_queue(db_interface.data_queue, name)
+
+        def source():
+            labels = {"sink": name}
+            metrics = [
+                ("rows_written_total", "counter", "rows inserted", labels, db_interface.rows_written),
+                ("batches_written_total", "counter", "batches committed", labels, db_interface.batches_written),
+                ("batches_failed_total", "counter", "batches that failed to commit", labels,
+                 db_interface.batches_failed),
+                ("rejected_total", "counter", "objects given up on or turned down by the server",
+                 labels, db_interface.rejected),
+                ("connect_failures_total", "counter", "failed connects to the server", labels,
+                 db_interface.connect_failures),
+                ("reconnects_total", "counter", "connects after a connection was lost", labels,
+                 db_interface.reconnects),
+                ("connected", "gauge", "1 while the writer holds a working connection", labels,
+                 1 if db_interface.is_connected() else 0),
+                ("rows_written_rate", "gauge", "rows inserted per second since the last collect",
+                 labels, self.__rate__(("rows", name), db_interface.rows_written)),
+            ]
+            metrics.extend(self.__histogram__("batch_write_seconds", "batch insert to commit time",
+                                              labels, db_interface.write_latency.get_stats()))
+            if db_interface.spool is not None:
+                spool_stats = db_interface.spool.get_stats()
+                for key, value in spool_stats.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        metrics.append(("spool_%s" % key, "gauge", "spool %s" % key, labels, value))
+                    # end if
+                # end for
+            # end if
+            return metrics
+        # end source()
+        self.add_source(source)
+    # end add_interface()
+
+    def add_sensor(self, sensor):
+        # ttr percentiles of each register, and the sampling of
+        # the last run
+        def source():
+            labels = {"address": hex(sensor.i2c_address)}
+            metrics = [("total_ttr_seconds", "gauge", "time spent on bus reads this series",
+                        labels, sensor.get_total_ttr())]
+            for _name, histogram in list(sensor.ttr_histograms.items()):
+                register_labels = dict(labels, register=_name)
+                metrics.extend(self.__histogram__("ttr_seconds", "time to read a register",
+                                                  register_labels, histogram.get_stats()))
+            # end for
+            schedule = sensor.get_schedule_stats()
+            if schedule is not None:
+                metrics.extend([
+                    ("samples_total", "counter", "samples taken this run", labels, schedule["samples"]),
+                    ("sample_rate_target", "gauge", "samples per second asked for", labels,
+                     schedule["target_rate"]),
+                    ("sample_rate_achieved", "gauge", "samples per second taken", labels,
+                     schedule["achieved_rate"]),
+                    ("sample_jitter_seconds", "gauge", "spread of the sample lateness", labels,
+                     schedule["jitter"]),
+                    ("sample_overruns_total", "counter", "samples that started late", labels,
+                     schedule["overruns"]),
+                    ("sample_missed_total", "counter", "sample slots skipped", labels, schedule["missed"]),
+                ])
+            # end if
+            callbacks = sensor.get_callback_stats()
+            if callbacks is not None:
+                metrics.extend([
+                    ("callback_delivered_total", "counter", "readings handed to the callbacks", labels,
+                     callbacks["delivered"]),
+                    ("callback_backlog", "gauge", "readings waiting for the callbacks", labels,
+                     callbacks["backlog"]),
+                    ("callback_dropped_total", "counter", "readings the callbacks fell too far behind on",
+                     labels, callbacks["dropped"]),
+                    ("callback_stalls_total", "counter", "callback batches over the stall threshold",
+                     labels, callbacks["stalls"]),
+                    ("callback_errors_total", "counter", "callbacks that raised", labels,
+                     callbacks["errors"]),
+                ])
+                metrics.extend(self.__histogram__("callback_seconds", "time the callbacks took per batch",
+                                                  labels, callbacks["callback_time"]))
+            # end if
+            return metrics
+        # end source()
+        self.add_source(source)
+    # end add_sensor()
+
+    def add_stats(self, name, get_stats, labels=None):
+        # every number in the dictionary get_stats returns, as a
+        # gauge named name_key. for the parts that only have a
+        # get_stats (shm_ring.ProcessSink, ConnectionPool, ...)
+        labels = labels or {}
+
+        def source():
+            metrics = []
+            for key, value in get_stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metrics.append(("%s_%s" % (name, key), "gauge", "%s %s" % (name, key),
+                                    labels, value))
+                # end if
+            # end for
+            return metrics
+        # end source()
+        self.add_source(source)
+    # end add_stats()
+
+    def collect(self):
+        # every metric from every source. a source that fails is
+        # left out so the rest still get through.
+        metrics = []
+        with self.__lock__:
+            for source in self.sources:
+                try:
+                    metrics.extend(source())
+                except Exception as ex:
+                    print("METRICS ERROR: %s" % ex)
+                # end try
+            # end for
+        # end with
+        return metrics
+    # end collect()
+
+    def render(self):
+        # prometheus text format, the samples of a metric grouped
+        # under one HELP and TYPE. the _count and _sum of a
+        # summary go in with its quantiles.
+        families = {}
+        order = []
+        for name, metric_type, help_text, labels, value in self.collect():
+            if value is None:
+                continue
+            # end if
+            family = name
+            if metric_type == "summary" and name.endswith(("_count", "_sum")):
+                family = name.rsplit("_", 1)[0]
+            # end if
+            if family not in families:
+                families[family] = (metric_type, help_text, [])
+                order.append(family)
+            # end if
+            families[family][2].append("%s%s%s %s" % (PREFIX, name, format_labels(labels), repr(float(value))))
+        # end for
+        lines = []
+        for name in order:
+            metric_type, help_text, samples = families[name]
+            lines.append("# HELP %s%s %s" % (PREFIX, name, help_text))
+            lines.append("# TYPE %s%s %s" % (PREFIX, name, metric_type))
+            lines.extend(samples)
+        # end for
+        return "\n".join(lines) + "\n"
+    # end render()
+
+    def write_file(self, path):
+        # written to a temporary file and moved over the old one,
+        # so a reader never sees half a file
+        temporary = path + ".tmp"
+        with open(temporary, "w") as handle:
+            handle.write(self.render())
+        # end with
+        os.replace(temporary, path)
+    # end write_file()
+
+    def __rate__(self, key, count):
+        now = time.monotonic()
+        last = self.__last_counts__.get(key)
+        self.__last_counts__[key] = (now, count)
+        if last is None or now <= last[0]:
+            return None
+        # end if
+        return (count - last[1]) / (now - last[0])
+    # end __rate__()
+
+    def __histogram__(self, name, help_text, labels, stats):
+        # a latency.LatencyHistogram get_stats as a summary
+        metrics = []
+        for quantile, key in QUANTILES:
+            metrics.append((name, "summary", help_text, dict(labels, quantile=quantile), stats[key]))
+        # end for
+        mean = stats["mean"] or 0.0
+        metrics.append(("%s_count" % name, "summary", help_text, labels, stats["count"]))
+        metrics.append(("%s_sum" % name, "summary", help_text, labels, mean * stats["count"]))
+        metrics.append(("%s_max" % name, "gauge", help_text, labels, stats["max"]))
+        return metrics
+    # end __histogram__()
+# end Metrics class
+
+class MetricsServer(object):
+    """
+        MetricsServer - serves the metrics over http on a thread
+        GET /metrics returns Metrics.render(). It listens on the
+        loopback address unless told otherwise.
+        Constructor:
+            metrics - the Metrics to serve
+            port - tcp port
+            host - address to listen on
+    """
+    def __init__(self, metrics, port=9105, host="127.0.0.1"):
+        super(MetricsServer, self).__init__()
+        self.metrics = metrics
+        registry = metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                # end if
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(body.__len__()))
+                self.end_headers()
+                self.wfile.write(body)
+            # end do_GET()
+
+            def log_message(self, format, *args):
+                # scrapes are not printed
+                pass
+            # end log_message()
+        # end Handler class
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+    # end __init__()
+
+    def start(self):
+        self.thread.start()
+        return self
+    # end start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    # end stop()
+# end MetricsServer class
+
+class MetricsFile(object):
+    """
+        MetricsFile - writes the metrics to a file every interval
+        seconds on a thread, and once more when stopped
+        Constructor:
+            metrics - the Metrics to write
+            path - file written
+            interval - seconds between writes
+    """
+    def __init__(self, metrics, path, interval=5.0):
+        super(MetricsFile, self).__init__()
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.__stop__ = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+    # end __init__()
+
+    def start(self):
+        self.thread.start()
+        return self
+    # end start()
+
+    def run(self):
+        while not self.__stop__.wait(self.interval):
+            self.__write__()
+        # end while
+    # end run()
+
+    def stop(self):
+        self.__stop__.set()
+        self.thread.join()
+        self.__write__()
+    # end stop()
+
+    def __write__(self):
+        try:
+            self.metrics.write_file(self.path)
+        except Exception as ex:
+            print("METRICS FILE ERROR: %s" % ex)
+        # end try
+    # end __write__()
+# end MetricsFile class
@@ -0,0 +1,137 @@
+# -----------------------------------------------------------
+# Migrate
+# purpose: backfills the compact schema (tbl_sample, see
+# db.SCHEMA_COMPACT) from the classic tables. every reading
+# with a row in tbl_temperature or tbl_emissivity becomes
+# one tbl_sample row. the classic tables are left alone.
+#
+# the classic tables do not keep the time a reading was
+# taken, so ts is made up from the series id (the time the
+# series started) plus one microsecond for every reading
+# id since the first one in the series. that keeps the
+# readings in order and the keys unique. the raw word is
+# worked back out from kelvin (0.02 K a count) or from the
+# emissivity value (1/65535 a count).
+#
+# readings are copied a chunk of ids at a time, one
+# transaction each, with INSERT IGNORE, so the tool can be
+# stopped and run again and it carries on.
+#
+# TO RUN:   python3 migrate.py --config mysql_config.json
+#           then set "schema": "compact" in main.SINK_CONFIG
+# -----------------------------------------------------------
+import argparse
+import time
+import db
+
+# first reading id of every series, for making up ts
+SQL_CREATE_SERIES_FIRST = (
+                           "CREATE TEMPORARY TABLE tmp_series_first "
+                           "(series_id DOUBLE NOT NULL PRIMARY KEY, first_id BIGINT NOT NULL) "
+                           "SELECT series_id, MIN(id) AS first_id FROM tbl_reading GROUP BY series_id"
+                          )
+SQL_READING_ID_RANGE = "SELECT MIN(id), MAX(id) FROM tbl_reading"
+SQL_BACKFILL_TEMPERATURE = (
+                            "INSERT IGNORE INTO tbl_sample (series_id, ts, device_address, data_address, "
+                            "location_id, raw_value, kelvin_milli, ttr) "
+                            "SELECT r.series_id, CAST(ROUND(r.series_id * 1000000) AS SIGNED) + (r.id - f.first_id), "
+                            "r.device_address, r.data_address, COALESCE(r.location_id, 0), "
+                            "LEAST(65535, GREATEST(0, ROUND(t.kelvin * 50))), ROUND(t.kelvin * 1000), r.ttr "
+                            "FROM tbl_reading r "
+                            "JOIN tbl_temperature t ON t.reading_id = r.id "
+                            "JOIN tmp_series_first f ON f.series_id = r.series_id "
+                            "WHERE r.id >= %s AND r.id < %s"
+                           )
+SQL_BACKFILL_EMISSIVITY = (
+                           "INSERT IGNORE INTO tbl_sample (series_id, ts, device_address, data_address, "
+                           "location_id, raw_value, kelvin_milli, ttr) "
+                           "SELECT r.series_id, CAST(ROUND(r.series_id * 1000000) AS SIGNED) + (r.id - f.first_id), "
+                           "r.device_address, r.data_address, COALESCE(r.location_id, 0), "
+                           "LEAST(65535, GREATEST(0, ROUND(e.value * 65535))), NULL, r.ttr "
+                           "FROM tbl_reading r "
+                           "JOIN tbl_emissivity e ON e.reading_id = r.id "
+                           "JOIN tmp_series_first f ON f.series_id = r.series_id "
+                           "WHERE r.id >= %s AND r.id < %s"
+                          )
+SQL_COUNT_READINGS = "SELECT COUNT(*) FROM tbl_reading"
+SQL_COUNT_SAMPLES = "SELECT COUNT(*) FROM tbl_sample"
+
+def connect(config_file):
+    if db.mysql is None:
+        raise RuntimeError("mysql.connector is needed to migrate")
+    # end if
+    config = db.load_config(config_file)
+    print("database configuration: %s" % db.safe_config(config))
+    return db.mysql.connector.connect(**config)
+# end connect()
+
+def backfill(connection, chunk_size=50000):
+    # copies the classic tables into tbl_sample. returns the
+    # number of rows inserted.
+    cursor = connection.cursor()
+    for sql_command in db.SQL_CREATE_COMPACT_TABLES:
+        cursor.execute(sql_command)
+    # end for
+    connection.commit()
+
+    cursor.execute(SQL_READING_ID_RANGE)
+    first_id, last_id = cursor.fetchall()[0]
+    if first_id is None:
+        print("tbl_reading is empty, nothing to migrate")
+        return 0
+    # end if
+    cursor.execute(SQL_CREATE_SERIES_FIRST)
+
+    inserted = 0
+    ts1 = time.monotonic()
+    for start in range(int(first_id), int(last_id) + 1, chunk_size):
+        end = start + chunk_size
+        cursor.execute(SQL_BACKFILL_TEMPERATURE, (start, end))
+        inserted = inserted + max(cursor.rowcount, 0)
+        cursor.execute(SQL_BACKFILL_EMISSIVITY, (start, end))
+        inserted = inserted + max(cursor.rowcount, 0)
+        connection.commit()
+
+        done = (min(end, int(last_id) + 1) - int(first_id)) / (int(last_id) + 1 - int(first_id))
+        print("ids %s to %s    %5.1f%%    %s rows    %.1fs" %
+              (start, end - 1, done * 100, inserted, time.monotonic() - ts1))
+    # end for
+    cursor.close()
+    return inserted
+# end backfill()
+
+def verify(connection):
+    # compares the row counts. readings with neither a
+    # temperature nor an emissivity row are not migrated, so
+    # tbl_sample can come up short by those.
+    cursor = connection.cursor()
+    cursor.execute(SQL_COUNT_READINGS)
+    readings = cursor.fetchall()[0][0]
+    cursor.execute(SQL_COUNT_SAMPLES)
+    samples = cursor.fetchall()[0][0]
+    cursor.close()
+    print("tbl_reading %s rows    tbl_sample %s rows" % (readings, samples))
+    return readings, samples
+# end verify()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="backfill the compact tbl_sample schema")
+    parser.add_argument("--config", default="mysql_config.json",
+                        help="mysql config file")
+    parser.add_argument("--chunk-size", type=int, default=50000,
+                        help="reading ids copied per transaction")
+    parser.add_argument("--verify-only", action="store_true",
+                        help="only compare the row counts")
+    args = parser.parse_args()
+
+    connection = connect(args.config)
+    try:
+        if not args.verify_only:
+            backfill(connection, args.chunk_size)
+        # end if
+        verify(connection)
+    finally:
+        connection.close()
+    # end try
+# end main
@@ -5,6 +5,31 @@
 # purpose: Model the datatypes of the system
 #
 ############################################
+from array import array
+
+# the data registers of the MLX90614 and how to turn the raw
+# word read from each one into a value. keyed by data address,
+# each entry is (name, conversion, data type).
+MLX90614_REGISTERS = {
+    0x6: ("ambient", 0.02, "temperature"),
+    0x7: ("object", 0.02, "temperature"),
+    0x24: ("emissivity", 1/65535, "emissivity"),
+}
+
+def new_reading(name, device_address, data_address, ttr, raw_value,
+                series_id, conversion, data_type, location_id=0,
+                timestamp=None):
+    # builds a reading and sets its temperature or emissivity
+    # data from the raw value
+    reading = Reading(name, device_address, data_address, ttr,
+                      raw_value, series_id, location_id, timestamp)
+    if data_type == "temperature":
+        reading.set_data(Temperature(raw_value * conversion))
+    elif data_type == "emissivity":
+        reading.set_data(Emissivity(raw_value * conversion))
+    # end if
+    return reading
+# end new_reading()
 
 class Series(object):
     def __init__(self, id):
@@ -16,8 +41,14 @@ class Series(object):
 # end Series class
 
 class Reading(object):
+
+    # slots keep every reading down to a fixed set of fields
+    # without a __dict__, there can be a lot of these.
+    __slots__ = ("name", "device_address", "data_address", "raw_value",
+                 "series_id", "id", "location_id", "data", "ttr", "timestamp")
+
     def __init__(self, name, device_address, data_address, ttr,
-                 raw_value, series_id, location_id=0):
+                 raw_value, series_id, location_id=0, timestamp=None):
     
         self.name = name
         self.device_address = device_address
@@ -28,6 +59,9 @@ class Reading(object):
         self.location_id = location_id
         self.data = None
         self.ttr = ttr
+
+        # time the reading was taken, in seconds since the epoch
+        self.timestamp = timestamp
         
     # end __init__()
 
@@ -56,6 +90,18 @@ class Reading(object):
         return self.data
     # end get_data
 
+    def get_value(self):
+        # returns the reading as a single number: kelvin for a
+        # temperature, the value for an emissivity, otherwise
+        # the raw value
+        if type(self.data) is Temperature:
+            return self.data.kelvin
+        elif type(self.data) is Emissivity:
+            return self.data.value
+        # end if
+        return self.raw_value
+    # end get_value
+
     def __str__(self):
         # this is the method that gets called when it is "printed"
         _string = "name: %s    device address: %s    data address: %s    data: %s" % \
@@ -64,9 +110,15 @@ class Reading(object):
 # end reading
 
 class Temperature(object):
+
+    __slots__ = ("kelvin",)
+
+    # the table is the same for every temperature, so it lives
+    # on the class rather than on each instance
+    table_name = "tbl_temperature"
+
     def __init__(self, kelvin):
         self.kelvin = kelvin
-        self.table_name = "tbl_temperature"
     # end init
 
     def get_kelvin(self, decimal_places=None):
@@ -105,6 +157,8 @@ class Temperature(object):
 
 class Emissivity(object):
 
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
     # end __init__
@@ -123,3 +177,157 @@ class Emissivity(object):
     # end __str__()
 
 # end emissivity
+
+class Aggregate(object):
+    """
+        Aggregate - summary of one window of readings from a register
+        The value summarized is kelvin for temperatures and the
+        emissivity value for emissivity readings.
+    """
+
+    __slots__ = ("series_id", "name", "device_address", "data_address",
+                 "window_start", "window_end", "count", "minimum",
+                 "maximum", "mean", "stddev")
+
+    def __init__(self, series_id, name, device_address, data_address,
+                 window_start, window_end, count, minimum, maximum,
+                 mean, stddev):
+        self.series_id = series_id
+        self.name = name
+        self.device_address = device_address
+        self.data_address = data_address
+        self.window_start = window_start
+        self.window_end = window_end
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.stddev = stddev
+    # end __init__()
+
+    def __str__(self):
+        return "name: %s    data address: %s    count: %s    min: %s    max: %s    mean: %s    stddev: %s" % \
+            (self.name, hex(self.data_address), self.count, round(self.minimum, 2),
+             round(self.maximum, 2), round(self.mean, 2), round(self.stddev, 2))
+    # end __str__()
+# end Aggregate
+
+class SeriesSummary(object):
+    """
+        SeriesSummary - statistics of one register over a whole series
+        Worked out by the sensor as the readings are taken and
+        logged once when the series ends. The value summarized is
+        kelvin for temperatures and the emissivity value for
+        emissivity readings. slope is the change per second.
+    """
+
+    __slots__ = ("series_id", "name", "device_address", "data_address",
+                 "start", "end", "count", "minimum", "maximum", "mean",
+                 "stddev", "ewma", "slope")
+
+    def __init__(self, series_id, name, device_address, data_address,
+                 start, end, count, minimum, maximum, mean, stddev,
+                 ewma, slope):
+        self.series_id = series_id
+        self.name = name
+        self.device_address = device_address
+        self.data_address = data_address
+        self.start = start
+        self.end = end
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.stddev = stddev
+        self.ewma = ewma
+        self.slope = slope
+    # end __init__()
+
+    def get_duration(self):
+        if self.start is None or self.end is None:
+            return None
+        # end if
+        return self.end - self.start
+    # end get_duration()
+
+    def __str__(self):
+        return "name: %s    data address: %s    count: %s    min: %s    max: %s    mean: %s    stddev: %s    slope: %s" % \
+            (self.name, hex(self.data_address), self.count, self.minimum,
+             self.maximum, self.mean, self.stddev, self.slope)
+    # end __str__()
+# end SeriesSummary
+
+class ReadingBatch(object):
+    """
+        ReadingBatch - columnar block of readings from one series
+        Each column is a typed array, so a batch of readings costs
+        a few bytes per row instead of three python objects.
+        Constructor:
+            series_id - the series every reading in the batch belongs to
+            registers - data address -> (name, conversion, data type),
+                        used to build readings back out of the raw values
+            location_id - location id given to the rebuilt readings
+
+        Indexing or iterating the batch gives back model.Reading
+        objects built from the row, for code that wants objects.
+    """
+
+    __slots__ = ("series_id", "registers", "location_id", "timestamps",
+                 "raw_values", "ttrs", "device_addresses", "data_addresses")
+
+    def __init__(self, series_id, registers=None, location_id=0):
+        self.series_id = series_id
+        if registers is None:
+            registers = MLX90614_REGISTERS
+        # end if
+        self.registers = registers
+        self.location_id = location_id
+
+        self.timestamps = array("d")
+        self.raw_values = array("H")
+        self.ttrs = array("d")
+        self.device_addresses = array("B")
+        self.data_addresses = array("B")
+    # end __init__()
+
+    def append(self, timestamp, device_address, data_address, raw_value, ttr):
+        self.timestamps.append(timestamp)
+        self.device_addresses.append(device_address)
+        self.data_addresses.append(data_address)
+        self.raw_values.append(raw_value)
+        self.ttrs.append(ttr)
+    # end append()
+
+    def append_reading(self, aReading):
+        self.append(aReading.timestamp, aReading.device_address,
+                    aReading.data_address, aReading.raw_value, aReading.ttr)
+    # end append_reading()
+
+    def clear(self):
+        del self.timestamps[:]
+        del self.raw_values[:]
+        del self.ttrs[:]
+        del self.device_addresses[:]
+        del self.data_addresses[:]
+    # end clear()
+
+    def __len__(self):
+        return self.timestamps.__len__()
+    # end __len__()
+
+    def __getitem__(self, index):
+        # builds the reading for one row of the batch
+        data_address = self.data_addresses[index]
+        name, conversion, data_type = self.registers[data_address]
+        return new_reading(name, self.device_addresses[index], data_address,
+                           self.ttrs[index], self.raw_values[index],
+                           self.series_id, conversion, data_type,
+                           self.location_id, self.timestamps[index])
+    # end __getitem__()
+
+    def __iter__(self):
+        for index in range(self.timestamps.__len__()):
+            yield self[index]
+        # end for
+    # end __iter__()
+# end ReadingBatch
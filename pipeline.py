@@ -0,0 +1,261 @@
+# -----------------------------------------------------------
+# Pipeline module
+# purpose: small toolkit of generator stages for readings.
+# each stage takes an iterable and lazily yields what comes
+# out of it, so readings flow from Sensor.iter_readings()
+# through the whole chain one at a time without building
+# up lists in between:
+#
+#     chain = pipeline.Pipeline(
+#         pipeline.Filter(lambda r: r.name == "object"),
+#         pipeline.Decimate(10),
+#         pipeline.Sink(db_interface.add_data))
+#     chain.run(sensor.iter_readings(1000, 0.01))
+#
+# every stage counts what goes in and out of it and how
+# much time it spends on its own work, not counting the
+# time spent waiting on the stages before it.
+# -----------------------------------------------------------
+import time
+
+class Stage(object):
+    """
+        Stage - base class for the pipeline stages
+        Subclasses override process(), a generator that takes the
+        items coming in and yields the items going out.
+        Constructor:
+            name - name used in the stats, defaults to the class name
+    """
+    def __init__(self, name=None):
+        super(Stage, self).__init__()
+        if name is None:
+            name = type(self).__name__.lower()
+        # end if
+        self.name = name
+
+        # counters
+        self.count_in = 0
+        self.count_out = 0
+        self.time_ns = 0
+
+        # time spent in the stages before this one while this
+        # stage was asking them for the next item
+        self.__upstream_ns__ = 0
+    # end __init__()
+
+    def process(self, items):
+        raise NotImplementedError("pipeline stages have to override process()")
+    # end process()
+
+    def __call__(self, source):
+        output = self.process(self.__upstream__(source))
+        while True:
+            upstream_before = self.__upstream_ns__
+            ts1 = time.perf_counter_ns()
+            try:
+                item = next(output)
+            except StopIteration:
+                self.time_ns = self.time_ns + (time.perf_counter_ns() - ts1) - \
+                    (self.__upstream_ns__ - upstream_before)
+                return
+            # end try
+            self.time_ns = self.time_ns + (time.perf_counter_ns() - ts1) - \
+                (self.__upstream_ns__ - upstream_before)
+            self.count_out = self.count_out + 1
+            yield item
+        # end while
+    # end __call__()
+
+    def __upstream__(self, source):
+        # passes the source through, counting the items and the
+        # time it takes to get each one
+        iterator = iter(source)
+        while True:
+            ts1 = time.perf_counter_ns()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.__upstream_ns__ = self.__upstream_ns__ + (time.perf_counter_ns() - ts1)
+                return
+            # end try
+            self.__upstream_ns__ = self.__upstream_ns__ + (time.perf_counter_ns() - ts1)
+            self.count_in = self.count_in + 1
+            yield item
+        # end while
+    # end __upstream__()
+
+    def get_stats(self):
+        per_item = None
+        if self.count_in > 0:
+            per_item = self.time_ns / self.count_in / 1e9
+        # end if
+        return {"name": self.name, "in": self.count_in, "out": self.count_out,
+                "seconds": self.time_ns / 1e9, "seconds_per_item": per_item}
+    # end get_stats()
+# end Stage class
+
+class Filter(Stage):
+    # passes on the items the predicate returns True for
+    def __init__(self, predicate, name=None):
+        super(Filter, self).__init__(name)
+        self.predicate = predicate
+    # end __init__()
+
+    def process(self, items):
+        predicate = self.predicate
+        for item in items:
+            if predicate(item):
+                yield item
+            # end if
+        # end for
+    # end process()
+# end Filter class
+
+class Map(Stage):
+    # passes on function(item) for every item
+    def __init__(self, function, name=None):
+        super(Map, self).__init__(name)
+        self.function = function
+    # end __init__()
+
+    def process(self, items):
+        function = self.function
+        for item in items:
+            yield function(item)
+        # end for
+    # end process()
+# end Map class
+
+class Decimate(Stage):
+    # passes on every nth item, starting with the first
+    def __init__(self, n, name=None):
+        super(Decimate, self).__init__(name)
+        self.n = n
+    # end __init__()
+
+    def process(self, items):
+        _index = 0
+        for item in items:
+            if _index == 0:
+                yield item
+            # end if
+            _index = _index + 1
+            if _index == self.n:
+                _index = 0
+            # end if
+        # end for
+    # end process()
+# end Decimate class
+
+class Window(Stage):
+    """
+        Window - groups items into tumbling windows
+        Yields a list for every window, either every size items or,
+        with seconds, every time the item timestamps move on by that
+        many seconds from the start of the window. A partly full
+        window is yielded at the end.
+    """
+    def __init__(self, size=None, seconds=None, name=None):
+        super(Window, self).__init__(name)
+        if size is None and seconds is None:
+            raise ValueError("a window needs a size or a length in seconds")
+        # end if
+        self.size = size
+        self.seconds = seconds
+    # end __init__()
+
+    def process(self, items):
+        window = []
+        window_start = None
+        for item in items:
+            if self.seconds is not None:
+                if window_start is None:
+                    window_start = item.timestamp
+                elif item.timestamp - window_start >= self.seconds:
+                    yield window
+                    window = []
+                    window_start = item.timestamp
+                # end if
+            # end if
+            window.append(item)
+            if self.size is not None and window.__len__() >= self.size:
+                yield window
+                window = []
+                window_start = None
+            # end if
+        # end for
+        if window:
+            yield window
+        # end if
+    # end process()
+# end Window class
+
+class Tee(Stage):
+    # hands every item to each consumer and passes it on
+    def __init__(self, *consumers, **kwargs):
+        super(Tee, self).__init__(kwargs.get("name"))
+        self.consumers = consumers
+    # end __init__()
+
+    def process(self, items):
+        consumers = self.consumers
+        for item in items:
+            for consumer in consumers:
+                consumer(item)
+            # end for
+            yield item
+        # end for
+    # end process()
+# end Tee class
+
+class Sink(Stage):
+    # hands every item to the consumer and passes nothing on,
+    # for the end of a pipeline (db_interface.add_data, say)
+    def __init__(self, consumer, name=None):
+        super(Sink, self).__init__(name)
+        self.consumer = consumer
+    # end __init__()
+
+    def process(self, items):
+        consumer = self.consumer
+        for item in items:
+            consumer(item)
+        # end for
+        return
+        yield
+    # end process()
+# end Sink class
+
+class Pipeline(object):
+    """
+        Pipeline - chains stages together
+        Constructor:
+            stages - the stages, in order
+
+        Methods:
+            __call__ - returns the generator coming out of the last stage
+            run - pulls everything through the pipeline
+            get_stats - each stage's counters and time
+    """
+    def __init__(self, *stages):
+        super(Pipeline, self).__init__()
+        self.stages = stages
+    # end __init__()
+
+    def __call__(self, source):
+        for stage in self.stages:
+            source = stage(source)
+        # end for
+        return source
+    # end __call__()
+
+    def run(self, source):
+        for _ in self(source):
+            pass
+        # end for
+    # end run()
+
+    def get_stats(self):
+        return [stage.get_stats() for stage in self.stages]
+    # end get_stats()
+# end Pipeline class
@@ -0,0 +1,350 @@
+# -----------------------------------------------------------
+# Reading log module
+# purpose: compact on-disk format for long captures. every
+# reading is one fixed size little endian record:
+#
+#   timestamp   double   seconds since the epoch
+#   series_id   double
+#   device      uint8    i2c device address
+#   register    uint8    data address
+#   raw         uint16   raw word read from the sensor
+#   ttr         float    time to read in seconds
+#
+# 24 bytes a reading, after a 16 byte header. next to the
+# log is a sparse index (path + ".idx") with an entry every
+# index_every records and at every change of series, so a
+# time range or a series can be found without scanning.
+#
+# the reader memory maps the log and hands back numpy
+# structured arrays that are views straight onto the map,
+# so slicing a time range copies nothing.
+# -----------------------------------------------------------
+import bisect
+import mmap
+import os
+import struct
+import model
+
+# numpy is only needed to read logs back as arrays
+try:
+    import numpy
+except ImportError:
+    numpy = None
+# end try
+
+MAGIC = b"J4055LOG"
+VERSION = 1
+HEADER = struct.Struct("<8sHHI")
+RECORD = struct.Struct("<ddBBHf")
+INDEX_ENTRY = struct.Struct("<Qdd")
+
+# numpy layout of RECORD
+DTYPE = [("timestamp", "<f8"), ("series_id", "<f8"), ("device_address", "u1"),
+         ("data_address", "u1"), ("raw_value", "<u2"), ("ttr", "<f4")]
+
+def pack_reading(aReading):
+    return RECORD.pack(aReading.timestamp or 0.0, aReading.series_id,
+                       aReading.device_address, aReading.data_address,
+                       aReading.raw_value, aReading.ttr)
+# end pack_reading()
+
+class Writer(object):
+    """
+        Writer - appends readings to a reading log
+        Constructor:
+            path - log file, appended to if it already exists
+            index_every - records between sparse index entries
+    """
+    def __init__(self, path, index_every=1024):
+        super(Writer, self).__init__()
+        self.path = path
+        self.index_path = path + ".idx"
+        self.index_every = index_every
+
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.handle = open(path, "ab")
+        if new_file:
+            self.handle.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+            self.records = 0
+            self.__last_series__ = None
+        else:
+            check_header(path)
+            # a half written record at the end is cut off
+            size = os.path.getsize(path) - HEADER.size
+            self.records = size // RECORD.size
+            if size % RECORD.size:
+                self.handle.truncate(HEADER.size + self.records * RECORD.size)
+            # end if
+            self.__last_series__ = self.__read_last_series__()
+        # end if
+        self.index_handle = open(self.index_path, "ab")
+    # end __init__()
+
+    def append(self, aReading):
+        self.append_batch((aReading,))
+    # end append()
+
+    def append_batch(self, readings):
+        # packs the readings into one write, adding index entries
+        # where they are due
+        records = []
+        entries = []
+        for reading in readings:
+            if self.records % self.index_every == 0 or \
+                    reading.series_id != self.__last_series__:
+                entries.append(INDEX_ENTRY.pack(self.records, reading.timestamp or 0.0,
+                                                reading.series_id))
+                self.__last_series__ = reading.series_id
+            # end if
+            records.append(pack_reading(reading))
+            self.records = self.records + 1
+        # end for
+        self.handle.write(b"".join(records))
+        if entries:
+            self.index_handle.write(b"".join(entries))
+        # end if
+    # end append_batch()
+
+    def flush(self, fsync=False):
+        self.handle.flush()
+        self.index_handle.flush()
+        if fsync:
+            os.fsync(self.handle.fileno())
+            os.fsync(self.index_handle.fileno())
+        # end if
+    # end flush()
+
+    def close(self):
+        self.flush(True)
+        self.handle.close()
+        self.index_handle.close()
+    # end close()
+
+    def __read_last_series__(self):
+        if self.records == 0:
+            return None
+        # end if
+        with open(self.path, "rb") as handle:
+            handle.seek(HEADER.size + (self.records - 1) * RECORD.size)
+            return RECORD.unpack(handle.read(RECORD.size))[1]
+        # end with
+    # end __read_last_series__()
+# end Writer class
+
+def check_header(path):
+    with open(path, "rb") as handle:
+        magic, version, record_size, _ = HEADER.unpack(handle.read(HEADER.size))
+    # end with
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError("%s is not a reading log" % path)
+    # end if
+    if version != VERSION:
+        raise ValueError("%s is reading log version %s, expected %s" % (path, version, VERSION))
+    # end if
+# end check_header()
+
+class Reader(object):
+    """
+        Reader - memory mapped reading log
+        Constructor:
+            path - log file
+            registers - data address -> (name, conversion, data type),
+                        used when building model.Reading objects
+
+        Methods:
+            array - every record as a numpy structured array (a view)
+            time_range - records with start <= timestamp < end (a view)
+            series - records of one series
+            series_ids - the series in the log
+            readings - model.Reading objects for a range of records
+            import_into - writes the log to a sink in batches
+    """
+    def __init__(self, path, registers=None):
+        super(Reader, self).__init__()
+        check_header(path)
+        self.path = path
+        if registers is None:
+            registers = model.MLX90614_REGISTERS
+        # end if
+        self.registers = registers
+
+        self.handle = open(path, "rb")
+        size = os.path.getsize(path)
+        self.records = (size - HEADER.size) // RECORD.size
+        self.map = None
+        if size > 0:
+            self.map = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+        # end if
+
+        self.index = self.__load_index__(path + ".idx")
+        self.__index_records__ = [entry[0] for entry in self.index]
+        self.__index_times__ = [entry[1] for entry in self.index]
+    # end __init__()
+
+    def __len__(self):
+        return self.records
+    # end __len__()
+
+    def array(self):
+        # zero copy structured array over the whole log
+        if numpy is None:
+            raise RuntimeError("numpy is needed to read a reading log as arrays")
+        # end if
+        return numpy.frombuffer(self.map, dtype=DTYPE, count=self.records,
+                                offset=HEADER.size)
+    # end array()
+
+    def time_range(self, start, end):
+        # the sparse index narrows it down to a few blocks of
+        # records, then the timestamps in those are searched.
+        # timestamps are taken to go up through the file.
+        first, last = self.__record_bounds__(start, end)
+        block = self.array()[first:last]
+        timestamps = block["timestamp"]
+        return block[numpy.searchsorted(timestamps, start, "left"):
+                     numpy.searchsorted(timestamps, end, "left")]
+    # end time_range()
+
+    def series_ids(self):
+        seen = []
+        for entry in self.index:
+            if entry[2] not in seen:
+                seen.append(entry[2])
+            # end if
+        # end for
+        return seen
+    # end series_ids()
+
+    def series(self, series_id):
+        # records of one series. a view if the series is in one
+        # run of the file, a copy if it is split up.
+        data = self.array()
+        ranges = self.__series_ranges__(series_id)
+        if ranges.__len__() == 1:
+            return data[ranges[0][0]:ranges[0][1]]
+        # end if
+        if not ranges:
+            return data[0:0]
+        # end if
+        return numpy.concatenate([data[first:last] for first, last in ranges])
+    # end series()
+
+    def readings(self, first=0, last=None):
+        # model.Reading objects for records first to last, for
+        # code that wants objects. does not need numpy.
+        if last is None or last > self.records:
+            last = self.records
+        # end if
+        for index in range(first, last):
+            timestamp, series_id, device_address, data_address, raw_value, ttr = \
+                RECORD.unpack_from(self.map, HEADER.size + index * RECORD.size)
+            name, conversion, data_type = self.registers[data_address]
+            yield model.new_reading(name, device_address, data_address, ttr,
+                                    raw_value, series_id, conversion, data_type,
+                                    timestamp=timestamp)
+        # end for
+    # end readings()
+
+    def import_into(self, sink, batch_size=1000):
+        # writes every reading in the log, and its series, to a
+        # sink (db.Interface for the mysql schema) with
+        # write_batch. returns the number of readings written.
+        series_seen = set()
+        batch = []
+        written = 0
+        for reading in self.readings():
+            if reading.series_id not in series_seen:
+                series_seen.add(reading.series_id)
+                batch.append(model.Series(reading.series_id))
+            # end if
+            batch.append(reading)
+            if batch.__len__() >= batch_size:
+                if not sink.write_batch(batch):
+                    return written
+                # end if
+                written = written + sum(1 for data_object in batch
+                                        if type(data_object) is model.Reading)
+                batch = []
+            # end if
+        # end for
+        if batch and sink.write_batch(batch):
+            written = written + sum(1 for data_object in batch
+                                    if type(data_object) is model.Reading)
+        # end if
+        return written
+    # end import_into()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        # end if
+        self.handle.close()
+    # end close()
+
+    def __record_bounds__(self, start, end):
+        if not self.index:
+            return 0, self.records
+        # end if
+        # start from the last entry before start, stop at the
+        # first entry at or past end
+        position = bisect.bisect_left(self.__index_times__, start) - 1
+        first = self.__index_records__[position] if position >= 0 else 0
+        position = bisect.bisect_left(self.__index_times__, end)
+        last = self.__index_records__[position] if position < self.index.__len__() else self.records
+        return first, last
+    # end __record_bounds__()
+
+    def __series_ranges__(self, series_id):
+        # runs of records [first, last) that belong to the series.
+        # an index entry is written at every change of series, so
+        # a run goes from an entry to the next entry of a
+        # different series.
+        ranges = []
+        first = None
+        for entry in self.index:
+            if entry[2] == series_id:
+                if first is None:
+                    first = entry[0]
+                # end if
+            elif first is not None:
+                ranges.append((first, entry[0]))
+                first = None
+            # end if
+        # end for
+        if first is not None:
+            ranges.append((first, self.records))
+        # end if
+        return ranges
+    # end __series_ranges__()
+
+    def __load_index__(self, index_path):
+        # reads the sparse index. entries past the end of the
+        # log (the index was synced and the log was not) are
+        # dropped.
+        if not os.path.exists(index_path):
+            return self.__build_index__()
+        # end if
+        with open(index_path, "rb") as handle:
+            data = handle.read()
+        # end with
+        usable = data.__len__() - data.__len__() % INDEX_ENTRY.size
+        return [entry for entry in INDEX_ENTRY.iter_unpack(data[:usable])
+                if entry[0] < self.records]
+    # end __load_index__()
+
+    def __build_index__(self, index_every=1024):
+        # no index file, so make one in memory by going over
+        # the records
+        index = []
+        last_series = None
+        for record_number in range(self.records):
+            timestamp, series_id = struct.unpack_from(
+                "<dd", self.map, HEADER.size + record_number * RECORD.size)
+            if record_number % index_every == 0 or series_id != last_series:
+                index.append((record_number, timestamp, series_id))
+                last_series = series_id
+            # end if
+        # end for
+        return index
+    # end __build_index__()
+# end Reader class
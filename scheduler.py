@@ -0,0 +1,139 @@
+# -----------------------------------------------------------
+# Scheduler module
+# purpose: keeps a sampling loop on an exact period. the
+# sample instants are worked out from the start time on the
+# monotonic clock (start + n * period) instead of sleeping a
+# fixed amount after each sample, so the time spent reading,
+# in callbacks and queueing for the database does not add
+# up into drift.
+# -----------------------------------------------------------
+import math
+import time
+
+class DeadlineScheduler(object):
+    """
+        DeadlineScheduler - absolute deadline scheduler
+        Constructor:
+            period - seconds between sample instants
+            catch_up - what to do when a whole period or more was
+                       missed. False skips the missed slots and
+                       carries on from the next one. True keeps
+                       them, the loop runs back to back until it
+                       is back on schedule.
+
+        Methods:
+            start - sets the first deadline to now
+            wait - sleeps until the next deadline, call once before
+                   each sample
+            tick - records a sample without sleeping, for callers
+                   that sleep until get_deadline() themselves
+            get_deadline - the next deadline on the perf_counter clock
+            get_stats - samples, overruns, missed slots, achieved
+                        rate and jitter
+    """
+    def __init__(self, period, catch_up=False):
+        super(DeadlineScheduler, self).__init__()
+        self.period = period
+        self.catch_up = catch_up
+        self.start()
+    # end __init__()
+
+    def start(self):
+        self.__deadline__ = time.perf_counter()
+        self.__first__ = None
+        self.__last__ = None
+
+        # counters
+        self.samples = 0
+        self.overruns = 0
+        self.missed = 0
+
+        # running mean and variance of how late each sample
+        # started (welford), and the worst case
+        self.__lateness_mean__ = 0.0
+        self.__lateness_m2__ = 0.0
+        self.max_lateness = 0.0
+    # end start()
+
+    def wait(self):
+        # sleeps until the current deadline, then moves the
+        # deadline on by one period. returns how late, in seconds,
+        # the sample is starting.
+        delay = self.__deadline__ - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        # end if
+        return self.tick()
+    # end wait()
+
+    def tick(self):
+        # records a sample starting now and moves the deadline on
+        # by one period. wait() calls this after sleeping, code
+        # that does its own sleeping (asyncio) calls it directly
+        # once get_deadline() has passed. returns how late, in
+        # seconds, the sample is starting.
+        now = time.perf_counter()
+        # a period of zero means as fast as possible, which can
+        # never overrun
+        if self.period > 0 and now - self.__deadline__ >= self.period:
+            # the loop overran by at least a whole slot
+            self.overruns = self.overruns + 1
+            if not self.catch_up:
+                _missed = int(math.floor((now - self.__deadline__) / self.period))
+                self.missed = self.missed + _missed
+                self.__deadline__ = self.__deadline__ + _missed * self.period
+            # end if
+        # end if
+
+        lateness = now - self.__deadline__
+        self.samples = self.samples + 1
+        delta = lateness - self.__lateness_mean__
+        self.__lateness_mean__ = self.__lateness_mean__ + delta / self.samples
+        self.__lateness_m2__ = self.__lateness_m2__ + delta * (lateness - self.__lateness_mean__)
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        # end if
+
+        if self.__first__ is None:
+            self.__first__ = now
+        # end if
+        self.__last__ = now
+
+        self.__deadline__ = self.__deadline__ + self.period
+        return lateness
+    # end tick()
+
+    def get_deadline(self):
+        # the next sample instant on the perf_counter clock
+        return self.__deadline__
+    # end get_deadline()
+
+    def get_achieved_rate(self):
+        # samples per second actually achieved between the first
+        # and the last sample
+        if self.samples < 2 or self.__last__ == self.__first__:
+            return None
+        # end if
+        return (self.samples - 1) / (self.__last__ - self.__first__)
+    # end get_achieved_rate()
+
+    def get_jitter(self):
+        # standard deviation of the sample start lateness
+        if self.samples < 2:
+            return 0.0
+        # end if
+        return math.sqrt(self.__lateness_m2__ / (self.samples - 1))
+    # end get_jitter()
+
+    def get_stats(self):
+        return {"samples": self.samples,
+                "period": self.period,
+                "target_rate": (1.0 / self.period) if self.period > 0 else None,
+                "achieved_rate": self.get_achieved_rate(),
+                "overruns": self.overruns,
+                "missed": self.missed,
+                "mean_lateness": self.__lateness_mean__,
+                "max_lateness": self.max_lateness,
+                "jitter": self.get_jitter()}
+    # end get_stats()
+# end DeadlineScheduler class
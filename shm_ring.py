@@ -0,0 +1,325 @@
+# -----------------------------------------------------------
+# Shared memory ring module
+# purpose: runs the database writer in its own process, so
+# the sensor loop does not share the interpreter (and the
+# GIL) with mysql.connector. the sensor side packs each
+# reading into a fixed size record (reading_log.RECORD) in
+# a multiprocessing.shared_memory ring buffer and the
+# writer process unpacks them and hands them to a sink
+# opened from a sinks.open_sink config.
+#
+# the ring has one writer and one reader. the header holds
+#
+#   head      uint64  records put in, only the sensor side
+#                     moves it
+#   tail      uint64  records taken out, only the writer
+#                     process moves it
+#   overruns  uint64  records dropped because the ring was
+#                     full
+#   capacity  uint32  records the ring holds
+#   closed    uint32  set once the sensor side is done
+#   flush_request uint32  flushes asked for, only the
+#                         sensor side moves it
+#   flush_done    uint32  last flush request the writer
+#                         process has carried out
+#   flush_ok      uint32  1 if its sink flushed cleanly
+#
+# a record is written before head is moved past it, so the
+# writer never sees half a record. when the ring is full
+# the new reading is dropped and counted, the sensor loop
+# never waits on the database.
+# -----------------------------------------------------------
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+import model
+import reading_log
+import sinks
+
+HEADER = struct.Struct("<QQQIIIII")
+RECORD = reading_log.RECORD
+
+# offsets of the header fields
+HEAD = 0
+TAIL = 8
+OVERRUNS = 16
+CAPACITY = 24
+CLOSED = 28
+FLUSH_REQUEST = 32
+FLUSH_DONE = 36
+FLUSH_OK = 40
+
+U64 = struct.Struct("<Q")
+U32 = struct.Struct("<I")
+
+class Ring(object):
+    """
+        Ring - fixed size record ring buffer in shared memory
+        Constructor:
+            capacity - records the ring holds, only used when
+                       creating it
+            name - name of an existing ring to attach to, None
+                   makes a new one
+    """
+    def __init__(self, capacity=65536, name=None):
+        super(Ring, self).__init__()
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True,
+                                                     size=HEADER.size + capacity * RECORD.size)
+            self.owner = True
+            HEADER.pack_into(self.memory.buf, 0, 0, 0, 0, capacity, 0, 0, 0, 0)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        # end if
+        self.name = self.memory.name
+        self.buffer = self.memory.buf
+        self.capacity = U32.unpack_from(self.buffer, CAPACITY)[0]
+    # end __init__()
+
+    def __len__(self):
+        return self.get_head() - self.get_tail()
+    # end __len__()
+
+    def get_head(self):
+        return U64.unpack_from(self.buffer, HEAD)[0]
+    # end get_head()
+
+    def get_tail(self):
+        return U64.unpack_from(self.buffer, TAIL)[0]
+    # end get_tail()
+
+    def get_overruns(self):
+        return U64.unpack_from(self.buffer, OVERRUNS)[0]
+    # end get_overruns()
+
+    def is_closed(self):
+        return U32.unpack_from(self.buffer, CLOSED)[0] != 0
+    # end is_closed()
+
+    def put(self, *fields):
+        # writes one record. returns False, and counts an
+        # overrun, if the ring is full.
+        head = self.get_head()
+        if head - self.get_tail() >= self.capacity:
+            U64.pack_into(self.buffer, OVERRUNS, self.get_overruns() + 1)
+            return False
+        # end if
+        RECORD.pack_into(self.buffer, HEADER.size + (head % self.capacity) * RECORD.size, *fields)
+        U64.pack_into(self.buffer, HEAD, head + 1)
+        return True
+    # end put()
+
+    def get_batch(self, max_records):
+        # takes up to max_records records off the ring as
+        # tuples of the record fields
+        tail = self.get_tail()
+        count = min(self.get_head() - tail, max_records)
+        records = []
+        for position in range(tail, tail + count):
+            records.append(RECORD.unpack_from(self.buffer,
+                                              HEADER.size + (position % self.capacity) * RECORD.size))
+        # end for
+        U64.pack_into(self.buffer, TAIL, tail + count)
+        return records
+    # end get_batch()
+
+    def request_flush(self):
+        # asks the writer process to flush its sink once it has
+        # taken everything put so far. returns the request
+        # number to wait on with get_flush_done.
+        request = U32.unpack_from(self.buffer, FLUSH_REQUEST)[0] + 1
+        U32.pack_into(self.buffer, FLUSH_REQUEST, request)
+        return request
+    # end request_flush()
+
+    def get_flush_request(self):
+        return U32.unpack_from(self.buffer, FLUSH_REQUEST)[0]
+    # end get_flush_request()
+
+    def get_flush_done(self):
+        # last request carried out, and whether its flush worked
+        return (U32.unpack_from(self.buffer, FLUSH_DONE)[0],
+                U32.unpack_from(self.buffer, FLUSH_OK)[0] != 0)
+    # end get_flush_done()
+
+    def set_flush_done(self, request, ok):
+        # the result goes in before the request number, so the
+        # sensor side never sees the number with an old result
+        U32.pack_into(self.buffer, FLUSH_OK, 1 if ok else 0)
+        U32.pack_into(self.buffer, FLUSH_DONE, request)
+    # end set_flush_done()
+
+    def close_input(self):
+        # tells the reader nothing more is coming
+        U32.pack_into(self.buffer, CLOSED, 1)
+    # end close_input()
+
+    def close(self):
+        # the memoryview has to go before the memory can close
+        self.buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        # end if
+    # end close()
+# end Ring class
+
+def writer_main(ring_name, sink_config, registers, batch_size=500, poll_interval=0.01):
+    # body of the writer process. drains the ring into the
+    # sink until the sensor side closes it and it is empty.
+    # a Series is written ahead of the first reading of each
+    # series id, the sensor side does not send them. readings
+    # from several sensors come in mixed together, so every id
+    # written so far is kept, not just the last one.
+    ring = Ring(name=ring_name)
+    sink = sinks.open_sink(sink_config)
+    written_series = set()
+    try:
+        while True:
+            # a flush request is read before the ring is found
+            # empty, so everything put ahead of it has been taken
+            # by the time the sink is flushed
+            flush_request = ring.get_flush_request()
+            records = ring.get_batch(batch_size)
+            if not records:
+                if flush_request != ring.get_flush_done()[0]:
+                    ring.set_flush_done(flush_request, sink.flush() is not False)
+                # end if
+                if ring.is_closed() and ring.__len__() == 0:
+                    break
+                # end if
+                time.sleep(poll_interval)
+                continue
+            # end if
+            for timestamp, series_id, device_address, data_address, raw_value, ttr in records:
+                if series_id not in written_series:
+                    sink.add_data(model.Series(series_id))
+                    written_series.add(series_id)
+                # end if
+                name, conversion, data_type = registers[data_address]
+                sink.add_data(model.new_reading(name, device_address, data_address, ttr,
+                                                raw_value, series_id, conversion, data_type,
+                                                timestamp=timestamp))
+            # end for
+        # end while
+    finally:
+        sink.close()
+        ring.close()
+    # end try
+# end writer_main()
+
+class ProcessSink(sinks.Sink):
+    """
+        ProcessSink - sink that logs from a separate writer process
+        Hand it to the sensor in place of db.Interface. Readings go
+        through a shared memory ring to a process that writes them
+        to the sink sink_config opens (see sinks.open_sink).
+        Series are made by the writer process from the series ids.
+        Aggregates and series summaries can not go through the ring,
+        they are counted in skipped and are not stored, so log
+        those to a sink of their own if they are wanted.
+        Constructor:
+            sink_config - sinks.open_sink config for the writer process
+            capacity - records the ring holds
+            registers - data address -> (name, conversion, data type)
+            batch_size - records the writer process takes at a time
+            poll_interval - writer process sleep when the ring is empty
+    """
+    def __init__(self, sink_config, capacity=65536, registers=None,
+                 batch_size=500, poll_interval=0.01):
+        super(ProcessSink, self).__init__(1)
+        if registers is None:
+            registers = model.MLX90614_REGISTERS
+        # end if
+        self.ring = Ring(capacity)
+        self.process = multiprocessing.Process(target=writer_main,
+                                               args=(self.ring.name, sink_config, registers,
+                                                     batch_size, poll_interval))
+        self.process.daemon = True
+        self.process.start()
+        self.closed = False
+        self.overruns = 0
+
+        # counters
+        self.accepted = 0
+        self.skipped = 0
+    # end __init__()
+
+    def add_data(self, data_object):
+        if type(data_object) is model.Reading:
+            if self.ring.put(data_object.timestamp or time.time(), data_object.series_id,
+                             data_object.device_address, data_object.data_address,
+                             data_object.raw_value, data_object.ttr):
+                self.accepted = self.accepted + 1
+            # end if
+        elif type(data_object) is not model.Series:
+            self.skipped = self.skipped + 1
+        # end if
+    # end add_data()
+
+    def write_batch(self, batch):
+        for data_object in batch:
+            self.add_data(data_object)
+        # end for
+        return True
+    # end write_batch()
+
+    def flush(self, timeout=None):
+        # waits for the writer process to take everything off
+        # the ring and flush its sink, so what was added so far
+        # is stored. returns False on a timeout, if the sink
+        # flush failed, or if the process has died.
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        # end if
+        request = self.ring.request_flush()
+        while True:
+            done, ok = self.ring.get_flush_done()
+            if done >= request:
+                return ok
+            # end if
+            if not self.process.is_alive():
+                print("ERROR: writer process stopped with %s records left" % self.ring.__len__())
+                return False
+            # end if
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            # end if
+            time.sleep(0.01)
+        # end while
+    # end flush()
+
+    def close(self, timeout=None):
+        # lets the writer process drain the ring and close its
+        # sink, then frees the shared memory. returns False if
+        # the process had to be terminated.
+        if self.closed:
+            return True
+        # end if
+        self.closed = True
+        self.ring.close_input()
+        self.process.join(timeout)
+        clean = not self.process.is_alive()
+        if not clean:
+            print("ERROR: writer process did not stop, terminating it")
+            self.process.terminate()
+            self.process.join()
+        # end if
+        self.overruns = self.ring.get_overruns()
+        self.ring.close()
+        return clean
+    # end close()
+
+    def get_stats(self):
+        if not self.closed:
+            self.overruns = self.ring.get_overruns()
+        # end if
+        return {"accepted": self.accepted, "skipped": self.skipped,
+                "overruns": self.overruns,
+                "depth": 0 if self.closed else self.ring.__len__(),
+                "writer_alive": self.process.is_alive()}
+    # end get_stats()
+# end ProcessSink class
@@ -0,0 +1,234 @@
+# -----------------------------------------------------------
+# Simulated bus module
+# purpose: stand-ins for smbus.SMBus so the sensor code and
+# everything behind it can be run and benchmarked on any
+# linux box with no sensor attached. they all have the one
+# method the sensor uses, read_word_data(address, register),
+# and are handed to the sensor with bus=.
+#
+#   SimulatedBus - synthetic temperature waveforms, with a
+#                  chosen read latency and injected errors
+#   RecordingBus - wraps a real bus and writes every word it
+#                  reads to a file
+#   ReplayBus    - plays back a file written by RecordingBus
+# -----------------------------------------------------------
+import errno
+import math
+import random
+import time
+import model
+
+# MLX90614 error flag, bit 15 of a temperature word
+ERROR_FLAG = 0x8000
+
+# delays shorter than this are busy waited, time.sleep can
+# not do better than a fraction of a millisecond
+SPIN_THRESHOLD = 0.001
+
+# -----------------------------------------------------------
+# latency distributions. each returns a function that gives
+# one read latency in seconds.
+# -----------------------------------------------------------
+def constant_latency(seconds):
+    return lambda rng: seconds
+# end constant_latency()
+
+def uniform_latency(low, high):
+    return lambda rng: rng.uniform(low, high)
+# end uniform_latency()
+
+def gauss_latency(mean, stddev):
+    return lambda rng: max(0.0, rng.gauss(mean, stddev))
+# end gauss_latency()
+
+def lognormal_latency(median, sigma):
+    # long tailed, closer to what a busy bus looks like
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+# end lognormal_latency()
+
+# -----------------------------------------------------------
+# waveforms. each returns a function of the time in seconds
+# since the bus was made that gives the value of the
+# register: kelvin for temperatures, 0-1 for emissivity.
+# -----------------------------------------------------------
+def constant(value):
+    return lambda t: value
+# end constant()
+
+def sine(mean, amplitude, period):
+    return lambda t: mean + amplitude * math.sin(2 * math.pi * t / period)
+# end sine()
+
+def ramp(start, slope):
+    # slope is in units per second
+    return lambda t: start + slope * t
+# end ramp()
+
+def step(before, after, at):
+    return lambda t: before if t < at else after
+# end step()
+
+def noisy(waveform, stddev, seed=None):
+    rng = random.Random(seed)
+    return lambda t: waveform(t) + rng.gauss(0.0, stddev)
+# end noisy()
+
+def default_waveforms():
+    return {0x6: constant(295.15),
+            0x7: noisy(sine(310.0, 5.0, 10.0), 0.05),
+            0x24: constant(1.0)}
+# end default_waveforms()
+
+class SimulatedBus(object):
+    """
+        SimulatedBus - fake smbus with synthetic sensor data
+        Constructor:
+            waveforms - data address -> waveform function, defaults
+                        to a steady ambient, a noisy sine wave object
+                        temperature and an emissivity of 1
+            latency - latency function for each read, None for no delay
+            error_rate - fraction of reads that raise an IOError the
+                         way a NACK on the real bus does
+            error_word_rate - fraction of temperature words that come
+                              back with the MLX90614 error flag set
+            registers - data address -> (name, conversion, data type),
+                        used to turn the waveform value into a word
+            seed - seed for the random numbers, for repeatable runs
+    """
+    def __init__(self, waveforms=None, latency=None, error_rate=0.0,
+                 error_word_rate=0.0, registers=None, seed=None):
+        super(SimulatedBus, self).__init__()
+        if waveforms is None:
+            waveforms = default_waveforms()
+        # end if
+        if registers is None:
+            registers = model.MLX90614_REGISTERS
+        # end if
+        self.waveforms = waveforms
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_word_rate = error_word_rate
+        self.registers = registers
+        self.rng = random.Random(seed)
+        self.start = time.monotonic()
+
+        # counters
+        self.reads = 0
+        self.errors = 0
+        self.error_words = 0
+    # end __init__()
+
+    def read_word_data(self, address, register):
+        self.reads = self.reads + 1
+        if self.latency is not None:
+            self.__delay__(self.latency(self.rng))
+        # end if
+
+        if self.error_rate > 0 and self.rng.random() < self.error_rate:
+            self.errors = self.errors + 1
+            raise IOError(errno.EREMOTEIO, "simulated i2c error at %s register %s" %
+                          (hex(address), hex(register)))
+        # end if
+
+        value = self.waveforms[register](time.monotonic() - self.start)
+        conversion = self.registers[register][1]
+        word = min(0xffff, max(0, int(round(value / conversion))))
+
+        if self.registers[register][2] == "temperature":
+            word = word & ~ERROR_FLAG
+            if self.error_word_rate > 0 and self.rng.random() < self.error_word_rate:
+                self.error_words = self.error_words + 1
+                word = word | ERROR_FLAG
+            # end if
+        # end if
+        return word
+    # end read_word_data()
+
+    def __delay__(self, seconds):
+        if seconds >= SPIN_THRESHOLD:
+            time.sleep(seconds)
+            return
+        # end if
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+        # end while
+    # end __delay__()
+# end SimulatedBus class
+
+class RecordingBus(object):
+    """
+        RecordingBus - records the words read from another bus
+        Every word is written to the file as one line of
+        "timestamp,address,register,word".
+        Constructor:
+            bus - the bus to read from, normally smbus.SMBus(1)
+            path - file to write to, appended to if it exists
+    """
+    def __init__(self, bus, path):
+        super(RecordingBus, self).__init__()
+        self.bus = bus
+        self.handle = open(path, "a")
+    # end __init__()
+
+    def read_word_data(self, address, register):
+        word = self.bus.read_word_data(address, register)
+        self.handle.write("%.6f,%d,%d,%d\n" % (time.time(), address, register, word))
+        return word
+    # end read_word_data()
+
+    def close(self):
+        self.handle.close()
+    # end close()
+# end RecordingBus class
+
+class ReplayBus(object):
+    """
+        ReplayBus - plays back words recorded by RecordingBus
+        Words come back in the order they were recorded, separately
+        for each address and register.
+        Constructor:
+            path - file written by RecordingBus
+            loop - start again from the top once a register runs out,
+                   otherwise an IOError is raised
+    """
+    def __init__(self, path, loop=True):
+        super(ReplayBus, self).__init__()
+        self.loop = loop
+
+        # (address, register) -> list of words, and the position
+        # reached in each list
+        self.words = {}
+        self.positions = {}
+        with open(path) as handle:
+            for line in handle:
+                fields = line.strip().split(",")
+                if fields.__len__() != 4:
+                    continue
+                # end if
+                key = (int(fields[1]), int(fields[2]))
+                self.words.setdefault(key, []).append(int(fields[3]))
+            # end for
+        # end with
+    # end __init__()
+
+    def read_word_data(self, address, register):
+        key = (address, register)
+        words = self.words.get(key)
+        if not words:
+            raise IOError(errno.EREMOTEIO, "nothing recorded for %s register %s" %
+                          (hex(address), hex(register)))
+        # end if
+        position = self.positions.get(key, 0)
+        if position >= words.__len__():
+            if not self.loop:
+                raise IOError(errno.EREMOTEIO, "recording for %s register %s ran out" %
+                              (hex(address), hex(register)))
+            # end if
+            position = 0
+        # end if
+        self.positions[key] = position + 1
+        return words[position]
+    # end read_word_data()
+# end ReplayBus class
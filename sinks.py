@@ -0,0 +1,422 @@
+# -----------------------------------------------------------
+# Sinks module
+# purpose: the storage side of the system. a sink is
+# anything the sensor can hand its data objects to, and it
+# has the same four methods whatever it stores them in:
+#
+#   add_data(data_object) - take one Series/Reading/Aggregate
+#   write_batch(batch)    - store a list of them in one go
+#   flush()               - store anything still held back
+#   close()               - flush and let go of the storage
+#
+# db.Interface is the mysql sink. this module has a local
+# sqlite sink (WAL mode, batched transactions) and an
+# append-only binary file sink, and open_sink() to pick one
+# from a config.
+# -----------------------------------------------------------
+import json
+import sqlite3
+import threading
+import model
+import reading_log
+
+class TableRows(object):
+    # a batch of data objects split up into rows for each of
+    # the tables, ready for executemany
+    __slots__ = ("series", "readings", "temperatures", "emissivities", "aggregates",
+                 "summaries")
+
+    def __init__(self):
+        self.series = []
+        self.readings = []
+        self.temperatures = []
+        self.emissivities = []
+        self.aggregates = []
+        self.summaries = []
+    # end __init__()
+
+    def __len__(self):
+        return self.series.__len__() + self.readings.__len__() + \
+            self.temperatures.__len__() + self.emissivities.__len__() + \
+            self.aggregates.__len__() + self.summaries.__len__()
+    # end __len__()
+# end TableRows class
+
+def summary_row(aSummary):
+    # tbl_series_summary row, the same in every schema
+    return (aSummary.series_id, aSummary.name, aSummary.device_address,
+            aSummary.data_address, aSummary.start, aSummary.end, aSummary.count,
+            aSummary.minimum, aSummary.maximum, aSummary.mean, aSummary.stddev,
+            aSummary.ewma, aSummary.slope)
+# end summary_row()
+
+def split_rows(batch, get_reading_id):
+    # splits a batch up by table. readings without an id are
+    # given one from get_reading_id. readings that already
+    # have an id (a retried batch) keep it, so the child rows
+    # still line up. returns None if an id could not be had.
+    rows = TableRows()
+    for data_object in batch:
+        if type(data_object) is model.Series:
+            rows.series.append((data_object.get_id(),))
+        elif type(data_object) is model.Reading:
+            if not data_object.has_id():
+                _reading_id = get_reading_id()
+                if _reading_id is None:
+                    return None
+                # end if
+                data_object.set_id(_reading_id)
+            # end if
+
+            rows.readings.append((data_object.id, data_object.name, data_object.series_id,
+                                  data_object.ttr, data_object.location_id,
+                                  data_object.device_address, data_object.data_address))
+
+            # the child row goes into the temperature or the
+            # emissivity table depending on the data object.
+            data = data_object.get_data()
+            if type(data) is model.Temperature:
+                rows.temperatures.append((data_object.id, data.get_kelvin(),
+                                          data.get_celcius(), data.get_fahrenheit()))
+            elif type(data) is model.Emissivity:
+                rows.emissivities.append((data_object.id, data.get_value()))
+            # end if
+        elif type(data_object) is model.Aggregate:
+            rows.aggregates.append((data_object.series_id, data_object.name,
+                                    data_object.device_address, data_object.data_address,
+                                    data_object.window_start, data_object.window_end,
+                                    data_object.count, data_object.minimum,
+                                    data_object.maximum, data_object.mean,
+                                    data_object.stddev))
+        elif type(data_object) is model.SeriesSummary:
+            rows.summaries.append(summary_row(data_object))
+        else:
+            print("ERROR: Unsupported data type %s" % type(data_object))
+        # end if
+    # end for
+    return rows
+# end split_rows()
+
+class Sink(object):
+    """
+        Sink - base class for the storage sinks
+        add_data holds objects back until batch_size of them are
+        waiting and then writes them with write_batch. A batch that
+        fails to write stays in the buffer and goes again once
+        another batch_size objects have come in, or on flush. Past
+        max_pending objects the oldest are dropped and counted in
+        lost. Subclasses have to override write_batch and can add
+        to close.
+        Constructor:
+            batch_size - objects written per batch
+            max_pending - most objects held while writes are failing,
+                          ten batches if None
+    """
+    def __init__(self, batch_size=100, max_pending=None):
+        super(Sink, self).__init__()
+        self.batch_size = batch_size
+        if max_pending is None:
+            max_pending = batch_size * 10
+        # end if
+        self.max_pending = max_pending
+        self.__buffer__ = []
+        self.__buffer_lock__ = threading.Lock()
+
+        # buffer length the next write waits for, pushed on by a
+        # batch_size after a failed write
+        self.__write_at__ = batch_size
+
+        # counters
+        self.failed_writes = 0
+        self.lost = 0
+    # end __init__()
+
+    def add_data(self, data_object):
+        with self.__buffer_lock__:
+            self.__buffer__.append(data_object)
+            if self.__buffer__.__len__() < self.__write_at__:
+                return
+            # end if
+            batch = self.__buffer__
+            self.__buffer__ = []
+        # end with
+        self.__write__(batch)
+    # end add_data()
+
+    def __write__(self, batch):
+        # writes a batch taken out of the buffer. if it fails it
+        # goes back in front of anything added since.
+        if self.write_batch(batch):
+            with self.__buffer_lock__:
+                self.__write_at__ = self.batch_size
+            # end with
+            return True
+        # end if
+        with self.__buffer_lock__:
+            self.failed_writes = self.failed_writes + 1
+            self.__buffer__ = batch + self.__buffer__
+            excess = self.__buffer__.__len__() - self.max_pending
+            if excess > 0:
+                print("ERROR: sink buffer full, dropping %s records" % excess)
+                del self.__buffer__[:excess]
+                self.lost = self.lost + excess
+            # end if
+            self.__write_at__ = self.__buffer__.__len__() + self.batch_size
+        # end with
+        return False
+    # end __write__()
+
+    def write_batch(self, batch):
+        raise NotImplementedError("sinks have to override write_batch()")
+    # end write_batch()
+
+    def flush(self):
+        with self.__buffer_lock__:
+            batch = self.__buffer__
+            self.__buffer__ = []
+        # end with
+        if batch:
+            return self.__write__(batch)
+        # end if
+        return True
+    # end flush()
+
+    def close(self):
+        self.flush()
+        self.__drop_pending__()
+    # end close()
+
+    def __drop_pending__(self):
+        # counts whatever could not be written by close as lost
+        with self.__buffer_lock__:
+            if self.__buffer__:
+                print("ERROR: sink closed with %s records not written" % self.__buffer__.__len__())
+                self.lost = self.lost + self.__buffer__.__len__()
+                self.__buffer__ = []
+            # end if
+        # end with
+    # end __drop_pending__()
+# end Sink class
+
+# -----------------------------------------------------------
+# sqlite sink. same tables and columns as the mysql schema,
+# so the files can be loaded into the server as they are.
+# -----------------------------------------------------------
+SQLITE_CREATE_TABLES = (
+    "CREATE TABLE IF NOT EXISTS tbl_series (id REAL PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS tbl_reading (id INTEGER PRIMARY KEY, name TEXT, "
+    "series_id REAL, ttr REAL, location_id INTEGER, device_address INTEGER, "
+    "data_address INTEGER)",
+    "CREATE INDEX IF NOT EXISTS idx_reading_series ON tbl_reading (series_id)",
+    "CREATE TABLE IF NOT EXISTS tbl_temperature (reading_id INTEGER PRIMARY KEY, "
+    "kelvin REAL, celcius REAL, fahrenheit REAL)",
+    "CREATE TABLE IF NOT EXISTS tbl_emissivity (reading_id INTEGER PRIMARY KEY, value REAL)",
+    "CREATE TABLE IF NOT EXISTS tbl_aggregate (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "series_id REAL NOT NULL, name TEXT, device_address INTEGER, data_address INTEGER, "
+    "window_start REAL, window_end REAL, count INTEGER, minimum REAL, maximum REAL, "
+    "mean REAL, stddev REAL)",
+    "CREATE TABLE IF NOT EXISTS tbl_series_summary (series_id REAL NOT NULL, name TEXT, "
+    "device_address INTEGER NOT NULL, data_address INTEGER NOT NULL, start REAL, end REAL, "
+    "count INTEGER, minimum REAL, maximum REAL, mean REAL, stddev REAL, ewma REAL, slope REAL, "
+    "PRIMARY KEY (series_id, device_address, data_address))",
+)
+# a window is unique to its register and start time, so
+# aggregates written twice do not double up. a file that
+# already has duplicate windows in it carries on without it.
+SQLITE_CREATE_AGGREGATE_KEY = (
+                               "CREATE UNIQUE INDEX IF NOT EXISTS uq_aggregate_window ON tbl_aggregate "
+                               "(series_id, device_address, data_address, window_start)"
+                              )
+SQLITE_INSERT_SERIES = "INSERT OR IGNORE INTO tbl_series (id) VALUES(?)"
+SQLITE_INSERT_READING = (
+                         "INSERT INTO tbl_reading (id, name, series_id, ttr, location_id, device_address, data_address) "
+                         "VALUES(?, ?, ?, ?, ?, ?, ?)"
+                        )
+SQLITE_INSERT_TEMPERATURE = (
+                             "INSERT INTO tbl_temperature (reading_id, kelvin, celcius, fahrenheit) "
+                             "VALUES(?, ?, ?, ?)"
+                            )
+SQLITE_INSERT_EMISSIVITY = "INSERT INTO tbl_emissivity (reading_id, value) VALUES(?, ?)"
+SQLITE_INSERT_AGGREGATE = (
+                           "INSERT OR IGNORE INTO tbl_aggregate (series_id, name, device_address, data_address, "
+                           "window_start, window_end, count, minimum, maximum, mean, stddev) "
+                           "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                          )
+SQLITE_INSERT_SUMMARY = (
+                         "INSERT OR IGNORE INTO tbl_series_summary (series_id, name, device_address, "
+                         "data_address, start, end, count, minimum, maximum, mean, stddev, ewma, slope) "
+                         "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                        )
+
+class SQLiteSink(Sink):
+    """
+        SQLiteSink - local sqlite database in WAL mode
+        Every batch is written in one transaction. With WAL and
+        synchronous=NORMAL a commit does not wait on an fsync, the
+        log is synced at checkpoints instead.
+        Constructor:
+            path - database file
+            batch_size - objects written per transaction
+            synchronous - sqlite synchronous setting
+    """
+    def __init__(self, path, batch_size=500, synchronous="NORMAL"):
+        super(SQLiteSink, self).__init__(batch_size)
+        self.path = path
+        self.__lock__ = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=%s" % synchronous)
+        for sql_command in SQLITE_CREATE_TABLES:
+            self.connection.execute(sql_command)
+        # end for
+        try:
+            self.connection.execute(SQLITE_CREATE_AGGREGATE_KEY)
+        except sqlite3.Error as ex:
+            print("SQLITE AGGREGATE KEY ERROR: %s" % ex)
+        # end try
+        self.connection.commit()
+
+        # this is the only writer, so reading ids just carry
+        # on from the highest one in the file
+        data = self.connection.execute("SELECT MAX(id) FROM tbl_reading").fetchall()
+        self.__next_reading_id__ = 0 if data[0][0] is None else int(data[0][0]) + 1
+
+        # counters
+        self.rows_written = 0
+        self.batches_written = 0
+    # end __init__()
+
+    def write_batch(self, batch):
+        with self.__lock__:
+            rows = split_rows(batch, self.__get_reading_id__)
+            try:
+                cursor = self.connection.cursor()
+                if rows.series:
+                    cursor.executemany(SQLITE_INSERT_SERIES, rows.series)
+                if rows.readings:
+                    cursor.executemany(SQLITE_INSERT_READING, rows.readings)
+                if rows.temperatures:
+                    cursor.executemany(SQLITE_INSERT_TEMPERATURE, rows.temperatures)
+                if rows.emissivities:
+                    cursor.executemany(SQLITE_INSERT_EMISSIVITY, rows.emissivities)
+                if rows.aggregates:
+                    cursor.executemany(SQLITE_INSERT_AGGREGATE, rows.aggregates)
+                if rows.summaries:
+                    cursor.executemany(SQLITE_INSERT_SUMMARY, rows.summaries)
+                # end if
+                self.connection.commit()
+            except sqlite3.Error as ex:
+                print("SQLITE ERROR: %s" % ex)
+                self.connection.rollback()
+                return False
+            # end try
+            self.rows_written = self.rows_written + rows.__len__()
+            self.batches_written = self.batches_written + 1
+            return True
+        # end with
+    # end write_batch()
+
+    def close(self):
+        super(SQLiteSink, self).close()
+        with self.__lock__:
+            self.connection.close()
+        # end with
+    # end close()
+
+    def __get_reading_id__(self):
+        reading_id = self.__next_reading_id__
+        self.__next_reading_id__ = reading_id + 1
+        return reading_id
+    # end __get_reading_id__()
+# end SQLiteSink class
+
+# -----------------------------------------------------------
+# binary file sink. readings are appended to a reading log,
+# see the reading_log module for the format.
+# -----------------------------------------------------------
+class BinaryFileSink(Sink):
+    """
+        BinaryFileSink - append-only reading log
+        Only readings are stored, the series id is in every
+        record. Aggregates and series summaries have no place in
+        the record format, they are counted in skipped and not
+        stored (lost only counts objects a failed write dropped).
+        Constructor:
+            path - log file to append to
+            batch_size - readings packed per write
+            fsync - fsync after every batch
+            index_every - records between sparse index entries
+    """
+    def __init__(self, path, batch_size=1000, fsync=False, index_every=1024):
+        super(BinaryFileSink, self).__init__(batch_size)
+        self.path = path
+        self.fsync = fsync
+        self.__lock__ = threading.Lock()
+        self.writer = reading_log.Writer(path, index_every)
+
+        # counters
+        self.records_written = 0
+        self.skipped = 0
+    # end __init__()
+
+    def write_batch(self, batch):
+        readings = []
+        for data_object in batch:
+            if type(data_object) is model.Reading:
+                readings.append(data_object)
+            elif type(data_object) is not model.Series:
+                self.skipped = self.skipped + 1
+            # end if
+        # end for
+        with self.__lock__:
+            self.writer.append_batch(readings)
+            if self.fsync:
+                self.writer.flush(True)
+            # end if
+            self.records_written = self.records_written + readings.__len__()
+        # end with
+        return True
+    # end write_batch()
+
+    def flush(self):
+        result = super(BinaryFileSink, self).flush()
+        with self.__lock__:
+            self.writer.flush()
+        # end with
+        return result
+    # end flush()
+
+    def close(self):
+        super(BinaryFileSink, self).close()
+        with self.__lock__:
+            self.writer.close()
+        # end with
+    # end close()
+# end BinaryFileSink class
+
+def open_sink(config):
+    # makes a sink from a config dictionary, or the path of a
+    # json file holding one. "type" picks the sink and the
+    # rest of the keys are passed to it:
+    #
+    #   {"type": "mysql", "config_file": "mysql_config.json"}
+    #   {"type": "sqlite", "path": "readings.db"}
+    #   {"type": "binary", "path": "readings.bin"}
+    if not isinstance(config, dict):
+        with open(config) as handle:
+            config = json.loads(handle.read())
+        # end with
+    # end if
+    options = dict(config)
+    sink_type = options.pop("type", "mysql")
+    if sink_type == "mysql":
+        # imported here, db needs this module for Sink
+        import db
+        return db.Interface(**options)
+    elif sink_type == "sqlite":
+        return SQLiteSink(**options)
+    elif sink_type == "binary":
+        return BinaryFileSink(**options)
+    # end if
+    raise ValueError("unknown sink type %s" % sink_type)
+# end open_sink()
@@ -0,0 +1,318 @@
+# -----------------------------------------------------------
+# Spool module
+# purpose: append-only file on local disk that holds data
+# objects while the database can not take them. objects are
+# written one JSON line each and fsync'd in batches. once
+# the database is back they are read back in chunks and
+# replayed, and the file is truncated when it has all been
+# committed.
+#
+# a small checkpoint file next to the spool keeps track of
+# how far the replay has got. before a chunk is written to
+# the database the reading ids it will use are recorded in
+# the checkpoint, so if the program dies half way through a
+# replay the same chunk comes back with the same ids and the
+# writer can tell whether it already made it into the tables.
+# -----------------------------------------------------------
+import json
+import os
+import threading
+import time
+import model
+
+# bytes read at a time looking back for the last whole line
+TRIM_BLOCK_SIZE = 65536
+
+def encode(data_object):
+    # turns a Series, Reading, Aggregate or SeriesSummary into a dictionary that can
+    # be written as one line of JSON
+    if type(data_object) is model.Series:
+        return {"type": "series", "id": data_object.get_id()}
+    elif type(data_object) is model.Reading:
+        record = {"type": "reading", "id": data_object.id, "name": data_object.name,
+                  "device_address": data_object.device_address,
+                  "data_address": data_object.data_address,
+                  "ttr": data_object.ttr, "raw_value": data_object.raw_value,
+                  "series_id": data_object.series_id,
+                  "location_id": data_object.location_id,
+                  "timestamp": data_object.timestamp}
+        data = data_object.get_data()
+        if type(data) is model.Temperature:
+            record["temperature"] = data.get_kelvin()
+        elif type(data) is model.Emissivity:
+            record["emissivity"] = data.get_value()
+        # end if
+        return record
+    elif type(data_object) is model.Aggregate:
+        record = dict((field, getattr(data_object, field))
+                      for field in model.Aggregate.__slots__)
+        record["type"] = "aggregate"
+        return record
+    elif type(data_object) is model.SeriesSummary:
+        record = dict((field, getattr(data_object, field))
+                      for field in model.SeriesSummary.__slots__)
+        record["type"] = "summary"
+        return record
+    else:
+        raise ValueError("can not spool data type %s" % type(data_object))
+    # end if
+# end encode()
+
+def decode(record):
+    # turns a dictionary written by encode back into the
+    # model object
+    if record["type"] == "series":
+        return model.Series(record["id"])
+    elif record["type"] == "reading":
+        reading = model.Reading(record["name"], record["device_address"],
+                                record["data_address"], record["ttr"],
+                                record["raw_value"], record["series_id"],
+                                record["location_id"], record.get("timestamp"))
+        reading.set_id(record["id"])
+        if "temperature" in record:
+            reading.set_data(model.Temperature(record["temperature"]))
+        elif "emissivity" in record:
+            reading.set_data(model.Emissivity(record["emissivity"]))
+        # end if
+        return reading
+    elif record["type"] == "aggregate":
+        return model.Aggregate(*[record[field] for field in model.Aggregate.__slots__])
+    elif record["type"] == "summary":
+        return model.SeriesSummary(*[record[field] for field in model.SeriesSummary.__slots__])
+    else:
+        raise ValueError("unknown spool record type %s" % record["type"])
+    # end if
+# end decode()
+
+class Spool(object):
+    """
+        Spool - disk backed write-ahead spool for data objects
+        Constructor:
+            path - spool file. the checkpoint is kept in path + ".ckpt"
+            sync_every - fsync after this many appended objects
+            sync_interval - or after this many seconds since the
+                            last fsync, whichever comes first
+    """
+    def __init__(self, path, sync_every=100, sync_interval=1.0):
+        super(Spool, self).__init__()
+
+        self.path = path
+        self.checkpoint_path = path + ".ckpt"
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+
+        self.__lock__ = threading.Lock()
+
+        # counters
+        self.appended = 0
+        self.replayed = 0
+
+        # objects appended since the last fsync
+        self.__unsynced__ = 0
+        self.__last_sync__ = time.monotonic()
+
+        # a crash in the middle of an append can leave half a
+        # line on the end of the file. that object was never
+        # acknowledged, so it is cut off before anything else
+        # gets appended after it.
+        self.__trim_partial_line__()
+
+        self.__handle__ = open(self.path, "ab")
+        self.__checkpoint__ = self.__load_checkpoint__()
+    # end __init__()
+
+    def append(self, data_object):
+        # appends one object to the end of the spool
+        line = (json.dumps(encode(data_object)) + "\n").encode("utf-8")
+        with self.__lock__:
+            self.__handle__.write(line)
+            self.appended = self.appended + 1
+            self.__unsynced__ = self.__unsynced__ + 1
+            if (self.__unsynced__ >= self.sync_every or
+                    time.monotonic() - self.__last_sync__ >= self.sync_interval):
+                self.__sync__()
+            # end if
+        # end with
+    # end append()
+
+    def sync(self):
+        with self.__lock__:
+            self.__sync__()
+        # end with
+    # end sync()
+
+    def has_pending(self):
+        # returns True if there are objects in the spool that
+        # have not been committed to the database yet
+        with self.__lock__:
+            self.__sync__()
+            return self.__checkpoint__["offset"] < os.path.getsize(self.path)
+        # end with
+    # end has_pending()
+
+    def read_batch(self, max_objects):
+        # reads up to max_objects from the first object that has
+        # not been committed yet. returns the start and end
+        # offsets of the chunk along with the objects, the end
+        # offset gets handed back to commit() once the chunk has
+        # been written to the database.
+        # if a chunk was started but never committed, the same
+        # chunk is read again, no more and no less, so it lines
+        # up with the reading ids recorded for it.
+        with self.__lock__:
+            self.__sync__()
+            start = self.__checkpoint__["offset"]
+            stop = None
+            pending = self.__checkpoint__.get("pending")
+            if pending is not None and pending["offset"] == start:
+                stop = pending["end"]
+                max_objects = None
+            # end if
+        # end with
+
+        objects = []
+        end = start
+        with open(self.path, "rb") as handle:
+            handle.seek(start)
+            while max_objects is None or objects.__len__() < max_objects:
+                if stop is not None and end >= stop:
+                    break
+                # end if
+                line = handle.readline()
+                if not line.endswith(b"\n"):
+                    break
+                # end if
+                objects.append(decode(json.loads(line.decode("utf-8"))))
+                end = end + line.__len__()
+            # end while
+        # end with
+        return start, end, objects
+    # end read_batch()
+
+    def get_pending(self, start):
+        # returns the reading id recorded for the chunk starting
+        # at start, or None if that chunk has not been started
+        pending = self.__checkpoint__.get("pending")
+        if pending is not None and pending["offset"] == start:
+            return pending["first_id"]
+        # end if
+        return None
+    # end get_pending()
+
+    def mark_pending(self, start, end, first_id):
+        # records the first reading id a chunk is about to be
+        # written with, before it goes to the database
+        with self.__lock__:
+            self.__checkpoint__["pending"] = {"offset": start, "end": end,
+                                              "first_id": first_id}
+            self.__save_checkpoint__()
+        # end with
+    # end mark_pending()
+
+    def commit(self, end, count=0):
+        # records that everything up to end is in the database.
+        # if that is the whole file, the spool is truncated.
+        with self.__lock__:
+            self.replayed = self.replayed + count
+            self.__sync__()
+
+            # the pending chunk is cleared before any truncate, so
+            # new objects written at the top of an emptied file can
+            # never be mistaken for the chunk that was replayed.
+            self.__checkpoint__ = {"offset": end}
+            self.__save_checkpoint__()
+
+            if end >= os.path.getsize(self.path):
+                self.__handle__.truncate(0)
+                self.__handle__.seek(0)
+                os.fsync(self.__handle__.fileno())
+                self.__checkpoint__ = {"offset": 0}
+                self.__save_checkpoint__()
+            # end if
+        # end with
+    # end commit()
+
+    def close(self):
+        with self.__lock__:
+            self.__sync__()
+            self.__handle__.close()
+        # end with
+    # end close()
+
+    def get_stats(self):
+        return {"appended": self.appended, "replayed": self.replayed,
+                "size": os.path.getsize(self.path),
+                "offset": self.__checkpoint__["offset"]}
+    # end get_stats()
+
+    def __sync__(self):
+        # flushes python's buffer and fsyncs the spool file.
+        # the lock has to be held by the caller.
+        if self.__unsynced__ > 0:
+            self.__handle__.flush()
+            os.fsync(self.__handle__.fileno())
+            self.__unsynced__ = 0
+        # end if
+        self.__last_sync__ = time.monotonic()
+    # end __sync__()
+
+    def __trim_partial_line__(self):
+        # looks back from the end of the file a block at a time
+        # for the last newline, so a spool that grew large over a
+        # long outage is not read into memory
+        if not os.path.exists(self.path):
+            return
+        # end if
+        with open(self.path, "rb+") as handle:
+            end = handle.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - TRIM_BLOCK_SIZE)
+                handle.seek(start)
+                block = handle.read(position - start)
+                if position == end and block.endswith(b"\n"):
+                    return
+                # end if
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    handle.truncate(start + newline + 1)
+                    return
+                # end if
+                position = start
+            # end while
+            # no newline at all, the only line is partial
+            if end > 0:
+                handle.truncate(0)
+            # end if
+        # end with
+    # end __trim_partial_line__()
+
+    def __load_checkpoint__(self):
+        try:
+            with open(self.checkpoint_path) as handle:
+                checkpoint = json.loads(handle.read())
+            # end with
+        except (IOError, ValueError):
+            checkpoint = {"offset": 0}
+        # end try
+
+        # a checkpoint past the end of the file means the file
+        # was truncated underneath it, so start from the top.
+        if checkpoint["offset"] > os.path.getsize(self.path):
+            checkpoint = {"offset": 0}
+        # end if
+        return checkpoint
+    # end __load_checkpoint__()
+
+    def __save_checkpoint__(self):
+        # writes the checkpoint to a temporary file and renames
+        # it over the old one so it is never half written
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as handle:
+            handle.write(json.dumps(self.__checkpoint__))
+            handle.flush()
+            os.fsync(handle.fileno())
+        # end with
+        os.replace(temp_path, self.checkpoint_path)
+    # end __save_checkpoint__()
+# end Spool class
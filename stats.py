@@ -0,0 +1,129 @@
+# -----------------------------------------------------------
+# Stats module
+# purpose: running statistics that are updated in O(1) for
+# every new value, so nothing has to go back over the data
+# afterwards.
+# -----------------------------------------------------------
+import math
+
+class RunningStats(object):
+    """
+        RunningStats - count, min, max, mean and variance of a stream
+        of values. The mean and variance use Welford's method, which
+        stays accurate over long runs.
+    """
+
+    __slots__ = ("count", "minimum", "maximum", "mean", "m2")
+
+    def __init__(self):
+        self.reset()
+    # end __init__()
+
+    def reset(self):
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        self.mean = 0.0
+        self.m2 = 0.0
+    # end reset()
+
+    def add(self, value):
+        self.count = self.count + 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (value - self.mean)
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        # end if
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        # end if
+    # end add()
+
+    def get_variance(self):
+        # sample variance, 0 until there are two values
+        if self.count < 2:
+            return 0.0
+        # end if
+        return self.m2 / (self.count - 1)
+    # end get_variance()
+
+    def get_stddev(self):
+        return math.sqrt(self.get_variance())
+    # end get_stddev()
+# end RunningStats class
+
+class SeriesStats(object):
+    """
+        SeriesStats - running summary of one register over a series
+        On top of RunningStats it keeps an exponentially weighted
+        moving average and the least squares slope of the value
+        against time, all in O(1) per value.
+        Constructor:
+            alpha - weight of the newest value in the moving average
+    """
+
+    __slots__ = ("running", "alpha", "ewma", "last", "first_time", "last_time",
+                 "mean_time", "m2_time", "co_moment")
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.running = RunningStats()
+        self.reset()
+    # end __init__()
+
+    def reset(self):
+        self.running.reset()
+        self.ewma = None
+        self.last = None
+        self.first_time = None
+        self.last_time = None
+
+        # welford style sums for the slope. times are kept
+        # relative to the first one so they stay small.
+        self.mean_time = 0.0
+        self.m2_time = 0.0
+        self.co_moment = 0.0
+    # end reset()
+
+    def add(self, value, timestamp):
+        running = self.running
+        if self.first_time is None:
+            self.first_time = timestamp
+        # end if
+        elapsed = timestamp - self.first_time
+
+        # co-moment of time and value, updated with the means
+        # from before and after this value the same way m2 is
+        delta_time = elapsed - self.mean_time
+        running.add(value)
+        self.mean_time = self.mean_time + delta_time / running.count
+        self.m2_time = self.m2_time + delta_time * (elapsed - self.mean_time)
+        self.co_moment = self.co_moment + delta_time * (value - running.mean)
+
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            self.ewma = self.ewma + self.alpha * (value - self.ewma)
+        # end if
+        self.last = value
+        self.last_time = timestamp
+    # end add()
+
+    def get_slope(self):
+        # change in value per second, None until the values
+        # span some time
+        if self.m2_time <= 0:
+            return None
+        # end if
+        return self.co_moment / self.m2_time
+    # end get_slope()
+
+    def get_stats(self):
+        running = self.running
+        return {"count": running.count, "minimum": running.minimum,
+                "maximum": running.maximum, "mean": running.mean if running.count else None,
+                "stddev": running.get_stddev(), "ewma": self.ewma, "slope": self.get_slope(),
+                "last": self.last, "start": self.first_time, "end": self.last_time}
+    # end get_stats()
+# end SeriesStats class